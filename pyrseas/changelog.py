@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.changelog
+    ~~~~~~~~~~~~~~~~~
+
+    This module defines the statements that install a log of the DDL
+    commands executed in a database, using event triggers that also
+    notify listeners of each change, functions to install it and to
+    read the changes logged since a previous read, and Listener,
+    which receives the notifications.
+"""
+from __future__ import print_function
+import sys
+import json
+import time
+import select
+import threading
+
+from pgdbconn.dbconn import DbConnection
+
+from pyrseas.checkpoint import SCHEMA
+
+# Channel on which the event triggers notify the changes
+CHANNEL = 'pyrseas_ddl'
+
+# Catalogs of the objects that don't belong to a schema, other than
+# the schemas themselves
+GLOBAL_CATALOGS = [
+    'pg_extension', 'pg_language', 'pg_cast', 'pg_foreign_data_wrapper',
+    'pg_foreign_server', 'pg_user_mapping', 'pg_event_trigger']
+
+# Event trigger function logging and notifying the objects selected
+# from the function given
+LOG_FUNCTION = \
+    """CREATE OR REPLACE FUNCTION %s.%%s() RETURNS event_trigger
+           LANGUAGE plpgsql AS $$
+       DECLARE
+           obj record;
+       BEGIN
+           FOR obj IN SELECT %%s
+           LOOP
+               CONTINUE WHEN obj.schema_name IS NOT DISTINCT FROM '%s';
+               INSERT INTO %s.ddl_log (classid, objid, schema_name, command)
+               VALUES (obj.classid, obj.objid, obj.schema_name, obj.command);
+               PERFORM pg_notify('%s', json_build_object(
+                   'catalog', obj.classid::regclass::text,
+                   'schema_name', obj.schema_name,
+                   'identity', obj.object_identity,
+                   'command', obj.command)::text);
+           END LOOP;
+       END $$""" % (SCHEMA, SCHEMA, SCHEMA, CHANNEL)
+
+INSTALL_STMTS = [
+    "CREATE SCHEMA IF NOT EXISTS %s" % SCHEMA,
+    """CREATE TABLE IF NOT EXISTS %s.ddl_log (
+           id bigserial PRIMARY KEY,
+           txid bigint NOT NULL DEFAULT txid_current(),
+           classid oid NOT NULL,
+           objid oid NOT NULL,
+           schema_name text,
+           command text NOT NULL,
+           logged timestamp with time zone NOT NULL DEFAULT now())"""
+    % SCHEMA,
+    """CREATE INDEX IF NOT EXISTS ddl_log_txid_idx
+           ON %s.ddl_log (txid)""" % SCHEMA,
+    LOG_FUNCTION % ('log_ddl', """classid, objid,
+                  CASE WHEN object_type = 'schema'
+                       THEN (SELECT nspname FROM pg_namespace
+                             WHERE oid = objid)
+                       ELSE schema_name END AS schema_name,
+                  command_tag AS command, object_identity
+           FROM pg_event_trigger_ddl_commands()"""),
+    LOG_FUNCTION % ('log_drop', """classid, objid,
+                  CASE WHEN object_type = 'schema' THEN object_name
+                       ELSE schema_name END AS schema_name,
+                  'DROP ' || upper(object_type) AS command,
+                  object_identity
+           FROM pg_event_trigger_dropped_objects()"""),
+    "DROP EVENT TRIGGER IF EXISTS pyrseas_ddl_end",
+    """CREATE EVENT TRIGGER pyrseas_ddl_end ON ddl_command_end
+           EXECUTE PROCEDURE %s.log_ddl()""" % SCHEMA,
+    "DROP EVENT TRIGGER IF EXISTS pyrseas_sql_drop",
+    """CREATE EVENT TRIGGER pyrseas_sql_drop ON sql_drop
+           EXECUTE PROCEDURE %s.log_drop()""" % SCHEMA]
+
+TRIGGERS_QUERY = \
+    """SELECT count(*) FROM pg_event_trigger
+       WHERE evtname IN ('pyrseas_ddl_end', 'pyrseas_sql_drop')
+             AND evtenabled != 'D'"""
+
+HORIZON_QUERY = "SELECT txid_snapshot_xmin(txid_current_snapshot())"
+
+CHANGES_QUERY = \
+    """SELECT classid::regclass::text AS catalog, schema_name
+       FROM %s.ddl_log WHERE txid >= %%s""" % SCHEMA
+
+
+def install(dbconn):
+    """Install the DDL log and its event triggers, and commit
+
+    :param dbconn: a DbConnection object
+
+    Event triggers can only be created by a superuser, on PostgreSQL
+    9.5 or later.  Installing the log again replaces its functions
+    and triggers, keeping the entries logged.
+    """
+    for stmt in INSTALL_STMTS:
+        dbconn.execute(stmt)
+    dbconn.commit()
+
+
+def notifying(dbconn):
+    """Return whether the event triggers notifying the changes are enabled
+
+    :param dbconn: a DbConnection object
+    :return: boolean
+    """
+    try:
+        row = dbconn.fetchone(TRIGGERS_QUERY)
+    except Exception:
+        # e.g., before PostgreSQL 9.3, without pg_event_trigger
+        return False
+    dbconn.rollback()
+    return row[0] == 2
+
+
+def changes(dbconn, since=None):
+    """Return the changes logged since a previous call
+
+    :param dbconn: a DbConnection object
+    :param since: horizon returned by the previous call (None to only
+        return the current horizon)
+    :return: tuple of horizon to pass to the next call, set of schema
+        names changed (None if some changes cannot be attributed to a
+        schema) and whether database-wide objects have changed
+
+    The log is read by transaction rather than by entry: the horizon
+    is the oldest transaction still running, whose entries, if any,
+    are not visible yet.  Entries of transactions that had finished
+    by the previous call but had started after its horizon are read
+    again, which is harmless.
+    """
+    horizon = dbconn.fetchone(HORIZON_QUERY)[0]
+    rows = [] if since is None else dbconn.fetchall(CHANGES_QUERY, (since, ))
+    dbconn.rollback()
+    return (horizon, ) + classify(rows)
+
+
+def classify(rows):
+    """Return the schemas named by entries of the log or notifications
+
+    :param rows: list of dictionaries holding a `catalog` and a
+        `schema_name`
+    :return: tuple of set of schema names changed (None if some
+        changes cannot be attributed to a schema) and whether
+        database-wide objects have changed
+    """
+    schemas = set()
+    dbwide = False
+    for row in rows:
+        if row['schema_name'] is not None:
+            schemas.add(row['schema_name'])
+        elif row['catalog'] in GLOBAL_CATALOGS:
+            dbwide = True
+        else:
+            # e.g., GRANT, which isn't reported with the object's schema
+            schemas = None
+            break
+    return (schemas, dbwide)
+
+
+class Listener(threading.Thread):
+    """Listens for the changes notified by the event triggers
+
+    The callback is called with the list of notifications received
+    together, each a dictionary holding the `catalog`, `schema_name`,
+    `identity` and `command` of an object changed, and with None
+    whenever the listener (re)connects, since notifications may have
+    been missed while it wasn't listening.  The connection is retried
+    if it fails.  Notifications are only sent when the transaction
+    that made the changes commits.
+    """
+
+    daemon = True
+    retry = 5
+
+    def __init__(self, dbcfg, callback):
+        """Initialize the listener
+
+        :param dbcfg: database configuration dictionary
+        :param callback: function to call with the notifications
+        """
+        super(Listener, self).__init__(name="listener %s" % dbcfg['dbname'])
+        self.dbconn = DbConnection(dbcfg['dbname'], dbcfg['username'],
+                                   dbcfg['password'], dbcfg['host'],
+                                   dbcfg['port'])
+        self.callback = callback
+        self.listening = False
+
+    def _listen(self):
+        self.dbconn.execute("LISTEN %s" % CHANNEL)
+        self.dbconn.commit()
+        self.listening = True
+        self.callback(None)
+        conn = self.dbconn.conn
+        while True:
+            select.select([conn], [], [])
+            conn.poll()
+            notifies = []
+            while conn.notifies:
+                notifies.append(json.loads(conn.notifies.pop(0).payload))
+            if notifies:
+                self.callback(notifies)
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except (Exception, SystemExit) as exc:
+                if self.listening:
+                    print("Stopped listening on %s: %s" % (
+                        self.dbconn.dbname, exc), file=sys.stderr)
+                self.listening = False
+                self.dbconn.close()
+                time.sleep(self.retry)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.checkpoint
+    ~~~~~~~~~~~~~~~~~~
+
+    This module defines Checkpoint, which records the statements
+    executed outside the transaction in a bookkeeping table, so that
+    an interrupted run can be resumed without repeating them, and
+    functions to record and check the specification last applied.
+"""
+from __future__ import print_function
+import hashlib
+
+from pyrseas.yamlutil import yamldump
+
+SCHEMA = 'pyrseas'
+
+SCHEMA_QUERY = "SELECT 1 FROM pg_namespace WHERE nspname = %s"
+
+CREATE_STMTS = [
+    """CREATE TABLE IF NOT EXISTS %s.checkpoint (
+           spec_hash text NOT NULL,
+           stmt_hash text NOT NULL,
+           statement text NOT NULL,
+           applied timestamp with time zone NOT NULL DEFAULT now(),
+           PRIMARY KEY (spec_hash, stmt_hash))""" % SCHEMA,
+    """CREATE TABLE IF NOT EXISTS %s.applied (
+           spec_hash text NOT NULL,
+           catalog_hash text NOT NULL,
+           applied timestamp with time zone NOT NULL DEFAULT now())"""
+    % SCHEMA]
+
+APPLIED_QUERY = \
+    "SELECT stmt_hash FROM %s.checkpoint WHERE spec_hash = %%s" % SCHEMA
+
+RECORD_STMT = \
+    """INSERT INTO %s.checkpoint (spec_hash, stmt_hash, statement)
+       SELECT * FROM (VALUES (%%s, %%s, %%s))
+                     AS new (spec_hash, stmt_hash, statement)
+       WHERE NOT EXISTS (SELECT 1 FROM %s.checkpoint c
+                         WHERE c.spec_hash = new.spec_hash
+                               AND c.stmt_hash = new.stmt_hash)""" % (
+        SCHEMA, SCHEMA)
+
+CLEAR_STMT = "DELETE FROM %s.checkpoint WHERE spec_hash = %%s" % SCHEMA
+
+# Catalogs whose rows define the objects compared by yamltodb.  Any
+# change to a row gives it a new transaction id (xmin), so hashing the
+# ids detects the changes without extracting the objects.
+FINGERPRINT_CATALOGS = [
+    'pg_namespace', 'pg_class', 'pg_attribute', 'pg_attrdef',
+    'pg_constraint', 'pg_index', 'pg_inherits', 'pg_type', 'pg_enum',
+    'pg_proc', 'pg_aggregate', 'pg_operator', 'pg_opclass', 'pg_opfamily',
+    'pg_trigger', 'pg_rewrite', 'pg_description', 'pg_language', 'pg_cast',
+    'pg_collation', 'pg_conversion', 'pg_extension', 'pg_ts_config',
+    'pg_ts_dict', 'pg_ts_parser', 'pg_ts_template', 'pg_foreign_data_wrapper',
+    'pg_foreign_server', 'pg_user_mapping', 'pg_foreign_table',
+    'pg_event_trigger', 'pg_depend']
+
+# The parameters of the sequences are kept in pg_sequence on
+# PostgreSQL 10 or later, and before that in each sequence, where
+# ALTER SEQUENCE updates them in place, so they are hashed themselves
+SEQUENCES_QUERY = \
+    """SELECT string_agg(query_to_xml(
+                  CASE WHEN current_setting('server_version_num')::integer
+                            >= 100000
+                       THEN 'SELECT seqstart, seqincrement, seqmax, seqmin,
+                                    seqcache, seqcycle
+                             FROM pg_catalog.pg_sequence
+                             WHERE seqrelid = ' || oid
+                       ELSE 'SELECT start_value, increment_by, max_value,
+                                    min_value, cache_value, is_cycled
+                             FROM ' || oid::regclass::text END,
+                  false, false, '')::text, ',' ORDER BY oid) AS xmins
+       FROM pg_catalog.pg_class WHERE relkind = 'S'"""
+
+FINGERPRINT_QUERY = "SELECT md5(string_agg(xmins, ';')) FROM (%s) cats" % (
+    " UNION ALL ".join(
+        ["SELECT string_agg(xmin::text, ',' ORDER BY ctid) AS xmins "
+         "FROM pg_catalog.%s" % cat for cat in FINGERPRINT_CATALOGS] +
+        [SEQUENCES_QUERY]))
+
+UNCHANGED_QUERY = \
+    """SELECT spec_hash = %%s AND catalog_hash = (%s)
+       FROM %s.applied""" % (FINGERPRINT_QUERY, SCHEMA)
+
+
+def _sha1(text):
+    """Return the hexadecimal SHA-1 digest of a string
+
+    :param text: string
+    :return: string
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def spec_hash(input_map):
+    """Return a hash identifying a YAML specification
+
+    :param input_map: a YAML map defining the new database
+    :return: string
+
+    The map is dumped with its keys sorted, so that the hash does not
+    depend on the order or formatting of the input files.
+    """
+    return _sha1(yamldump(input_map))
+
+
+def stmt_hash(stmt):
+    """Return a hash identifying a statement
+
+    :param stmt: SQL statement
+    :return: string
+    """
+    return _sha1(stmt)
+
+
+def create_tables(dbconn):
+    """Create the bookkeeping schema and tables if they don't exist
+
+    :param dbconn: a DbConnection object
+
+    The schema is looked up first, since ``CREATE SCHEMA IF NOT
+    EXISTS`` requires PostgreSQL 9.3 or later.
+    """
+    if dbconn.fetchone(SCHEMA_QUERY, (SCHEMA, )) is None:
+        dbconn.execute("CREATE SCHEMA %s" % SCHEMA)
+    for stmt in CREATE_STMTS:
+        dbconn.execute(stmt)
+
+
+class Checkpoint(object):
+    """Records the statements applied outside the transaction
+
+    The hashes of the statements executed successfully are recorded,
+    each in its own transaction, in the ``pyrseas.checkpoint`` table,
+    together with the hash of the specification they were generated
+    from.  If a run is interrupted, e.g., by a failed ``CREATE INDEX
+    CONCURRENTLY`` or a lost connection, the statements are generated
+    again from the differences that remain and, when the same
+    specification is applied, those already recorded are skipped.
+    Once a run completes, its entries are cleared, so that a later run
+    with the same specification generates and executes all the
+    statements needed then.
+
+    A ``Backfill`` interrupted partway is not resumed: the column
+    already exists, so the differences that remain don't include the
+    batches filling it, and making it NOT NULL fails while rows are
+    still to be filled.
+    """
+
+    def __init__(self, spec):
+        """Initialize the checkpoint
+
+        :param spec: hash of the specification, from :func:`spec_hash`
+        """
+        self.spec = spec
+        self._applied = set()
+
+    def load(self, dbconn):
+        """Create the bookkeeping table if needed and fetch its entries
+
+        :param dbconn: a DbConnection object
+        """
+        create_tables(dbconn)
+        self._applied = set(row[0] for row in dbconn.fetchall(
+            APPLIED_QUERY, (self.spec, )))
+        dbconn.commit()
+
+    def applied(self, stmt):
+        """Return whether a statement has already been applied
+
+        :param stmt: SQL statement
+        :return: boolean
+        """
+        return stmt_hash(stmt) in self._applied
+
+    def record(self, dbconn, stmt):
+        """Record that a statement has been applied and commit
+
+        :param dbconn: a DbConnection object
+        :param stmt: SQL statement
+        """
+        digest = stmt_hash(stmt)
+        dbconn.execute(RECORD_STMT, (self.spec, digest, stmt))
+        dbconn.commit()
+        self._applied.add(digest)
+
+    def clear(self, dbconn):
+        """Remove the entries of the specification and commit
+
+        :param dbconn: a DbConnection object
+
+        Called when a run completes, since the entries are only needed
+        to resume an interrupted run.
+        """
+        dbconn.execute(CLEAR_STMT, (self.spec, ))
+        dbconn.commit()
+        self._applied = set()
+
+
+def unchanged(dbconn, spec):
+    """Return whether a specification was the last applied, unchanged
+
+    :param dbconn: a DbConnection object
+    :param spec: hash of the specification, from :func:`spec_hash`
+    :return: boolean
+
+    The specification must be the one last recorded by
+    :func:`record_applied` and the catalogs must not have changed
+    since.  The check is a single query, which fails if the
+    bookkeeping table doesn't exist.
+    """
+    try:
+        row = dbconn.fetchone(UNCHANGED_QUERY, (spec, ))
+    except Exception:
+        # the connection has been rolled back
+        return False
+    dbconn.commit()
+    return bool(row and row[0])
+
+
+def record_applied(dbconn, spec):
+    """Record a specification as applied, with the current catalogs
+
+    :param dbconn: a DbConnection object
+    :param spec: hash of the specification, from :func:`spec_hash`
+    """
+    create_tables(dbconn)
+    dbconn.execute("DELETE FROM %s.applied" % SCHEMA)
+    dbconn.execute("INSERT INTO %s.applied (spec_hash, catalog_hash) "
+                   "SELECT %%s, (%s)" % (SCHEMA, FINGERPRINT_QUERY), (spec, ))
+    dbconn.commit()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.costs
+    ~~~~~~~~~~~~~
+
+    This module classifies the generated SQL statements by the work
+    they cause PostgreSQL to do on the existing rows of a table.
+"""
+import re
+
+from pyrseas.dbobject import NonTransactional, quote_id
+from pyrseas.dbobject.column import METADATA_ONLY, VERIFY_SCAN, FULL_REWRITE
+from pyrseas.dbobject.column import CONSTANT_DEFAULT, volatile_default
+from pyrseas.lockplan import REL
+
+INDEX_BUILD = 'index-build'
+
+# From cheapest to most expensive
+COST_CLASSES = (METADATA_ONLY, VERIFY_SCAN, INDEX_BUILD, FULL_REWRITE)
+
+ALTER_TABLE = re.compile(r'ALTER TABLE (?:ONLY )?' + REL + r'\s')
+ALTER_TYPE = re.compile(r'\bALTER COLUMN (\S+) TYPE ')
+ADD_DEFAULT = re.compile(r'\bADD COLUMN \S+ .*?\bDEFAULT (.*?)'
+                         r'(?: COLLATE "[^"]*")?,?$', re.MULTILINE)
+SET_NOT_NULL = re.compile(r'\bSET NOT NULL\b')
+ADD_INDEX = re.compile(r'\bADD CONSTRAINT \S+ (?:PRIMARY KEY|UNIQUE) \(')
+ADD_CHECK = re.compile(r'\bADD CONSTRAINT \S+ (?:CHECK|FOREIGN KEY) '
+                       r'(?!.*\bNOT VALID$)', re.MULTILINE)
+VALIDATE = re.compile(r'\bVALIDATE CONSTRAINT ')
+SET_TABLESPACE = re.compile(r'\bSET TABLESPACE ')
+
+OTHER_STMTS = [(re.compile(pattern, re.DOTALL), cls) for (pattern, cls) in [
+    (r'CREATE (?:UNIQUE )?INDEX .*? ON (?:ONLY )?' + REL, INDEX_BUILD),
+    (r'CLUSTER ' + REL, FULL_REWRITE),
+    (r'REFRESH MATERIALIZED VIEW (?:CONCURRENTLY )?' + REL, FULL_REWRITE),
+    (r'(?:DO|WITH)\b.*?\bUPDATE ' + REL, FULL_REWRITE)]]
+
+
+def _alter_table_cost(stmt, rel, type_changes, version, volatile):
+    """Return the cost class of an ALTER TABLE statement
+
+    :param stmt: SQL statement
+    :param rel: relation altered, as in the statement
+    :param type_changes: list of column type changes
+    :param version: server version number
+    :param volatile: set of names of the volatile functions, or None
+    :return: cost class
+    """
+    costs = [METADATA_ONLY]
+    for match in ALTER_TYPE.finditer(stmt):
+        cls = FULL_REWRITE
+        for (tbl, col, oldtype, newtype, tccls) in type_changes:
+            if tbl == rel and quote_id(col) == match.group(1):
+                cls = tccls
+        costs.append(cls)
+    for match in ADD_DEFAULT.finditer(stmt):
+        if version < 110000:
+            costs.append(FULL_REWRITE)
+        elif volatile is None:
+            if not CONSTANT_DEFAULT.match(match.group(1)):
+                costs.append(FULL_REWRITE)
+        elif volatile_default(match.group(1), volatile):
+            costs.append(FULL_REWRITE)
+    if SET_TABLESPACE.search(stmt):
+        costs.append(FULL_REWRITE)
+    if ADD_INDEX.search(stmt):
+        costs.append(INDEX_BUILD)
+    if ADD_CHECK.search(stmt) or VALIDATE.search(stmt):
+        costs.append(VERIFY_SCAN)
+    # after the transaction, SET NOT NULL follows a validated CHECK
+    # constraint, which PostgreSQL 12 or later uses to skip the scan
+    if SET_NOT_NULL.search(stmt) and not (
+            isinstance(stmt, NonTransactional) and version >= 120000):
+        costs.append(VERIFY_SCAN)
+    return max(costs, key=COST_CLASSES.index)
+
+
+def estimate_cost(stmt, type_changes=(), version=0, volatile=None):
+    """Classify a statement by the work done on the rows of a table
+
+    :param stmt: SQL statement or data copy tuple
+    :param type_changes: list of column type changes, as recorded in
+        `Database.type_changes`
+    :param version: server version number
+    :param volatile: set of names of the volatile functions, if known
+        (otherwise only literal defaults are taken to be stored
+        without a rewrite)
+    :return: tuple of cost class and relation affected, if any
+
+    The classes are: METADATA_ONLY, when only the catalogs are
+    changed, VERIFY_SCAN, when the table is read to check that its
+    rows satisfy a constraint, INDEX_BUILD, when the table is read and
+    sorted to build an index, and FULL_REWRITE, when every row is
+    written anew.  The relation is given as in the statement.
+    """
+    if isinstance(stmt, tuple):
+        return (METADATA_ONLY, None)
+    match = ALTER_TABLE.match(stmt)
+    if match:
+        rel = match.group(1)
+        return (_alter_table_cost(stmt, rel, type_changes, version,
+                                  volatile), rel)
+    for (pattern, cls) in OTHER_STMTS:
+        match = pattern.match(stmt)
+        if match:
+            return (cls, match.group(1))
+    return (METADATA_ONLY, None)
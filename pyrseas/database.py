@@ -11,22 +11,36 @@
     on the `input_map` supplied to the `from_map` method.
 """
 import os
+import re
 import sys
+import multiprocessing
+from copy import copy
 from operator import itemgetter
 from collections import defaultdict, deque
 import yaml
 
 from pgdbconn.dbconn import DbConnection
 
+from pyrseas.lib.pycompat import strtypes
 from pyrseas.yamlutil import yamldump
+from pyrseas.costs import estimate_cost
+from pyrseas.checkpoint import SCHEMA as BOOKKEEPING_SCHEMA
 from pyrseas.dbobject import fetch_reserved_words, DbObjectDict, DbSchemaObject
+from pyrseas.dbobject import NonTransactional, stmt_phase
+from pyrseas.dbobject import PRE_TRANSACTION, TRANSACTION, POST_TRANSACTION
 from pyrseas.dbobject.language import LanguageDict
 from pyrseas.dbobject.cast import CastDict
 from pyrseas.dbobject.schema import SchemaDict
-from pyrseas.dbobject.dbtype import TypeDict
-from pyrseas.dbobject.table import ClassDict
-from pyrseas.dbobject.column import ColumnDict
+from pyrseas.dbobject.dbtype import TypeDict, Enum, Domain
+from pyrseas.dbobject.table import ClassDict, DbClass
+from pyrseas.dbobject.column import ColumnDict, BINARY_CASTS_QUERY
+from pyrseas.dbobject.column import classify_type_change
+from pyrseas.dbobject.column import BACKFILL_BATCH, VOLATILE_FUNCTIONS_QUERY
+from pyrseas.dbobject.column import volatile_default
+from pyrseas.dbobject.column import METADATA_ONLY
 from pyrseas.dbobject.constraint import ConstraintDict
+from pyrseas.dbobject.constraint import CheckConstraint, ForeignKey
+from pyrseas.dbobject.constraint import PrimaryKey, UniqueConstraint
 from pyrseas.dbobject.index import IndexDict
 from pyrseas.dbobject.function import ProcDict
 from pyrseas.dbobject.operator import OperatorDict
@@ -55,9 +69,377 @@ def flatten(lst):
             yield elem
 
 
+def _find(parent, node):
+    """Return the representative of a node in a disjoint-set forest
+
+    :param parent: dictionary mapping each node to its parent
+    :param node: node to look up (added as a singleton if missing)
+    :return: root node
+    """
+    root = node
+    while parent.setdefault(root, root) != root:
+        root = parent[root]
+    while node != root:
+        (node, parent[node]) = (parent[node], root)
+    return root
+
+
+def _union(parent, node1, node2):
+    """Merge the sets of two nodes in a disjoint-set forest
+
+    :param parent: dictionary mapping each node to its parent
+    :param node1: first node
+    :param node2: second node
+    """
+    (root1, root2) = (_find(parent, node1), _find(parent, node2))
+    if root1 != root2:
+        parent[root2] = root1
+
+
+def _dep_cycles(ein):
+    """Find the dependency cycles left over by a topological sort
+
+    :param ein: dictionary mapping each unsorted object to the set of
+        objects it depends on
+    :return: list of cycles, each a list of objects starting and
+        ending with the same object
+
+    The strongly connected components of the graph are found with
+    (a non-recursive version of) Tarjan's algorithm.  For each
+    component with more than one object, or with an object depending
+    on itself, one of the cycles through its objects is returned.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    onstack = set()
+    sccs = []
+    for root in ein:
+        if root in index:
+            continue
+        work = [(root, iter(ein[root]))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        while work:
+            (node, deps) = work[-1]
+            for dep in deps:
+                if dep not in ein:
+                    continue
+                if dep not in index:
+                    index[dep] = lowlink[dep] = len(index)
+                    stack.append(dep)
+                    onstack.add(dep)
+                    work.append((dep, iter(ein[dep])))
+                    break
+                elif dep in onstack:
+                    lowlink[node] = min(lowlink[node], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    scc = set()
+                    while True:
+                        obj = stack.pop()
+                        onstack.discard(obj)
+                        scc.add(obj)
+                        if obj == node:
+                            break
+                    if len(scc) > 1 or node in ein[node]:
+                        sccs.append((node, scc))
+
+    cycles = []
+    for (node, scc) in sccs:
+        path = [node]
+        seen = {node: 0}
+        while True:
+            node = min([dep for dep in ein[node] if dep in scc],
+                       key=lambda obj: (obj.objtype, obj.identifier()))
+            if node in seen:
+                cycles.append(path[seen[node]:] + [node])
+                break
+            seen[node] = len(path)
+            path.append(node)
+    return cycles
+
+
+ALTER_TABLE = re.compile(
+    r'ALTER (TABLE|FOREIGN TABLE) ((?:"(?:[^"]|"")+"|[^\s".]+)'
+    r'(?:\.(?:"(?:[^"]|"")+"|[^\s".]+))?)\s+(.*)\Z', re.DOTALL)
+NOT_COALESCED = re.compile(r'(RENAME|SET SCHEMA)\b')
+
+
+def coalesce_alters(stmts):
+    """Merge consecutive ALTER TABLE statements on the same table
+
+    :param stmts: iterable of SQL statements
+    :return: generator of SQL statements
+
+    Each ALTER TABLE takes its own ACCESS EXCLUSIVE lock and may
+    rewrite the table, so subcommands on the same table are combined
+    into a single statement, e.g., ``ALTER TABLE t1 ADD COLUMN c3
+    text, ALTER COLUMN c2 TYPE bigint``.  Only adjacent statements are
+    merged, so the order of execution relative to other statements is
+    unchanged, except for COMMENT statements between them, which are
+    postponed after the merged statement.  RENAME and SET SCHEMA,
+    which cannot be combined with other subcommands, and statements to
+    be executed before the transaction are left alone.  Those to be
+    executed after it, e.g., to validate a constraint or fill a column
+    added online, are postponed to the end, so they don't separate the
+    statements on their table: they are only executed once the
+    transaction is committed anyway.
+    """
+    pending = None
+    comments = []
+    post = []
+    for stmt in stmts:
+        match = None
+        if stmt_phase(stmt) == POST_TRANSACTION:
+            post.append(stmt)
+            continue
+        if isinstance(stmt, strtypes) and stmt_phase(stmt) == TRANSACTION:
+            if pending and stmt.startswith('COMMENT ON '):
+                comments.append(stmt)
+                continue
+            match = ALTER_TABLE.match(stmt)
+            if match and NOT_COALESCED.match(match.group(3)):
+                match = None
+        if match and pending and pending[0] == match.group(1, 2):
+            pending[1].append(match.group(3))
+            continue
+        if pending:
+            yield _merged_alter(*pending)
+            for comment in comments:
+                yield comment
+        pending = None
+        comments = []
+        if match:
+            pending = (match.group(1, 2), [match.group(3)], stmt)
+        else:
+            yield stmt
+    if pending:
+        yield _merged_alter(*pending)
+        for comment in comments:
+            yield comment
+    for stmt in post:
+        yield stmt
+
+
+def _merged_alter(target, subcmds, stmt):
+    """Return an ALTER TABLE statement with one or more subcommands
+
+    :param target: tuple of relation kind and name
+    :param subcmds: list of subcommands
+    :param stmt: the original statement, returned if only one subcommand
+    :return: SQL statement
+    """
+    if len(subcmds) == 1:
+        return stmt
+    return "ALTER %s %s\n    %s" % (target + (",\n    ".join(subcmds), ))
+
+
+def _mark_online(obj, stmts):
+    """Mark the statements for an index to be built or dropped online
+
+    :param obj: the object the statements are for
+    :param stmts: iterable of SQL statements
+    :return: list of SQL statements
+    """
+    if getattr(obj, '_online', False):
+        return [NonTransactional(stmt) for stmt in stmts]
+    return list(stmts)
+
+
+def _relations(obj):
+    """Return the keys of the tables or other relations affected by an object
+
+    :param obj: the object whose statements are to be executed
+    :return: list of (schema, relation name) tuples
+    """
+    if isinstance(obj, DbClass):
+        return [(obj.schema, obj.name)]
+    rels = []
+    if 'table' in obj.keylist:
+        rels.append((obj.schema, obj.table))
+    if getattr(obj, 'ref_table', None) is not None:
+        rels.append((getattr(obj, 'ref_schema', None) or obj.schema,
+                     obj.ref_table))
+    return rels
+
+
+def _level_groups(objstmts):
+    """Group the statements for objects in the same dependency level
+
+    :param objstmts: list of (object, list of statements) tuples
+    :return: list of lists of statements
+
+    The statements for objects affecting the same relations are
+    concatenated, in the original order, in a single group.
+    """
+    parent = {}
+    for (obj, stmts) in objstmts:
+        if stmts:
+            _find(parent, obj)
+            for rel in _relations(obj):
+                _union(parent, obj, rel)
+    groups = []
+    index = {}
+    for (obj, stmts) in objstmts:
+        if stmts:
+            root = _find(parent, obj)
+            if root not in index:
+                index[root] = len(groups)
+                groups.append([])
+            groups[index[root]].extend(stmts)
+    return groups
+
+
+def _fork_context():
+    """Return a multiprocessing context that forks worker processes
+
+    :return: context (or module) object, or None if forking is unavailable
+    """
+    if sys.platform == 'win32':
+        return None
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks on POSIX platforms
+        return multiprocessing
+    except ValueError:
+        return None
+
+
+# State shared with the worker processes of a parallel diff.  It is set
+# just before forking, so the workers inherit the loaded databases
+# instead of receiving them pickled.
+_diff_state = None
+
+
+def _diff_component(comp):
+    """Generate the SQL for one component of the dependency graph
+
+    :param comp: index of the component in the shared state
+    :return: tuple of two lists of (position, statements) tuples
+
+    This runs in a worker process started by `Database._diff_parallel`.
+    """
+    (db, new_objs, old_objs, comps) = _diff_state
+    (newpos, oldpos) = comps[comp]
+    return ([(i, list(flatten([db._diff_new(new_objs[i])]))) for i in newpos],
+            [(i, list(flatten(db._diff_old(old_objs[i])))) for i in oldpos])
+
+
+LANG_TEMPLATES_QUERY = "SELECT tmplname FROM pg_pltemplate"
+
+SCHEMAS_QUERY = \
+    """SELECT nspname FROM pg_namespace
+       WHERE nspname NOT IN ('information_schema', 'pg_catalog', 'pg_toast')
+             AND nspname NOT LIKE 'pg_temp\_%'
+             AND nspname NOT LIKE 'pg_toast_temp\_%'"""
+
+# Dependencies between user objects, reduced to their respective
+# schemas.  Objects that are not in any schema map to NULL.
+SCHEMA_DEPS_QUERY = \
+    """WITH objs (classid, objid, nsp) AS (
+           SELECT 'pg_class'::regclass, oid, relnamespace FROM pg_class
+           UNION ALL SELECT 'pg_type'::regclass, oid, typnamespace
+                     FROM pg_type
+           UNION ALL SELECT 'pg_proc'::regclass, oid, pronamespace
+                     FROM pg_proc
+           UNION ALL SELECT 'pg_constraint'::regclass, oid, connamespace
+                     FROM pg_constraint
+           UNION ALL SELECT 'pg_operator'::regclass, oid, oprnamespace
+                     FROM pg_operator
+           UNION ALL SELECT 'pg_opclass'::regclass, oid, opcnamespace
+                     FROM pg_opclass
+           UNION ALL SELECT 'pg_opfamily'::regclass, oid, opfnamespace
+                     FROM pg_opfamily
+           UNION ALL SELECT 'pg_conversion'::regclass, oid, connamespace
+                     FROM pg_conversion
+           UNION ALL SELECT 'pg_collation'::regclass, oid, collnamespace
+                     FROM pg_collation
+           UNION ALL SELECT 'pg_ts_config'::regclass, oid, cfgnamespace
+                     FROM pg_ts_config
+           UNION ALL SELECT 'pg_ts_dict'::regclass, oid, dictnamespace
+                     FROM pg_ts_dict
+           UNION ALL SELECT 'pg_ts_parser'::regclass, oid, prsnamespace
+                     FROM pg_ts_parser
+           UNION ALL SELECT 'pg_ts_template'::regclass, oid, tmplnamespace
+                     FROM pg_ts_template
+           UNION ALL SELECT 'pg_attrdef'::regclass, a.oid, relnamespace
+                     FROM pg_attrdef a JOIN pg_class c ON (adrelid = c.oid)
+           UNION ALL SELECT 'pg_trigger'::regclass, t.oid, relnamespace
+                     FROM pg_trigger t JOIN pg_class c ON (tgrelid = c.oid)
+           UNION ALL SELECT 'pg_rewrite'::regclass, r.oid, relnamespace
+                     FROM pg_rewrite r JOIN pg_class c ON (ev_class = c.oid)
+           UNION ALL SELECT 'pg_namespace'::regclass, oid, oid
+                     FROM pg_namespace)
+       SELECT DISTINCT n1.nspname AS schema, n2.nspname AS refschema
+       FROM pg_depend d
+            LEFT JOIN objs o1 ON (d.classid, d.objid) = (o1.classid, o1.objid)
+            LEFT JOIN objs o2
+                 ON (d.refclassid, d.refobjid) = (o2.classid, o2.objid)
+            LEFT JOIN pg_namespace n1 ON (o1.nsp = n1.oid)
+            LEFT JOIN pg_namespace n2 ON (o2.nsp = n2.oid)
+       WHERE deptype != 'p' AND objid >= 16384 AND refobjid >= 16384"""
+
+QUALIFIER = re.compile(r'("[^"]+"|\w+)\.')
+WORD = re.compile(r'\w+')
+
+
+def _map_references(objmap, schemas, pubnames, globnames):
+    """Find the schemas and database-wide objects referenced in a map
+
+    :param objmap: a YAML (sub)map
+    :param schemas: set of all schema names
+    :param pubnames: set of names of objects in the 'public' schema
+    :param globnames: set of names of database-wide objects
+    :return: set of schema names, including None for database-wide
+        objects
+    """
+    refs = set()
+    todo = [objmap]
+    while todo:
+        obj = todo.pop()
+        if isinstance(obj, dict):
+            for (key, val) in list(obj.items()):
+                if key in ('schema', 'oldname') and \
+                        isinstance(val, strtypes) and val in schemas:
+                    refs.add(val)
+                todo.extend([key, val])
+        elif isinstance(obj, list):
+            todo.extend(obj)
+        elif isinstance(obj, strtypes):
+            for qual in QUALIFIER.findall(obj):
+                qual = qual.strip('"')
+                if qual in schemas:
+                    refs.add(qual)
+            words = set(WORD.findall(obj))
+            if words & pubnames:
+                refs.add('public')
+            if words & globnames:
+                refs.add(None)
+    return refs
+
+
 class CatDbConnection(DbConnection):
     """A database connection, specialized for querying catalogs"""
 
+    catalog_schemas = None
+    """Schema names to which catalog queries are restricted (None for all)
+    """
+
+    catalog_global = True
+    """Whether restricted catalog queries fetch database-wide objects
+    """
+
+    keep_open = False
+    """Whether the connection is left open after reading the catalogs
+    """
+
     def connect(self):
         """Connect to the database"""
         super(CatDbConnection, self).connect()
@@ -193,16 +575,25 @@ class Database(object):
             rv = self.tables.find(name)
             return rv
 
-    def __init__(self, config):
+    def __init__(self, config, dbconn=None):
         """Initialize the database
 
         :param config: configuration dictionary
+        :param dbconn: catalog connection to use, instead of one to the
+            configured database
         """
-        db = config['database']
-        self.dbconn = CatDbConnection(db['dbname'], db['username'],
-                                      db['password'], db['host'], db['port'])
+        if dbconn is None:
+            db = config['database']
+            dbconn = CatDbConnection(db['dbname'], db['username'],
+                                     db['password'], db['host'], db['port'])
+        self.dbconn = dbconn
         self.db = None
         self.config = config
+        self.type_changes = []
+        self.costs = []
+        self._binary_casts = None
+        self._volatile = None
+        self._relsizes = {}
 
     def _link_refs(self, db):
         """Link related objects"""
@@ -332,6 +723,27 @@ class Database(object):
         self.db.languages = LanguageDict()
         self.db.casts = CastDict()
 
+    def _hide_bookkeeping(self):
+        """Remove the objects that Pyrseas uses for its own bookkeeping
+
+        The schema is created by ``yamltodb --checkpoint`` or when the
+        DDL log (see :mod:`pyrseas.changelog`) is installed and, like
+        the event triggers of the latter, is neither output nor
+        dropped for not being in the input map.
+        """
+        prefix = BOOKKEEPING_SCHEMA + '.'
+        for (key, trig) in list(self.db.eventtrigs.items()):
+            if trig.procedure.startswith(prefix):
+                del self.db.eventtrigs[key]
+        if BOOKKEEPING_SCHEMA not in self.db.schemas:
+            return
+        for objtype in ['tables', 'constraints', 'indexes', 'functions']:
+            objdict = getattr(self.db, objtype)
+            for obj in list(objdict.keys()):
+                if obj[0] == BOOKKEEPING_SCHEMA:
+                    del objdict[obj]
+        del self.db.schemas[BOOKKEEPING_SCHEMA]
+
     def from_catalog(self, single_db=False):
         """Populate the database objects by querying the catalogs
 
@@ -344,8 +756,12 @@ class Database(object):
         self.db = self.Dicts(self.dbconn, single_db)
         self._build_dependency_graph(self.db, self.dbconn)
         if self.dbconn.conn:
-            self.dbconn.conn.close()
+            if self.dbconn.keep_open:
+                self.dbconn.rollback()
+            else:
+                self.dbconn.conn.close()
         self._link_refs(self.db)
+        self._hide_bookkeeping()
 
     def from_map(self, input_map, langs=None):
         """Populate the new database objects from the input map
@@ -488,19 +904,57 @@ class Database(object):
 
         return dbmap
 
-    def diff_map(self, input_map):
-        """Generate SQL to transform an existing database
+    def refresh_map(self, dbmap, schemas, dbwide):
+        """Update a map extracted earlier with the changes made since
+
+        :param dbmap: a YAML-suitable dictionary, as returned by `to_map`
+        :param schemas: names of the schemas changed (None if unknown)
+        :param dbwide: whether database-wide objects have changed
+        :return: a new YAML-suitable dictionary
+
+        The changes are usually those logged by the event triggers of
+        :mod:`pyrseas.changelog`.  Only the groups of schemas (see
+        :meth:`_schema_groups`) that include a changed schema, and the
+        database-wide objects if they have changed, are loaded from
+        the catalogs, and their entries replace those of `dbmap`.  If
+        the schemas changed are unknown, the whole map is extracted
+        again.
+        """
+        if schemas is None:
+            self.db = None
+            return self.to_map()
+        reload = set(schemas)
+        reload_global = False
+        for (group, glob) in self._schema_groups(dbmap):
+            if reload & set(group) or (glob and dbwide):
+                reload.update(group)
+                reload_global = reload_global or glob
+        newmap = {}
+        for (key, val) in list(dbmap.items()):
+            if key.startswith('schema '):
+                if key[7:] not in reload:
+                    newmap[key] = val
+            elif not reload_global:
+                newmap[key] = val
+        if not reload and not reload_global:
+            return newmap
+        self.dbconn.catalog_schemas = sorted(reload)
+        self.dbconn.catalog_global = reload_global
+        try:
+            self.db = None
+            self.from_catalog(True)
+        finally:
+            self.dbconn.catalog_schemas = None
+            self.dbconn.catalog_global = True
+        newmap.update(self.to_map())
+        self.db = None
+        return newmap
 
-        :param input_map: a YAML map defining the new database
-        :return: list of SQL statements
+    def _prepare_diff(self, input_map):
+        """Load the catalogs and the input map in preparation for a diff
 
-        Compares the existing database definition, as fetched from the
-        catalogs, to the input YAML map and generates SQL statements
-        to transform the database into the one represented by the
-        input.
+        :param input_map: a YAML map defining the new database
         """
-        from .dbobject.table import Table
-
         if not self.db:
             self.from_catalog()
         opts = self.config['options']
@@ -514,16 +968,387 @@ class Database(object):
         if opts.quote_reserved:
             fetch_reserved_words(self.dbconn)
 
-        langs = None
-        if self.dbconn.version >= 90100:
-            langs = [lang[0] for lang in self.dbconn.fetchall(
-                "SELECT tmplname FROM pg_pltemplate")]
-        self.from_map(input_map, langs)
+        if getattr(opts, 'estimate_costs', False):
+            self._relsizes = self.db.tables.fetch_sizes()
+
+        self.from_map(input_map, self._lang_templates())
         if opts.revert:
             (self.db, self.ndb) = (self.ndb, self.db)
-            del self.ndb.schemas['pg_catalog']
+            self.ndb.schemas.pop('pg_catalog', None)
             self.db.languages.dbconn = self.dbconn
+        if getattr(opts, 'online_indexes', False):
+            # indexes on tables that are kept are built and dropped online
+            for idxs in (self.db.indexes, self.ndb.indexes):
+                for idx in list(idxs.values()):
+                    tblkey = (idx.schema, idx.table)
+                    if tblkey in self.db.tables and tblkey in self.ndb.tables:
+                        idx._online = True
+        if getattr(opts, 'online_constraints', False):
+            self._mark_online_constraints()
+        if getattr(opts, 'online_columns', False):
+            self._mark_backfill_columns(getattr(opts, 'backfill_batch',
+                                                BACKFILL_BATCH))
+        self.type_changes.extend(self._classify_type_changes())
+
+    def _lang_templates(self):
+        """Return the names of the procedural language templates
+
+        :return: list of language names, or None if not available
+        """
+        if self.dbconn.version < 90100:
+            return None
+        return [lang[0] for lang in self.dbconn.fetchall(
+            LANG_TEMPLATES_QUERY)]
+
+    def _number_columns(self, db):
+        """Give objects built from a map the column numbers of the catalogs
+
+        :param db: Dicts object populated by :meth:`from_map`
+
+        The columns are numbered in the order they are listed, and the
+        columns of primary keys, foreign keys and unique constraints
+        are replaced by their numbers, as if fetched from the catalogs.
+        """
+        numbers = {}
+        for (key, tbl) in list(db.tables.items()):
+            if hasattr(tbl, 'columns'):
+                for (num, col) in enumerate(tbl.columns):
+                    col.number = num + 1
+                numbers[key] = dict((col.name, col.number)
+                                    for col in tbl.columns)
+        for cns in list(db.constraints.values()):
+            tblcols = numbers.get((cns.schema, cns.table), {})
+            if isinstance(cns, (PrimaryKey, ForeignKey, UniqueConstraint)):
+                cns.keycols = [tblcols[col] for col in cns.keycols]
+            if isinstance(cns, ForeignKey):
+                refcols = numbers.get((cns.ref_schema, cns.ref_table), {})
+                cns.ref_cols = [refcols[col] for col in cns.ref_cols]
+
+    def _mark_online_constraints(self):
+        """Mark constraints on existing tables to be added NOT VALID
+
+        Foreign keys and CHECK constraints added to tables that are
+        kept are validated after the transaction.  Columns of such
+        tables that become NOT NULL are first given a validated CHECK
+        constraint, if the server (PostgreSQL 12 or later) can use it
+        to skip the table scan.
+        """
+        for cns in list(self.ndb.constraints.values()):
+            tblkey = (cns.schema, cns.table)
+            if isinstance(cns, (CheckConstraint, ForeignKey)) and \
+                    tblkey in self.db.tables and tblkey in self.ndb.tables:
+                cns._not_valid = True
+        if self.dbconn.version < 120000:
+            return
+        for (key, tbl) in list(self.db.tables.items()):
+            if key in self.ndb.tables and hasattr(tbl, 'columns'):
+                for col in tbl.columns:
+                    col._online_not_null = True
+
+    def _mark_backfill_columns(self, batch):
+        """Mark new NOT NULL columns with defaults to be backfilled
+
+        :param batch: number of rows to update in each transaction
+
+        Adding a NOT NULL column with a default to an existing table
+        rewrites it, unless the server (PostgreSQL 11 or later) can
+        store the default in the catalog, i.e., the default doesn't
+        call a volatile function.  The other columns are added as
+        nullable and filled in batches ordered by the primary key, so
+        tables without one are left alone.
+        """
+        for (key, intbl) in list(self.ndb.tables.items()):
+            if key not in self.db.tables or \
+                    not hasattr(intbl, 'primary_key') or \
+                    not hasattr(self.db.tables[key], 'columns'):
+                continue
+            dbcols = [col.name for col in self.db.tables[key].columns]
+            for col in intbl.columns:
+                if col.name in dbcols or not hasattr(col, 'not_null') or \
+                        not hasattr(col, 'default') or \
+                        hasattr(col, 'inherited'):
+                    continue
+                if self.dbconn.version >= 110000 and not volatile_default(
+                        col.default, self._volatile_functions()):
+                    continue
+                col._backfill = batch
+                col._online_not_null = self.dbconn.version >= 120000
+
+    def _volatile_functions(self):
+        """Return the names of the volatile functions
+
+        :return: set of function names
+
+        The functions of the catalogs are fetched the first time they
+        are needed.  Those of the input map count as volatile unless
+        declared otherwise.
+        """
+        if self._volatile is None:
+            self._volatile = set(row[0] for row in self.dbconn.fetchall(
+                VOLATILE_FUNCTIONS_QUERY))
+        return self._volatile | set(
+            func.name for func in list(self.ndb.functions.values())
+            if getattr(func, 'volatility', 'v') == 'v')
+
+    def _classify_type_changes(self):
+        """Classify the changes to the types of existing columns
+
+        :return: list of (table, column, old type, new type, class) tuples
+
+        See :func:`~pyrseas.dbobject.column.classify_type_change` for
+        the classes.  The binary coercible casts are fetched from
+        `pg_cast` the first time they are needed.
+        """
+        changes = []
+        domains = {}
+        for types in (self.db.types, self.ndb.types):
+            for typ in list(types.values()):
+                if isinstance(typ, Domain):
+                    domains[typ.qualname()] = (typ.type, bool(
+                        getattr(typ, 'check_constraints', None) or
+                        getattr(typ, 'not_null', False)))
+        for (key, tbl) in list(self.ndb.tables.items()):
+            old = self.db.tables.get(key)
+            if not hasattr(tbl, 'columns') or not hasattr(old, 'columns'):
+                continue
+            oldcols = dict((col.name, col) for col in old.columns
+                           if not hasattr(col, 'dropped'))
+            for col in tbl.columns:
+                oldcol = oldcols.get(col.name)
+                if oldcol is None or not hasattr(col, 'type') or \
+                        oldcol.type == col.type:
+                    continue
+                if self._binary_casts is None:
+                    self._binary_casts = set(
+                        (row[0], row[1]) for row in
+                        self.dbconn.fetchall(BINARY_CASTS_QUERY))
+                changes.append((tbl.qualname(), col.name, oldcol.type,
+                                col.type, classify_type_change(
+                                    oldcol.type, col.type,
+                                    self._binary_casts, domains)))
+        return changes
+
+    def _need_nocheck_bodies(self):
+        """Determine whether any SQL-language function will be created
+
+        :return: True if SET check_function_bodies is needed
+
+        This is decided before any statement is generated, by
+        comparing the functions in the `ndb` and `db` holders in the
+        same way as :meth:`Function.alter` does: a new function is
+        created, and an existing one is replaced if its source differs.
+        """
+        for key, new in list(self.ndb.functions.items()):
+            old = self.db.functions.get(key)
+            if old is None:
+                if getattr(new, 'language', None) == 'sql' and \
+                        not getattr(new, 'oldname', None):
+                    return True
+            elif getattr(old, 'language', None) == 'sql' and \
+                    hasattr(old, 'source') and hasattr(new, 'source') and \
+                    old.source != new.source:
+                return True
+        return False
+
+    def diff_map(self, input_map):
+        """Generate SQL to transform an existing database
+
+        :param input_map: a YAML map defining the new database
+        :return: list of SQL statements
+
+        Compares the existing database definition, as fetched from the
+        catalogs, to the input YAML map and generates SQL statements
+        to transform the database into the one represented by the
+        input.
+        """
+        return list(self.diff_map_iter(input_map))
+
+    def diff_maps(self, old_map, new_map):
+        """Generate SQL to transform a database defined by a map to another
+
+        :param old_map: a YAML map defining the existing database
+        :param new_map: a YAML map defining the new database
+        :return: list of SQL statements
+
+        The existing database is built from `old_map` rather than from
+        the catalogs, so that, with a
+        :class:`~pyrseas.snapshot.MapConnection`, the statements are
+        generated without connecting to a database.
+        """
+        self.from_map(old_map, self._lang_templates())
+        self.db = self.ndb
+        self._number_columns(self.db)
+        return self.diff_map(new_map)
+
+    def diff_map_iter(self, input_map):
+        """Generate SQL to transform an existing database, incrementally
+
+        :param input_map: a YAML map defining the new database
+        :return: generator of SQL statements
+
+        This is the generator version of :meth:`diff_map`.  The
+        statements are yielded in dependency order as soon as they are
+        produced for each object, so that callers can output or
+        execute them without holding the complete list in memory.
+        """
+        opts = self.config['options']
+        self.type_changes = []
+        self.costs = []
+        if getattr(opts, 'by_schema', False):
+            stmts = self._diff_by_schema(input_map)
+        else:
+            stmts = self._diff_all(input_map)
+        if getattr(opts, 'coalesce_alters', False):
+            stmts = coalesce_alters(stmts)
+        for stmt in self._estimate_costs(stmts):
+            yield stmt
+
+    def _estimate_costs(self, stmts):
+        """Record the estimated cost of the statements, if asked
+
+        :param stmts: iterable of SQL statements
+        :return: generator of the same SQL statements
+
+        See :func:`~pyrseas.costs.estimate_cost` for the classes.  The
+        statements that do more than change the catalogs of an existing
+        table are added to `costs`, as tuples of statement, class,
+        relation, and the size in bytes and estimated number of rows
+        of the relation.
+        """
+        if not getattr(self.config['options'], 'estimate_costs', False):
+            for stmt in stmts:
+                yield stmt
+            return
+        volatile = self._volatile_functions()
+        for stmt in stmts:
+            (cls, rel) = estimate_cost(stmt, self.type_changes,
+                                       self.dbconn.version, volatile)
+            if cls != METADATA_ONLY and rel in self._relsizes:
+                self.costs.append((stmt, cls, rel) + self._relsizes[rel])
+            yield stmt
+
+    def _diff_all(self, input_map):
+        """Generate SQL to transform the whole database
+
+        :param input_map: a YAML map defining the new database
+        :return: generator of SQL statements
+        """
+        self._prepare_diff(input_map)
+        (new_objs, old_objs) = self._sorted_objects()
+        (new_objs, early) = self._diff_early(new_objs)
+        for stmt in early:
+            yield stmt
+        if self._need_nocheck_bodies():
+            yield "SET check_function_bodies = false"
+        for stmt in self._diff_sorted(new_objs, old_objs):
+            yield stmt
+
+    def _diff_early(self, new_objs):
+        """Generate SQL for the objects that need pre-transaction statements
+
+        :param new_objs: objects to create or alter, in dependency order
+        :return: tuple of the remaining objects and of the list of SQL
+            statements for the others, pre-transaction ones first
+
+        Existing enums may need labels added before the transaction.
+        Since they only depend on their schema, all their statements
+        are generated before those of other objects.
+        """
+        early = []
+        rest = []
+        for obj in new_objs:
+            if isinstance(obj, Enum) and obj.key() in self.db.types:
+                early.append(obj)
+            else:
+                rest.append(obj)
+        stmts = []
+        for obj in early:
+            stmts.extend(flatten([self._diff_new(obj)]))
+        stmts.sort(key=lambda stmt: stmt_phase(stmt) != PRE_TRANSACTION)
+        return (rest, stmts)
+
+    def diff_map_levels(self, input_map):
+        """Generate SQL to transform an existing database, by dependency level
+
+        :param input_map: a YAML map defining the new database
+        :return: generator of lists of lists of SQL statements
+
+        This produces the same statements as :meth:`diff_map`, grouped
+        so that they can be executed concurrently.  Each list yielded
+        holds the statements for one dependency level (see
+        :meth:`dep_levels`) and can only be executed after those of the
+        previous levels.  It consists of groups of statements, each to
+        be executed in order in a single transaction, that do not
+        depend on each other.  The statements affecting a given table,
+        e.g., its indexes and constraints, are kept in a single group
+        to prevent lock conflicts between concurrent transactions.
+
+        If needed, the first level consists of a single group with the
+        statements for existing enums, those to be executed before the
+        transaction first (see :meth:`_diff_early`), and the next of a
+        group with session settings, to be issued on every connection.
+        """
+        self.type_changes = []
+        self.costs = []
+        for level in self._diff_levels(input_map):
+            yield [list(self._estimate_costs(group)) for group in level]
+
+    def _diff_levels(self, input_map):
+        """Generate SQL to transform an existing database, by dependency level
+
+        :param input_map: a YAML map defining the new database
+        :return: generator of lists of lists of SQL statements
+        """
+        self._prepare_diff(input_map)
+        (new_objs, old_objs) = self._sorted_objects()
+        if getattr(self.config['options'], 'online_indexes', False):
+            self._unmark_needed_online(new_objs)
+        (rest, early) = self._diff_early(new_objs)
+        if early:
+            yield [early]
+        # the objects diffed early are kept for their dependents' levels
+        diffed = set(new_objs).difference(rest)
+        if self._need_nocheck_bodies():
+            yield [["SET check_function_bodies = false"]]
+
+        for objs in self.dep_levels(new_objs, self.ndb):
+            level = _level_groups([(obj, _mark_online(
+                obj, flatten([self._diff_new(obj)])))
+                for obj in objs if obj not in diffed])
+            if level:
+                yield self._coalesce_level(level)
+
+        old_objs.reverse()
+        for objs in reversed(self.dep_levels(old_objs, self.db)):
+            level = _level_groups([(obj, _mark_online(
+                obj, flatten(self._diff_old(obj)))) for obj in reversed(objs)])
+            if level:
+                yield self._coalesce_level(level)
 
+        if 'datacopy' in self.config:
+            opts = self.config['options']
+            opts.data_dir = self.config['files']['data_path']
+            level = [[stmt] for stmt in
+                     flatten(self.ndb.schemas.data_import(opts))]
+            if level:
+                yield level
+
+    def _coalesce_level(self, level):
+        """Merge the ALTER TABLE statements in each group of a level, if asked
+
+        :param level: list of lists of SQL statements
+        :return: list of lists of SQL statements
+        """
+        if not getattr(self.config['options'], 'coalesce_alters', False):
+            return level
+        return [list(coalesce_alters(group)) for group in level]
+
+    def _sorted_objects(self):
+        """Sort the objects of both databases in dependency order
+
+        :return: tuple of the `ndb` objects in dependency order and of
+            the `db` objects in reverse dependency order
+        """
         # First sort the objects in the new db in dependency order
         new_objs = []
         for _, d in self.ndb.all_dicts():
@@ -533,31 +1358,6 @@ class Database(object):
 
         new_objs = self.dep_sorted(new_objs, self.ndb)
 
-        # Then generate the sql for all the objects, walking in dependency
-        # order over all the db objects
-
-        stmts = []
-        for new in new_objs:
-            d = self.db.dbobjdict_from_catalog(new.catalog)
-            old = d.get(new.key())
-            if old is not None:
-                stmts.append(old.alter(new))
-            else:
-                stmts.append(new.create_sql())
-
-                # Check if the object just created was renamed, in which case
-                # don't try to delete the original one
-                if getattr(new, 'oldname', None):
-                    try:
-                        origname, new.name = new.name, new.oldname
-                        oldkey = new.key()
-                    finally:
-                        new.name = origname
-                    # Intentionally raising KeyError as tested e.g. in
-                    # test_bad_rename_view -- ok Joe?
-                    old = d[oldkey]
-                    old._nodrop = True
-
         # Order the old database objects in reverse dependency order
         old_objs = []
         for _, d in self.db.all_dicts():
@@ -566,42 +1366,366 @@ class Database(object):
             old_objs.extend(list(map(itemgetter(1), pairs)))
         old_objs = self.dep_sorted(old_objs, self.db)
         old_objs.reverse()
+        return (new_objs, old_objs)
 
-        # Drop the objects that don't appear in the new db
-        for old in old_objs:
-            d = self.ndb.dbobjdict_from_catalog(old.catalog)
-            if isinstance(old, Table):
-                new = d.get(old.key())
-                if new is not None:
-                    stmts.extend(old.alter_drop_columns(new))
-            if not getattr(old, '_nodrop', False) and old.key() not in d:
-                stmts.extend(old.drop())
+    def _diff_sorted(self, new_objs, old_objs):
+        """Generate SQL for the sorted objects of the loaded databases
+
+        :param new_objs: objects to create or alter, in dependency order
+        :param old_objs: objects to drop, in reverse dependency order
+        :return: generator of SQL statements
+        """
+        opts = self.config['options']
+        online_new = online_old = []
+        if getattr(opts, 'online_indexes', False):
+            # defer the online index statements
+            self._unmark_needed_online(new_objs)
+            online_new = [obj for obj in new_objs
+                          if getattr(obj, '_online', False)]
+            online_old = [obj for obj in old_objs
+                          if getattr(obj, '_online', False)]
+            new_objs = [obj for obj in new_objs if obj not in online_new]
+            old_objs = [obj for obj in old_objs if obj not in online_old]
+
+        jobs = getattr(opts, 'diff_jobs', None) or 1
+        if jobs > 1 and _fork_context() is not None:
+            stmtgen = self._diff_parallel(new_objs, old_objs, jobs)
+        else:
+            stmtgen = self._diff_serial(new_objs, old_objs)
+        for stmt in stmtgen:
+            yield stmt
 
         if 'datacopy' in self.config:
             opts.data_dir = self.config['files']['data_path']
-            stmts.append(self.ndb.schemas.data_import(opts))
-
-        stmts = [s for s in flatten(stmts)]
-        funcs = False
-        for s in stmts:
-            if "LANGUAGE sql" in s and (
-                    s.startswith("CREATE FUNCTION ") or
-                    s.startswith("CREATE OR REPLACE FUNCTION ")):
-                funcs = True
-                break
-        if funcs:
-            stmts.insert(0, "SET check_function_bodies = false")
+            for stmt in flatten(self.ndb.schemas.data_import(opts)):
+                yield stmt
+
+        for stmt in self._diff_serial(online_new, online_old):
+            yield NonTransactional(stmt)
 
+    def _unmark_needed_online(self, new_objs):
+        """Build the online indexes needed by other objects in the transaction
+
+        :param new_objs: objects to create or alter, in dependency order
+
+        An index that another object depends on, e.g., a unique index
+        referenced by a new foreign key, has to exist when the latter
+        is created, so it is built within the transaction instead.
+        """
+        deps = set()
+        for obj in new_objs:
+            if not getattr(obj, '_online', False):
+                deps.update(obj.get_deps(self.ndb))
+        for obj in new_objs:
+            if getattr(obj, '_online', False) and obj in deps:
+                obj._online = False
+                if obj.key() in self.db.indexes:
+                    self.db.indexes[obj.key()]._online = False
+
+    def _schema_groups(self, input_map):
+        """Partition the schemas into groups with no dependencies between them
+
+        :param input_map: a YAML map defining the new database
+        :return: list of (schema names, database-wide flag) tuples
+
+        The nodes of the graph are the schemas in the catalogs or in
+        the input map, plus `None` representing the database-wide
+        objects (extensions, languages, casts, etc.).  The edges
+        between schemas in the existing database are derived from
+        `pg_depend`, grouped by the namespaces of both ends.  Those in
+        the input map are inferred by scanning it for schema-qualified
+        names, `schema` attributes, names of objects in the 'public'
+        schema and names of database-wide objects.  The latter may
+        connect more schemas than strictly needed, which only affects
+        the size of the groups.
+        """
+        opts = self.config['options']
+        parent = {}
+        schemas = set(row[0] for row in self.dbconn.fetchall(SCHEMAS_QUERY))
+        for key in input_map:
+            if key.startswith('schema '):
+                schemas.add(key[7:])
+        for row in self.dbconn.fetchall(SCHEMA_DEPS_QUERY):
+            _union(parent, row['schema'], row['refschema'])
+        self.dbconn.rollback()
+
+        pubnames = set()
+        globnames = set()
+        for key in input_map:
+            if key == 'schema public':
+                for objkey in input_map[key]:
+                    pubnames.add(objkey.split('(')[0].split()[-1])
+            elif not key.startswith('schema '):
+                globnames.add(key.split('(')[0].split()[-1])
+                if key.startswith('foreign data wrapper '):
+                    for srvkey in input_map[key] or {}:
+                        globnames.add(srvkey.split()[-1])
+
+        for key in input_map:
+            node = key[7:] if key.startswith('schema ') else None
+            _find(parent, node)
+            for ref in _map_references(input_map[key], schemas, pubnames,
+                                       globnames):
+                _union(parent, node, ref)
+
+        groups = {}
+        for sch in sorted(schemas):
+            if opts.schemas and sch not in opts.schemas:
+                continue
+            groups.setdefault(_find(parent, sch), []).append(sch)
+        if not opts.schemas:
+            groups.setdefault(_find(parent, None), [])
+        result = [(schs, _find(parent, None) == root)
+                  for (root, schs) in groups.items()]
+        result.sort(key=lambda group: (not group[1], group[0]))
+        return result
+
+    def _diff_by_schema(self, input_map):
+        """Generate SQL to transform the database a group of schemas at a time
+
+        :param input_map: a YAML map defining the new database
+        :return: generator of SQL statements
+
+        Each group returned by :meth:`_schema_groups` is loaded from
+        the catalogs and from the corresponding part of the input map,
+        diffed and released before the next group is processed.  Peak
+        memory usage is thus proportional to the largest group instead
+        of to the whole database.  The catalogs are read over a
+        separate connection, since the statements generated for the
+        previous groups may be executing, uncommitted, over `dbconn`.
+        """
+        groups = self._schema_groups(input_map)
+        dbconn = self.dbconn
+        catconn = copy(dbconn)
+        catconn.conn = None
+        nocheck = False
+        for (schemas, dbwide) in groups:
+            submap = {}
+            for key in input_map:
+                if key.startswith('schema ') and key[7:] in schemas or \
+                        dbwide and not key.startswith('schema '):
+                    submap[key] = input_map[key]
+            catconn.catalog_schemas = schemas
+            catconn.catalog_global = dbwide
+            self.dbconn = catconn
+            try:
+                self.db = None
+                self._prepare_diff(submap)
+                (new_objs, old_objs) = self._sorted_objects()
+                (new_objs, early) = self._diff_early(new_objs)
+                need_nocheck = self._need_nocheck_bodies()
+            finally:
+                self.dbconn = dbconn
+                catconn.close()
+            for stmt in early:
+                yield stmt
+            if not nocheck and need_nocheck:
+                nocheck = True
+                yield "SET check_function_bodies = false"
+            for stmt in self._diff_sorted(new_objs, old_objs):
+                yield stmt
+            self.db = self.ndb = None
+
+    def _renamed_from(self, new):
+        """Return the key of the object a new object is renamed from
+
+        :param new: object in the `ndb` holder
+        :return: key of the object in the `db` holder, or None
+        """
+        if not getattr(new, 'oldname', None):
+            return None
+        try:
+            origname, new.name = new.name, new.oldname
+            return new.key()
+        finally:
+            new.name = origname
+
+    def _diff_new(self, new):
+        """Generate SQL to create or alter an object in the new database
+
+        :param new: object in the `ndb` holder
+        :return: list of SQL statements
+        """
+        d = self.db.dbobjdict_from_catalog(new.catalog)
+        old = d.get(new.key())
+        if old is not None:
+            return old.alter(new)
+        stmts = new.create_sql()
+
+        # Check if the object just created was renamed, in which case
+        # don't try to delete the original one
+        oldkey = self._renamed_from(new)
+        if oldkey is not None:
+            # Intentionally raising KeyError as tested e.g. in
+            # test_bad_rename_view -- ok Joe?
+            old = d[oldkey]
+            old._nodrop = True
+        return stmts
+
+    def _diff_old(self, old):
+        """Generate SQL to drop an object, or its columns, if not needed
+
+        :param old: object in the `db` holder
+        :return: list of SQL statements
+        """
+        from .dbobject.table import Table
+
+        stmts = []
+        d = self.ndb.dbobjdict_from_catalog(old.catalog)
+        if isinstance(old, Table):
+            new = d.get(old.key())
+            if new is not None:
+                stmts.extend(old.alter_drop_columns(new))
+        if not getattr(old, '_nodrop', False) and old.key() not in d:
+            stmts.extend(old.drop())
         return stmts
 
+    def _diff_serial(self, new_objs, old_objs):
+        """Generate SQL for the sorted new and old objects, in order
+
+        :param new_objs: objects to create or alter, in dependency order
+        :param old_objs: objects to drop, in reverse dependency order
+        :return: generator of SQL statements
+        """
+        # Generate the sql for all the objects, walking in dependency
+        # order over all the db objects
+        for new in new_objs:
+            for stmt in flatten([self._diff_new(new)]):
+                yield stmt
+
+        # Drop the objects that don't appear in the new db
+        for old in old_objs:
+            for stmt in flatten(self._diff_old(old)):
+                yield stmt
+
+    def _diff_components(self, new_objs, old_objs):
+        """Partition the objects to be diffed into independent groups
+
+        :param new_objs: objects to create or alter, in dependency order
+        :param old_objs: objects to drop, in reverse dependency order
+        :return: list of (new positions, old positions) tuples
+
+        The groups are the connected components of the union of the
+        dependency graphs of both databases.  An object in the new
+        database is connected to the object with the same key in the
+        old one (objects compare equal by class and key) and, if
+        renamed, to the object with its old name.  Objects in different
+        components do not share any state while their SQL is generated.
+        """
+        parent = {}
+
+        # nodes are keyed by object equality, so that the new and old
+        # versions of an object are the same node
+        for new in new_objs:
+            _find(parent, new)
+            for dep in new.get_deps(self.ndb):
+                _union(parent, new, dep)
+            oldkey = self._renamed_from(new)
+            if oldkey is not None:
+                old = self.db.dbobjdict_from_catalog(new.catalog).get(oldkey)
+                if old is not None:
+                    _union(parent, new, old)
+        for old in old_objs:
+            _find(parent, old)
+            for dep in old.get_deps(self.db):
+                _union(parent, old, dep)
+
+        comps = {}
+        for (i, new) in enumerate(new_objs):
+            comps.setdefault(_find(parent, new), ([], []))[0].append(i)
+        for (i, old) in enumerate(old_objs):
+            comps.setdefault(_find(parent, old), ([], []))[1].append(i)
+
+        def first(comp):
+            (newpos, oldpos) = comp
+            return newpos[0] if newpos else len(new_objs) + oldpos[0]
+
+        return sorted(comps.values(), key=first)
+
+    def _diff_parallel(self, new_objs, old_objs, jobs):
+        """Generate SQL for the sorted objects using worker processes
+
+        :param new_objs: objects to create or alter, in dependency order
+        :param old_objs: objects to drop, in reverse dependency order
+        :param jobs: number of worker processes
+        :return: generator of SQL statements
+
+        Each component of the dependency graph is diffed in a forked
+        worker.  The statements are merged back by the position of
+        their object in the sorted lists, so the result is identical
+        to that of :meth:`_diff_serial`.
+        """
+        global _diff_state
+
+        comps = self._diff_components(new_objs, old_objs)
+        if len(comps) < 2:
+            for stmt in self._diff_serial(new_objs, old_objs):
+                yield stmt
+            return
+
+        newstmts = [None] * len(new_objs)
+        oldstmts = [None] * len(old_objs)
+        _diff_state = (self, new_objs, old_objs, comps)
+        pool = _fork_context().Pool(min(jobs, len(comps)))
+        try:
+            chunk = max(1, len(comps) // (jobs * 4))
+            for (newres, oldres) in pool.imap_unordered(
+                    _diff_component, range(len(comps)), chunk):
+                for (i, stmts) in newres:
+                    newstmts[i] = stmts
+                for (i, stmts) in oldres:
+                    oldstmts[i] = stmts
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _diff_state = None
+
+        for stmts in newstmts + oldstmts:
+            for stmt in stmts:
+                yield stmt
+
     def dep_sorted(self, objs, db):
         """Sort `objs` in order of dependency.
 
         The function implements the classic Kahn 62 algorighm, see
         <http://en.wikipedia.org/wiki/Topological_sorting>.
         """
+        return self._kahn_sort(objs, db)[0]
+
+    def dep_levels(self, objs, db):
+        """Partition `objs` in levels of dependency.
+
+        :param objs: list of objects to sort
+        :param db: the `Dicts` holding the objects
+        :return: list of lists of objects
+
+        Each object is placed in the level following that of its
+        deepest dependency, so that there are no dependencies between
+        objects in the same level and they can be processed
+        concurrently once all the previous levels have been processed.
+        Within each level, the objects are in the order returned by
+        :meth:`dep_sorted`.
+        """
+        (L, level) = self._kahn_sort(objs, db)
+        levels = []
+        for obj in L:
+            if level[obj] == len(levels):
+                levels.append([])
+            levels[level[obj]].append(obj)
+        return levels
+
+    def _kahn_sort(self, objs, db):
+        """Sort `objs` in order of dependency and compute their levels
+
+        :return: tuple of the sorted list and a dictionary mapping each
+            object to its level
+        """
         # List of objects to return
         L = []
+        level = {}
 
         # Collect the graph edges.
         # Note that our "dependencies" are sort of backwards compared to the
@@ -619,6 +1743,7 @@ class Database(object):
         for obj in objs:
             if obj not in ein:
                 S.append(obj)
+                level[obj] = 0
 
         while S:
             # Objects with no dependencies can be emitted
@@ -630,6 +1755,7 @@ class Database(object):
             while eout[obj]:
                 ch = eout[obj].popleft()
                 ein[ch].remove(obj)
+                level[ch] = max(level.get(ch, 0), level[obj] + 1)
                 if not ein[ch]:
                     del ein[ch]
                     S.append(ch)
@@ -638,7 +1764,11 @@ class Database(object):
 
         assert bool(ein) == bool(eout)
         if not ein:
-            return L
+            return (L, level)
         else:
-            # is it possible? How do we deal with that?
-            raise Exception("the objects dependencies graph has loops")
+            raise Exception("the objects dependencies graph has loops: %s"
+                            % "; ".join(" -> ".join(
+                                "%s %s" % (obj.objtype.lower(),
+                                           obj.identifier())
+                                for obj in cycle)
+                                for cycle in _dep_cycles(ein)))
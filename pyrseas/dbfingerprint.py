@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""dbfingerprint - compare the schemas of many PostgreSQL databases by
+hashing their catalogs on the server"""
+
+from __future__ import print_function
+import sys
+import hashlib
+from argparse import ArgumentParser, Namespace
+from multiprocessing.pool import ThreadPool
+
+from pyrseas import __version__
+from pyrseas.yamlutil import yamldump
+from pyrseas.database import Database, CatDbConnection
+from pyrseas.dbobject import DbSchemaObject
+from pyrseas.checkpoint import SCHEMA as BOOKKEEPING_SCHEMA
+from pyrseas.snapshot import MapConnection
+
+# Oldest server version whose catalogs can be hashed
+MIN_VERSION = 90300
+
+# Columns left out of the hashes: the oids are assigned by each server
+# and the column numbers include those of dropped columns
+EXCLUDED = ['oid', 'number']
+
+# Columns holding attribute numbers, hashed by the names of the
+# attributes instead: column, catalog, key in the catalog, relation
+# and numbers
+ATTNUM_COLUMNS = {
+    'pg_constraint': [('keycols', 'oid', 'conrelid', 'conkey'),
+                      ('ref_cols', 'oid', 'confrelid', 'confkey')],
+    'pg_index': [('keycols', 'indexrelid', 'indrelid', 'indkey')],
+    'pg_trigger': [('columns', 'oid', 'tgrelid', 'tgattr')]}
+
+ATTNAMES = \
+    """ARRAY(SELECT attname
+                    FROM pg_catalog.%(catalog)s cat,
+                         generate_subscripts(cat.%(attnums)s::int2[], 1) i,
+                         pg_catalog.pg_attribute
+                    WHERE cat.%(catkey)s = objs.oid
+                          AND attrelid = cat.%(relation)s
+                          AND attnum = (cat.%(attnums)s::int2[])[i]
+                    ORDER BY i) AS %(column)s_names"""
+
+OBJECT_QUERY = \
+    """SELECT '%(objtype)s' AS objtype, %(schema)s AS schema,
+              ARRAY[%(key)s] AS key,
+              md5(string_agg(_hash, ',' ORDER BY _ord, _hash)) AS hash
+       FROM (SELECT objs.*,
+                    (row_to_json(objs)->>'number')::integer AS _ord,
+                    md5((SELECT string_agg(cols.key || ':' || cols.value::text,
+                                           ',' ORDER BY cols.key)
+                         FROM json_each(row_to_json(objs)) cols
+                         WHERE cols.key NOT IN (%(excluded)s))) AS _hash
+             FROM (SELECT objs.*%(attnames)s
+                   FROM (%(query)s) objs) objs) objs
+       WHERE %(where)s
+       GROUP BY 2, 3"""
+
+USER_SCHEMAS = "nspname !~ '^pg_' AND nspname != 'information_schema'"
+
+# Parameters of the sequences, read from the sequence itself before
+# PostgreSQL 10
+SEQUENCE_ATTRS_PRE10 = \
+    """query_to_xml('SELECT start_value, increment_by, max_value,
+                            min_value, cache_value
+                     FROM ' || c.oid::regclass::text, false, false, '')"""
+
+SEQUENCE_ATTRS = \
+    """(SELECT row(seqstart, seqincrement, seqmax, seqmin, seqcache)::text
+        FROM pg_catalog.pg_sequence WHERE seqrelid = c.oid)"""
+
+# Parameters of the sequences and the tables owning or using them, as
+# read by `Sequence.get_attrs` and `Sequence.get_dependent_table`
+SEQUENCES_QUERY = \
+    """SELECT nspname AS schema, relname AS name, %%s AS attrs,
+              (SELECT string_agg(refobjid::regclass::text || '.' ||
+                                 coalesce(attname, ''), ','
+                                 ORDER BY refobjid::regclass::text, attname)
+               FROM pg_catalog.pg_depend
+                    LEFT JOIN pg_catalog.pg_attribute
+                         ON (attrelid = refobjid AND attnum = refobjsubid)
+               WHERE objid = c.oid
+                     AND refclassid = 'pg_class'::regclass) AS owner_column,
+              (SELECT string_agg(adrelid::regclass::text, ','
+                                 ORDER BY adrelid::regclass::text)
+               FROM pg_catalog.pg_attrdef a
+                    JOIN pg_catalog.pg_depend d ON (a.oid = objid)
+               WHERE refobjid = c.oid
+                     AND classid = 'pg_attrdef'::regclass)
+                  AS dependent_table
+       FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON (relnamespace = n.oid)
+       WHERE relkind = 'S' AND %s""" % USER_SCHEMAS
+
+# Parents of the tables, in order, as read with `ClassDict.inhquery`
+INHERITS_QUERY = \
+    """SELECT nspname AS schema, relname AS name,
+              string_agg(inhparent::regclass::text, ','
+                         ORDER BY inhseqno) AS parents
+       FROM pg_catalog.pg_inherits
+            JOIN pg_catalog.pg_class c ON (inhrelid = c.oid)
+            JOIN pg_catalog.pg_namespace n ON (relnamespace = n.oid)
+       WHERE relkind IN ('r', 'S', 'v', 'm') AND %s
+       GROUP BY nspname, relname""" % USER_SCHEMAS
+
+# Dependencies between the objects, as read to build the dependency
+# graph, by the identity of the objects
+DEPENDS_QUERY = \
+    """SELECT o.schema, o.type || ' ' || o.identity AS object,
+              string_agg(r.type || ' ' || r.identity, ','
+                         ORDER BY r.type, r.identity) AS refs
+       FROM pg_catalog.pg_depend,
+            pg_catalog.pg_identify_object(classid, objid, objsubid) o,
+            pg_catalog.pg_identify_object(refclassid, refobjid,
+                                          refobjsubid) r
+       WHERE ((deptype = 'n' AND NOT (objid < 16384 AND refobjid < 16384))
+              OR (deptype = 'e' AND classid = 'pg_language'::regclass))
+             AND o.schema IS DISTINCT FROM '%s'
+             AND r.schema IS DISTINCT FROM '%s'
+       GROUP BY 1, 2""" % (BOOKKEEPING_SCHEMA, BOOKKEEPING_SCHEMA)
+
+SCHEMA_QUERY = \
+    """SELECT schema, md5(string_agg(
+                  objtype || ' ' || array_to_string(key, '.') || ' ' || hash,
+                  ',' ORDER BY objtype, key)) AS hash
+       FROM (%s) objects GROUP BY schema"""
+
+_queries = {}
+
+
+def objects_query(version, no_owner=False, no_privs=False):
+    """Return a query hashing the objects fetched by the DbObjectDicts
+
+    :param version: server version number
+    :param no_owner: leave the owners out of the hashes
+    :param no_privs: leave the privileges out of the hashes
+    :return: text of the query
+
+    The dictionaries are initialized from a connection that returns
+    no rows, so that each selects the query for the server version,
+    which is then wrapped to return, instead of the rows, an MD5 hash
+    of each object's row, keyed by the dictionary name and the
+    object's key columns.  The columns of a table have the same key
+    and are hashed together, in order.  The attribute numbers of
+    constraints, indexes and triggers are hashed as attribute names,
+    and the sequence parameters, table parents, operator class
+    members and dependencies, which are fetched by separate queries,
+    are hashed as `sequences`, `inherits`, `opclass_operators`,
+    `opclass_functions` and `depends` objects.  The rows are converted
+    to JSON and the excluded keys filtered out, which, like the
+    identification of the objects of the dependencies, needs
+    PostgreSQL 9.3.
+    """
+    if version < MIN_VERSION:
+        raise ValueError("Catalogs can only be hashed on PostgreSQL 9.3 "
+                         "or later")
+    cachekey = (version, no_owner, no_privs)
+    if cachekey in _queries:
+        return _queries[cachekey]
+    excluded = EXCLUDED + (['owner'] if no_owner else []) + (
+        ['privileges'] if no_privs else [])
+    dbs = Database.Dicts(MapConnection(version))
+    objdicts = [(objtype, objdict.cls.keylist, objdict.cls.catalog,
+                 objdict.query, issubclass(objdict.cls, DbSchemaObject))
+                for (objtype, objdict) in dbs.all_dicts() + [
+                    ('columns', dbs.columns)]]
+    objdicts += [
+        ('sequences', ['schema', 'name'], None, SEQUENCES_QUERY % (
+            SEQUENCE_ATTRS if version >= 100000 else SEQUENCE_ATTRS_PRE10),
+         True),
+        ('inherits', ['schema', 'name'], None, INHERITS_QUERY, True),
+        ('opclass_operators', ['schema', 'name', 'index_method'], None,
+         dbs.operclasses.opquery, True),
+        ('opclass_functions', ['schema', 'name', 'index_method'], None,
+         dbs.operclasses.prquery, True),
+        ('depends', ['schema', 'object'], 'pg_depend', DEPENDS_QUERY,
+         False)]
+    queries = []
+    for (objtype, keylist, catalog, query, inschema) in objdicts:
+        where = 'TRUE'
+        if inschema:
+            schema = 'objs."schema"::text'
+            where = "objs.\"schema\" != '%s'" % BOOKKEEPING_SCHEMA
+        elif catalog == 'pg_namespace':
+            schema = 'objs."name"::text'
+            where = "objs.\"name\" != '%s'" % BOOKKEEPING_SCHEMA
+        elif catalog == 'pg_depend':
+            schema = 'objs."schema"::text'
+        else:
+            schema = 'NULL::text'
+            if catalog == 'pg_event_trigger':
+                where = "objs.\"procedure\"::text NOT LIKE '%s.%%'" % (
+                    BOOKKEEPING_SCHEMA)
+        attnums = ATTNUM_COLUMNS.get(catalog, [])
+        queries.append(OBJECT_QUERY % {
+            'objtype': objtype, 'schema': schema,
+            'key': ", ".join('objs."%s"::text' % col for col in keylist),
+            'excluded': ", ".join("'%s'" % col for col in excluded + [
+                column for (column, _, _, _) in attnums]),
+            'attnames': "".join(",\n" + ATTNAMES % {
+                'column': column, 'catalog': catalog, 'catkey': catkey,
+                'relation': relation, 'attnums': numbers}
+                for (column, catkey, relation, numbers) in attnums),
+            'query': query, 'where': where})
+    _queries[cachekey] = query = "\nUNION ALL\n".join(queries)
+    return query
+
+
+def schema_hashes(dbconn, options):
+    """Return a hash of each schema, computed on the server
+
+    :param dbconn: a CatDbConnection object
+    :param options: object holding the options, as parsed by `main`
+    :return: dictionary of hashes by schema name (None for the
+        database-wide objects)
+    """
+    query = SCHEMA_QUERY % objects_query(dbconn.version, options.no_owner,
+                                         options.no_privs)
+    data = dbconn.fetchall(query)
+    dbconn.rollback()
+    return dict((row['schema'], row['hash']) for row in data)
+
+
+def object_hashes(dbconn, options, schemas):
+    """Return a hash of each object in some schemas, computed on the server
+
+    :param dbconn: a CatDbConnection object
+    :param options: object holding the options, as parsed by `main`
+    :param schemas: schema names, including None for the database-wide
+        objects
+    :return: dictionary by schema name of dictionaries of hashes by
+        (dictionary name, key) tuples
+    """
+    query = objects_query(dbconn.version, options.no_owner, options.no_privs)
+    query = 'SELECT * FROM (%s) objects WHERE schema = ANY(%%s) ' \
+        'OR (%%s AND schema IS NULL)' % query.replace('%', '%%')
+    data = dbconn.fetchall(query, ([sch for sch in schemas if sch is not None],
+                                   None in schemas))
+    dbconn.rollback()
+    result = {}
+    for row in data:
+        result.setdefault(row['schema'], {})[
+            (row['objtype'], tuple(row['key']))] = row['hash']
+    return result
+
+
+def fingerprint(dbconn):
+    """Return a fingerprint of the contents of the catalogs
+
+    :param dbconn: a CatDbConnection object
+    :return: string
+
+    Unlike the fingerprint of :mod:`pyrseas.checkpoint`, which changes
+    with the transaction ids of the catalog rows, this one is the same
+    for databases whose objects are identical.
+    """
+    hashes = schema_hashes(dbconn, Namespace(no_owner=False,
+                                              no_privs=False))
+    return hashlib.sha1(repr(sorted(hashes.items(), key=lambda item: (
+        item[0] is not None, item[0]))).encode('utf-8')).hexdigest()
+
+
+def _label(objkey):
+    (objtype, key) = objkey
+    return "%s %s" % (objtype, '.'.join(k for k in key if k is not None))
+
+
+def compare(ref_schemas, ref_objects, dbconn, options):
+    """Compare a database to the reference database
+
+    :param ref_schemas: schema hashes of the reference database
+    :param ref_objects: object hashes of the reference database
+    :param dbconn: a CatDbConnection object
+    :param options: object holding the options, as parsed by `main`
+    :return: dictionary listing the objects `changed`, `missing` and
+        `extra`, empty if the schemas are identical
+
+    The hashes of the objects are only fetched for the schemas whose
+    hashes differ.
+    """
+    db_schemas = schema_hashes(dbconn, options)
+    schemas = set(sch for sch in set(ref_schemas) | set(db_schemas)
+                  if ref_schemas.get(sch) != db_schemas.get(sch))
+    if not schemas:
+        return {}
+    db_objects = object_hashes(dbconn, options, schemas)
+    result = {}
+    for sch in schemas:
+        refobjs = ref_objects.get(sch, {})
+        dbobjs = db_objects.get(sch, {})
+        for objkey in sorted(set(refobjs) | set(dbobjs)):
+            if objkey not in dbobjs:
+                result.setdefault('missing', []).append(_label(objkey))
+            elif objkey not in refobjs:
+                result.setdefault('extra', []).append(_label(objkey))
+            elif refobjs[objkey] != dbobjs[objkey]:
+                result.setdefault('changed', []).append(_label(objkey))
+    for objs in result.values():
+        objs.sort()
+    return result
+
+
+def main():
+    """Compare the schemas of databases to that of a reference database."""
+    parser = ArgumentParser(description="Compare the schemas of PostgreSQL "
+                            "databases by hashing their catalogs on the "
+                            "server")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + '%s' % __version__)
+    parser.add_argument('dbnames', nargs='+', metavar='dbname',
+                        help='database name, the first being the reference')
+    group = parser.add_argument_group('Connection options')
+    group.add_argument('-H', '--host', help="database server host")
+    group.add_argument('-p', '--port', type=int,
+                       help="database server port")
+    group.add_argument('-U', '--username', help="database user name")
+    parser.add_argument('-O', '--no-owner', action='store_true',
+                        help='exclude object ownership information')
+    parser.add_argument('-x', '--no-privileges', action='store_true',
+                        dest='no_privs',
+                        help='exclude privilege (GRANT/REVOKE) information')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help="number of databases to compare concurrently "
+                        "(default %(default)s)")
+    options = parser.parse_args()
+
+    def connect(dbname):
+        dbconn = CatDbConnection(dbname, options.username, None,
+                                 options.host, options.port)
+        dbconn.connect()
+        return dbconn
+
+    refconn = connect(options.dbnames[0])
+    try:
+        ref_schemas = schema_hashes(refconn, options)
+        ref_objects = object_hashes(refconn, options, list(ref_schemas))
+    except ValueError as exc:
+        sys.exit("%s: %s" % (options.dbnames[0], exc))
+    finally:
+        refconn.close()
+
+    def check(dbname):
+        try:
+            dbconn = connect(dbname)
+            try:
+                return (dbname, compare(ref_schemas, ref_objects, dbconn,
+                                        options))
+            finally:
+                dbconn.close()
+        except (Exception, SystemExit) as exc:
+            return (dbname, {'error': str(exc)})
+
+    pool = ThreadPool(options.jobs)
+    try:
+        results = pool.map(check, options.dbnames[1:])
+    finally:
+        pool.close()
+    report = dict((dbname, result) for (dbname, result) in results if result)
+    if report:
+        print(yamldump(report), end='')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,59 @@ NON_FILENAME_CHARS = re.compile(r'\W', re.U)
 MAX_PG_IDENT_LEN = 63
 MAX_IDENT_LEN = int(os.environ.get("PYRSEAS_MAX_IDENT_LEN", 32))
 
+PRE_TRANSACTION = 'pre-transaction'
+TRANSACTION = 'transaction'
+POST_TRANSACTION = 'post-transaction'
+PHASES = (PRE_TRANSACTION, TRANSACTION, POST_TRANSACTION)
+
+
+class NonTransactional(str if not PY2 else unicode):
+    """An SQL statement that cannot be executed in a transaction block
+
+    Statements such as ``CREATE INDEX CONCURRENTLY`` are generated as
+    instances of this class, so that they can be executed after the
+    transaction holding the other statements has been committed.
+    """
+
+    phase = POST_TRANSACTION
+
+
+class PreTransactional(NonTransactional):
+    """An SQL statement to be executed before the transaction block
+
+    Statements such as ``ALTER TYPE ... ADD VALUE`` are generated as
+    instances of this class, so that their effects are committed
+    before the statements in the transaction, which may depend on
+    them, are executed.
+    """
+
+    phase = PRE_TRANSACTION
+
+
+class Backfill(NonTransactional):
+    """An SQL statement that updates the rows of a table in batches
+
+    The statement is a ``DO`` block that commits after each batch,
+    which PostgreSQL 11 or later allows outside a transaction block.
+    The `first` and `next` attributes hold the ``UPDATE`` statements
+    for the first and each subsequent batch (the latter taking the
+    last key returned by the previous one as parameters), so that the
+    batches can also be executed and reported on one at a time.
+    """
+
+
+def stmt_phase(stmt):
+    """Return the execution phase of a statement
+
+    :param stmt: SQL statement or data copy tuple
+    :return: one of the PHASES
+    """
+    return getattr(stmt, 'phase', TRANSACTION)
+
+
+RESERVED_WORDS_QUERY = \
+    "SELECT word FROM pg_get_keywords() WHERE catcode = 'R'"
+
 
 def fetch_reserved_words(db):
     """Fetch PostgreSQL reserved words
@@ -35,8 +88,7 @@ def fetch_reserved_words(db):
 
     if len(RESERVED_WORDS) == 0:
         RESERVED_WORDS = [word[0] for word in
-                          db.fetchall("""SELECT word FROM pg_get_keywords()
-                                         WHERE catcode = 'R'""")]
+                          db.fetchall(RESERVED_WORDS_QUERY)]
 
 
 def quote_id(name):
@@ -648,7 +700,28 @@ class DbObjectDict(dict):
         """Fetch all objects from the catalogs using the class :attr:`query`
 
         :return: list of self.cls objects
+
+        If the connection restricts the catalog queries to certain
+        schemas (see :attr:`CatDbConnection.catalog_schemas`), only
+        the objects in those schemas are fetched, and database-wide
+        objects only if so requested.
         """
-        data = self.dbconn.fetchall(self.query)
+        query = self.query
+        args = None
+        schemas = getattr(self.dbconn, 'catalog_schemas', None)
+        if schemas is not None:
+            if issubclass(self.cls, DbSchemaObject):
+                column = 'schema'
+            elif self.cls.catalog == 'pg_namespace':
+                column = 'name'
+            elif not self.dbconn.catalog_global:
+                return []
+            else:
+                column = None
+            if column is not None:
+                query = 'SELECT * FROM (%s) objs WHERE "%s" = ANY(%%s)' % (
+                    query.replace('%', '%%'), column)
+                args = (list(schemas), )
+        data = self.dbconn.fetchall(query, args)
         self.dbconn.rollback()
         return [self.cls(**dict(row)) for row in data]
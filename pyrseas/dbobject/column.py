@@ -6,11 +6,145 @@
     This module defines two classes: Column derived from
     DbSchemaObject and ColumnDict derived from DbObjectDict.
 """
+import re
+
 from pyrseas.dbobject import DbObjectDict, DbSchemaObject, quote_id
+from pyrseas.dbobject import NonTransactional, Backfill, MAX_PG_IDENT_LEN
 from pyrseas.dbobject.privileges import privileges_from_map, add_grant
 from pyrseas.dbobject.privileges import diff_privs
 
 
+METADATA_ONLY = 'metadata-only'
+VERIFY_SCAN = 'verify-scan'
+FULL_REWRITE = 'full-rewrite'
+
+BINARY_CASTS_QUERY = \
+    """SELECT format_type(castsource, NULL) AS source,
+              format_type(casttarget, NULL) AS target
+       FROM pg_cast WHERE castmethod = 'b'"""
+
+# Default number of rows updated in each transaction by backfill()
+BACKFILL_BATCH = 10000
+
+# Defaults that PostgreSQL 11 or later certainly stores in the catalog
+# when a column is added, instead of rewriting the table: literals,
+# possibly with a cast.  Any default that doesn't call a volatile
+# function is stored, which is checked when the functions are known.
+CONSTANT_DEFAULT = re.compile(
+    r"^\(?(-?[\d.]+|'(?:[^']|'')*'|true|false|null)\)?(::[\w .\[\]()]+)?$",
+    re.IGNORECASE)
+
+VOLATILE_FUNCTIONS_QUERY = \
+    "SELECT DISTINCT proname FROM pg_proc WHERE provolatile = 'v'"
+
+# Function calls in an expression, by possibly quoted name
+FUNCTION_CALL = re.compile(r'(?:"((?:[^"]|"")+)"|(\w+))\s*\(')
+
+TYPE_ALIASES = {
+    'bool': 'boolean', 'bpchar': 'character', 'char': 'character',
+    'decimal': 'numeric', 'float4': 'real', 'float8': 'double precision',
+    'int': 'integer', 'int2': 'smallint', 'int4': 'integer',
+    'int8': 'bigint', 'time': 'time without time zone',
+    'timestamp': 'timestamp without time zone',
+    'timestamptz': 'timestamp with time zone',
+    'timetz': 'time with time zone', 'varbit': 'bit varying',
+    'varchar': 'character varying'}
+
+# Types whose values are unchanged when their typmod is relaxed, and
+# the number of typmod elements that must be the same (e.g., the scale
+# of numeric) when the first one is increased.
+RELAXABLE_TYPES = {
+    'bit varying': 0, 'character varying': 0, 'numeric': 1,
+    'interval': 0, 'time without time zone': 0,
+    'time with time zone': 0, 'timestamp without time zone': 0,
+    'timestamp with time zone': 0}
+
+TYPMOD = re.compile(r'^([^(]*)(?:\(([^)]*)\))?(.*)$')
+
+
+def split_typmod(typ):
+    """Split a type name into its canonical base name and its modifiers
+
+    :param typ: type name, e.g., 'varchar(16)' or 'numeric(10, 2)'
+    :return: tuple of the base name and a list of integer modifiers,
+        or None if the type has no modifiers
+    """
+    match = TYPMOD.match(typ.strip())
+    base = (match.group(1).strip() + ' ' + match.group(3).strip()).strip()
+    if match.group(2) is None:
+        mods = None
+    else:
+        mods = [int(mod) for mod in match.group(2).split(',')]
+    (base, arr) = (base[:-2], '[]') if base.endswith('[]') else (base, '')
+    return (TYPE_ALIASES.get(base, base) + arr, mods)
+
+
+def volatile_default(default, volatile):
+    """Return whether a default expression calls a volatile function
+
+    :param default: text of the expression
+    :param volatile: set of names of the volatile functions
+    :return: boolean
+
+    The functions are matched by name only, so a call to a function
+    with the same name as a volatile one counts as volatile.
+    """
+    for (quoted, name) in FUNCTION_CALL.findall(default):
+        if (quoted.replace('""', '"') if quoted else name.lower()) \
+                in volatile:
+            return True
+    return False
+
+
+def classify_type_change(oldtype, newtype, casts, domains={}):
+    """Classify a column type change according to its cost
+
+    :param oldtype: current column type
+    :param newtype: new column type
+    :param casts: set of (source, target) binary coercible type names
+    :param domains: dictionary mapping domain names to tuples of base
+        type and a flag indicating whether the domain has constraints
+    :return: METADATA_ONLY, VERIFY_SCAN or FULL_REWRITE
+
+    PostgreSQL changes the type of a column without rewriting the
+    table when the values need no conversion: the types are binary
+    coercible (as recorded in `pg_cast`), or the same type with a
+    relaxed modifier, e.g., a longer `varchar` or an unconstrained
+    `numeric` (but not a `character` or `bit` without length, which
+    are of length 1).  If the new type is a domain with constraints
+    over such a type, the existing values still have to be checked
+    against them.  Any other change rewrites the whole table and its
+    indexes.
+    """
+    (oldbase, oldmods) = split_typmod(oldtype)
+    if oldbase in domains and oldmods is None:
+        (oldbase, oldmods) = split_typmod(domains[oldbase][0])
+    (newbase, newmods) = split_typmod(newtype)
+    verify = False
+    if newbase in domains and newmods is None:
+        verify = domains[newbase][1]
+        (newbase, newmods) = split_typmod(domains[newbase][0])
+
+    if oldbase == newbase:
+        if oldmods == newmods:
+            cheap = True
+        elif newmods is None:
+            # without a typmod, e.g., character means character(1)
+            cheap = oldbase in RELAXABLE_TYPES
+        elif oldmods is None or oldbase not in RELAXABLE_TYPES or \
+                len(oldmods) != len(newmods):
+            cheap = False
+        else:
+            fixed = RELAXABLE_TYPES[oldbase]
+            cheap = newmods[0] >= oldmods[0] and \
+                newmods[1:fixed + 1] == oldmods[1:fixed + 1]
+    else:
+        cheap = newmods is None and (oldbase, newbase) in casts
+    if not cheap:
+        return FULL_REWRITE
+    return VERIFY_SCAN if verify else METADATA_ONLY
+
+
 class Column(DbSchemaObject):
     "A table column definition"
 
@@ -41,9 +175,11 @@ class Column(DbSchemaObject):
         :return: partial SQL statement
         """
         stmt = "%s %s" % (quote_id(self.name), self.type)
-        if hasattr(self, 'not_null'):
+        # a column to be backfilled gets NOT NULL and DEFAULT later
+        backfill = getattr(self, '_backfill', None)
+        if hasattr(self, 'not_null') and not backfill:
             stmt += ' NOT NULL'
-        if hasattr(self, 'default'):
+        if hasattr(self, 'default') and not backfill:
             stmt += ' DEFAULT ' + self.default
         if hasattr(self, 'collation') and self.collation != 'default':
             stmt += ' COLLATE "%s"' % self.collation
@@ -121,6 +257,124 @@ class Column(DbSchemaObject):
             self.qualname(self.table), quote_id(self.name), self.default))
         return stmts
 
+    def _not_null_check(self, tables):
+        """Return a name for the CHECK constraint used to set NOT NULL
+
+        :param tables: the tables whose constraint names are taken
+        :return: constraint name
+
+        The name is `<table>_<column>_not_null`, followed by a number
+        if a constraint of the tables already has that name.
+        """
+        names = set()
+        for table in tables:
+            for attr in ('check_constraints', 'foreign_keys',
+                         'unique_constraints'):
+                names.update(getattr(table, attr, {}))
+            if hasattr(table, 'primary_key'):
+                names.add(table.primary_key.name)
+        base = "%s_%s_not_null" % (self.table, self.name)
+        name = base[:MAX_PG_IDENT_LEN]
+        num = 0
+        while name in names:
+            num += 1
+            name = base[:MAX_PG_IDENT_LEN - len(str(num))] + str(num)
+        return name
+
+    def _not_null_stmts(self, tables):
+        """Return SQL statements to set NOT NULL using a CHECK constraint
+
+        :param tables: the tables whose constraint names are taken
+        :return: list of SQL statements
+
+        SET NOT NULL scans the whole table while holding an ACCESS
+        EXCLUSIVE lock, unless a valid CHECK (column IS NOT NULL)
+        constraint proves there are no nulls (PostgreSQL 12 or later).
+        Such a constraint is added as NOT VALID, validated, used and
+        dropped.
+        """
+        tbl = self.qualname(self.table)
+        chk = quote_id(self._not_null_check(tables))
+        return ["ALTER TABLE %s ADD CONSTRAINT %s CHECK (%s IS NOT NULL) "
+                "NOT VALID" % (tbl, chk, quote_id(self.name)),
+                "ALTER TABLE %s VALIDATE CONSTRAINT %s" % (tbl, chk),
+                "ALTER TABLE %s ALTER COLUMN %s SET NOT NULL" % (
+                    tbl, quote_id(self.name)),
+                "ALTER TABLE %s DROP CONSTRAINT %s" % (tbl, chk)]
+
+    def set_not_null_online(self, incol):
+        """Return SQL statements to set NOT NULL via a validated CHECK
+
+        :param incol: a YAML map defining the new column
+        :return: list of SQL statements
+
+        The CHECK constraint is added in the transaction and the
+        remaining statements are executed after it.
+        """
+        if not getattr(self, '_online_not_null', False) or \
+                hasattr(self, 'not_null') or not hasattr(incol, 'not_null'):
+            return []
+        stmts = self._not_null_stmts([self._table, incol._table])
+        return stmts[:1] + [NonTransactional(stmt) for stmt in stmts[1:]]
+
+    def backfill(self):
+        """Return SQL statements to fill a column added online
+
+        :return: list of SQL statements
+
+        A NOT NULL column with a DEFAULT that cannot be added without
+        rewriting the table is added as nullable and without default
+        by :meth:`add`.  The default is then set, so that it applies
+        to new rows, and after the transaction the existing rows are
+        updated in batches ordered by the primary key, each in its own
+        transaction.  Finally, the column is made NOT NULL, using a
+        validated CHECK constraint if the server supports it.
+        """
+        tbl = self.qualname(self.table)
+        col = quote_id(self.name)
+        keys = [quote_id(key) for key in self._table.primary_key.keycols]
+        tkeys = ", ".join("_t." + key for key in keys)
+        vars = ["_k%d" % (i + 1) for i in range(len(keys))]
+
+        def batch(last):
+            "Return the statement to update the batch after the last key"
+            where = ''
+            if last:
+                where = " WHERE (%s) > (%s)" % (", ".join(keys),
+                                                ", ".join(last))
+            return "WITH _b AS (SELECT %s FROM %s%s ORDER BY %s LIMIT %d),\n" \
+                "     _u AS (UPDATE %s AS _t SET %s = DEFAULT FROM _b\n" \
+                "            WHERE (%s) = (%s) RETURNING %s)\n" \
+                "SELECT %s, count(*) OVER () FROM _u ORDER BY %s LIMIT 1" % (
+                    ", ".join(keys), tbl, where, ", ".join(keys),
+                    self._backfill, tbl, col, tkeys,
+                    ", ".join("_b." + key for key in keys), tkeys,
+                    ", ".join(keys), ", ".join(key + " DESC" for key in keys))
+
+        into = " INTO %s, _n" % ", ".join(vars)
+        notice = "RAISE NOTICE 'backfilled %% rows of %s.%s', _total;" % (
+            tbl.replace("'", "''"), col.replace("'", "''"))
+        stmt = Backfill(
+            "DO $$\nDECLARE\n%s    _n bigint;\n    _total bigint := 0;\n"
+            "BEGIN\n    %s%s;\n    WHILE _n > 0 LOOP\n"
+            "        _total := _total + _n;\n        %s\n        COMMIT;\n"
+            "        %s%s;\n    END LOOP;\nEND $$" % (
+                "".join("    %s %s.%s%%TYPE;\n" % (var, tbl, key)
+                        for (var, key) in zip(vars, keys)),
+                batch([]).replace("\n", "\n    "), into, notice,
+                batch(vars).replace("\n", "\n        "), into))
+        stmt.table = "%s.%s" % (tbl, col)
+        stmt.first = batch([])
+        stmt.next = batch(["%s"] * len(keys))
+        stmts = ["ALTER TABLE %s ALTER COLUMN %s SET DEFAULT %s" % (
+            tbl, col, self.default), stmt]
+        if getattr(self, '_online_not_null', False):
+            stmts.extend(self._not_null_stmts([self._table]))
+        else:
+            stmts.append("ALTER TABLE %s ALTER COLUMN %s SET NOT NULL" % (
+                tbl, col))
+        return stmts[:2] + [NonTransactional(stmt) for stmt in stmts[2:]]
+
     def alter(self, incol):
         """Generate SQL to transform an existing column
 
@@ -134,7 +388,8 @@ class Column(DbSchemaObject):
         stmts = []
         base = "ALTER COLUMN %s " % quote_id(self.name)
         # check NOT NULL
-        if not hasattr(self, 'not_null') and hasattr(incol, 'not_null'):
+        if not hasattr(self, 'not_null') and hasattr(incol, 'not_null') \
+                and not getattr(self, '_online_not_null', False):
             stmts.append(base + "SET NOT NULL")
         if hasattr(self, 'not_null') and not hasattr(incol, 'not_null'):
             stmts.append(base + "DROP NOT NULL")
@@ -218,6 +473,9 @@ class ColumnDict(DbObjectDict):
             if (sch, tbl) not in self:
                 self[(sch, tbl)] = []
             self[(sch, tbl)].append(col)
+        # a schema-restricted fetch does not guarantee the query order
+        for cols in list(self.values()):
+            cols.sort(key=lambda col: col.number)
 
     def from_map(self, table, incols):
         """Initialize the dictionary of columns by converting the input list
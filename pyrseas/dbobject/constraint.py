@@ -10,7 +10,7 @@
 """
 import re
 
-from pyrseas.dbobject import DbObjectDict, DbSchemaObject
+from pyrseas.dbobject import DbObjectDict, DbSchemaObject, NonTransactional
 from pyrseas.dbobject import quote_id, split_schema_obj, commentable
 from pyrseas.dbobject.index import Index
 
@@ -37,6 +37,24 @@ class Constraint(DbSchemaObject):
         # TODO: is add really needed?
         return self.add()
 
+    def not_valid(self, stmt):
+        """Add the constraint as NOT VALID and validate it afterwards
+
+        :param stmt: SQL statement to add the constraint
+        :return: list of SQL statements
+
+        If the constraint has been marked to be added online, it is
+        added as NOT VALID, which only takes a brief lock, and a
+        statement to validate the existing rows, which does not block
+        writes to the table, is issued after the transaction.
+        """
+        if not getattr(self, '_not_valid', False):
+            return [stmt]
+        return [stmt + " NOT VALID", NonTransactional(
+            "ALTER %s %s VALIDATE CONSTRAINT %s" % (
+                self._table.objtype, self._table.qualname(),
+                quote_id(self.name)))]
+
     @commentable
     def add(self):
         """Return string to add the constraint via ALTER TABLE
@@ -121,9 +139,9 @@ class CheckConstraint(Constraint):
         if getattr(self, 'inherited', None):
             return []
 
-        return ["ALTER %s %s ADD CONSTRAINT %s %s (%s)" % (
+        return self.not_valid("ALTER %s %s ADD CONSTRAINT %s %s (%s)" % (
             self._table.objtype, self._table.qualname(), quote_id(self.name),
-            self.objtype, self.expression)]
+            self.objtype, self.expression))
 
     def drop(self):
         if getattr(self, 'inherited', None):
@@ -250,9 +268,9 @@ class ForeignKey(Constraint):
 
     @commentable
     def add(self):
-        """Return string to add the foreign key via ALTER TABLE
+        """Return statements to add the foreign key via ALTER TABLE
 
-        :return: SQL statement
+        :return: list of SQL statements
         """
         match = ''
         if hasattr(self, 'match'):
@@ -267,11 +285,12 @@ class ForeignKey(Constraint):
         if getattr(self, 'deferred', False):
             actions += " INITIALLY DEFERRED"
 
-        return "ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) " \
+        return self.not_valid(
+            "ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) "
             "REFERENCES %s (%s)%s%s" % (
                 self._table.qualname(), quote_id(self.name),
                 self.key_columns(), self.references.qualname(),
-                self.ref_columns(), match, actions)
+                self.ref_columns(), match, actions))
 
     def get_match_actions(self):
         match = ""
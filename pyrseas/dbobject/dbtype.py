@@ -10,6 +10,7 @@
 
 from pyrseas.dbobject import DbObjectDict, DbSchemaObject
 from pyrseas.dbobject import split_schema_obj, commentable, ownable
+from pyrseas.dbobject import PreTransactional
 from pyrseas.dbobject.constraint import CheckConstraint
 
 
@@ -216,10 +217,40 @@ class Enum(DbType):
 
         :return: SQL statements
         """
-        lbls = ["'%s'" % lbl for lbl in self.labels]
+        lbls = ["'%s'" % lbl.replace("'", "''") for lbl in self.labels]
         return ["CREATE TYPE %s AS ENUM (%s)" % (
                 self.qualname(), ",\n    ".join(lbls))]
 
+    def alter(self, inenum):
+        """Generate SQL to transform an existing enum
+
+        :param inenum: the new enum type
+        :return: list of SQL statements
+
+        New labels are added with ``ALTER TYPE ... ADD VALUE``, which
+        cannot be executed in a transaction block prior to PostgreSQL
+        12, and whose values cannot be used in the same transaction
+        afterwards, so the statements are generated to be executed
+        before the transaction.  Labels cannot be removed or reordered.
+        """
+        stmts = []
+        labels = list(self.labels)
+        pos = 0
+        for lbl in inenum.labels:
+            if pos < len(labels) and labels[pos] == lbl:
+                pos += 1
+            elif lbl not in labels:
+                where = ''
+                if pos < len(labels):
+                    where = " BEFORE '%s'" % labels[pos].replace("'", "''")
+                stmts.append(PreTransactional(
+                    "ALTER TYPE %s ADD VALUE '%s'%s" % (
+                        self.qualname(), lbl.replace("'", "''"), where)))
+                labels.insert(pos, lbl)
+                pos += 1
+        stmts.append(super(Enum, self).alter(inenum))
+        return stmts
+
 
 class Domain(DbType):
     "A domain definition"
@@ -8,6 +8,7 @@
 """
 from pyrseas.dbobject import DbObjectDict, DbSchemaObject
 from pyrseas.dbobject import quote_id, split_schema_obj, commentable
+from pyrseas.dbobject import MAX_PG_IDENT_LEN
 
 
 def split_exprs(idx_exprs):
@@ -82,18 +83,19 @@ class Index(DbSchemaObject):
             del dct['access_method']
         return {self.name: dct}
 
-    @commentable
-    def create(self):
-        """Return a SQL statement to CREATE the index
+    def _concurrently(self):
+        """Return the CONCURRENTLY clause if the index is to be built online
 
-        :return: SQL statements
+        :return: string
         """
-        stmts = []
+        return 'CONCURRENTLY ' if getattr(self, '_online', False) else ''
 
-        # indexes defined by constraints are not to be dealt with as indexes
-        if getattr(self, '_for_constraint', None):
-            return stmts
+    def create_index(self, name=None):
+        """Return a CREATE INDEX statement for the index definition
 
+        :param name: name to give the index, if other than its own
+        :return: SQL statement
+        """
         unq = hasattr(self, 'unique') and self.unique
         acc = ''
         if hasattr(self, 'access_method') and self.access_method != 'btree':
@@ -104,10 +106,24 @@ class Index(DbSchemaObject):
         pred = ''
         if hasattr(self, 'predicate'):
             pred = '\n    WHERE %s' % self.predicate
-        stmts.append("CREATE %sINDEX %s ON %s %s(%s)%s%s" % (
-            'UNIQUE ' if unq else '', quote_id(self.name),
-            self.qualname(self.table), acc, self.key_expressions(), tblspc,
-            pred))
+        return "CREATE %sINDEX %s%s ON %s %s(%s)%s%s" % (
+            'UNIQUE ' if unq else '', self._concurrently(),
+            quote_id(name or self.name), self.qualname(self.table), acc,
+            self.key_expressions(), tblspc, pred)
+
+    @commentable
+    def create(self):
+        """Return a SQL statement to CREATE the index
+
+        :return: SQL statements
+        """
+        stmts = []
+
+        # indexes defined by constraints are not to be dealt with as indexes
+        if getattr(self, '_for_constraint', None):
+            return stmts
+
+        stmts.append(self.create_index())
         if hasattr(self, 'cluster') and self.cluster:
             stmts.append("CLUSTER %s USING %s" % (
                 self.qualname(self.table), quote_id(self.name)))
@@ -134,11 +150,21 @@ class Index(DbSchemaObject):
         if self.access_method != inindex.access_method \
                 or self.unique != inindex.unique \
                 or self.keys != inindex.keys:
-            stmts.append("DROP INDEX %s" % self.qualname())
             self.access_method = inindex.access_method
             self.unique = inindex.unique
             self.keys = inindex.keys
-            stmts.append(self.create())
+            if self._concurrently():
+                # build the new index alongside the old one, then swap
+                newname = self.name[:MAX_PG_IDENT_LEN - 4] + '_new'
+                stmts.append(self.create_index(newname))
+                stmts.append(self.drop())
+                stmts.append("ALTER INDEX %s RENAME TO %s" % (
+                    self.qualname(newname), quote_id(self.name)))
+                if self.description is not None:
+                    stmts.append(self.comment())
+            else:
+                stmts.append("DROP INDEX %s" % self.qualname())
+                stmts.append(self.create())
 
         base = "ALTER INDEX %s\n    " % self.qualname()
         if hasattr(inindex, 'tablespace'):
@@ -167,7 +193,10 @@ class Index(DbSchemaObject):
         if getattr(self, '_for_constraint', None):
             return []
 
-        return ["DROP INDEX %s" % self.identifier()]
+        # an index dropped online may be gone by then with its columns
+        return ["DROP INDEX %s%s" % (
+            self._concurrently() and 'CONCURRENTLY IF EXISTS ',
+            self.identifier())]
 
     def get_implied_deps(self, db):
         deps = super(Index, self).get_implied_deps(db)
@@ -185,11 +185,15 @@ class OperatorClassDict(DbObjectDict):
         opers = self.dbconn.fetchall(self.opquery)
         self.dbconn.rollback()
         for (sch, opc, idx, strat, oper) in opers:
+            if (sch, opc, idx) not in self:
+                continue
             opcls = self[(sch, opc, idx)]
             opcls.operators.update({strat: oper})
         funcs = self.dbconn.fetchall(self.prquery)
         self.dbconn.rollback()
         for (sch, opc, idx, supp, func) in funcs:
+            if (sch, opc, idx) not in self:
+                continue
             opcls = self[(sch, opc, idx)]
             opcls.functions.update({supp: func})
 
@@ -439,6 +439,7 @@ class Table(DbClass):
                 (stmt, descr) = self.columns[num].alter(incol)
                 if stmt:
                     stmts.append(base + stmt)
+                stmts.extend(self.columns[num].set_not_null_online(incol))
                 colprivs.append(self.columns[num].diff_privileges(incol))
                 if descr:
                     stmts.append(descr)
@@ -447,6 +448,8 @@ class Table(DbClass):
                     not hasattr(incol, 'inherited'):
                 (stmt, descr) = incol.add()
                 stmts.append(base + "ADD COLUMN %s" % stmt)
+                if getattr(incol, '_backfill', None):
+                    stmts.extend(incol.backfill())
                 colprivs.append(incol.add_privs())
                 if descr:
                     stmts.append(descr)
@@ -546,7 +549,8 @@ class Table(DbClass):
                         if hasattr(seq, 'owner_table'):
                             if not hasattr(self, '_owned_seqs'):
                                 self._owned_seqs = []
-                            self._owned_seqs.append(seq)
+                            if seq not in self._owned_seqs:
+                                self._owned_seqs.append(seq)
 
         for pname in getattr(self, 'inherits', ()):
             parent = db.tables.find(pname, self.schema)
@@ -694,6 +698,14 @@ QUERY_PRE93 = \
                   AND nspname != 'information_schema')
        ORDER BY nspname, relname"""
 
+SIZE_QUERY = \
+    """SELECT c.oid, pg_relation_size(c.oid) AS size,
+              reltuples::bigint AS tuples
+       FROM pg_class c JOIN pg_namespace ON (relnamespace = pg_namespace.oid)
+       WHERE relkind in ('r', 'm')
+             AND (nspname != 'pg_catalog'
+                  AND nspname != 'information_schema')"""
+
 OBJTYPES = ['table', 'sequence', 'view', 'materialized view']
 
 
@@ -759,11 +771,30 @@ class ClassDict(DbObjectDict):
         self.dbconn.rollback()
         for (tbl, partbl, num) in inhtbls:
             (sch, tbl) = split_schema_obj(tbl)
+            if (sch, tbl) not in self:
+                continue
             table = self[(sch, tbl)]
             if not hasattr(table, 'inherits'):
                 table.inherits = []
             table.inherits.append(partbl)
 
+    def fetch_sizes(self):
+        """Fetch the size and estimated number of rows of the tables
+
+        :return: dictionary of (bytes, rows) tuples, by qualified name
+
+        The size of the main fork of each table or materialized view,
+        as given by `pg_relation_size`, and the number of rows,
+        estimated in `pg_class.reltuples` by VACUUM and ANALYZE, are
+        fetched in a single query.
+        """
+        sizes = {}
+        for (oid, size, tuples) in self.dbconn.fetchall(SIZE_QUERY):
+            if oid in self.by_oid:
+                sizes[self.by_oid[oid].qualname()] = (size, tuples)
+        self.dbconn.rollback()
+        return sizes
+
     def from_map(self, schema, inobjs, newdb):
         """Initalize the dictionary of tables by converting the input map
 
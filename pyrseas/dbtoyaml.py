@@ -8,6 +8,7 @@ import sys
 from pyrseas import __version__
 from pyrseas.yamlutil import yamldump
 from pyrseas.database import Database
+from pyrseas.snapshot import RecordingConnection
 from pyrseas.cmdargs import cmd_parser, parse_args
 
 
@@ -38,6 +39,9 @@ def main(schema=None):
                        dest='excl_tables', action='append', default=[],
                        help="do NOT extract the named table(s) "
                        "(default none)")
+    parser.add_argument('--snapshot', metavar='FILE',
+                        help="also save the catalogs to FILE, for use by "
+                        "yamltodb --from-snapshot")
     parser.set_defaults(schema=schema)
     cfg = parse_args(parser)
     output = cfg['files']['output']
@@ -45,8 +49,16 @@ def main(schema=None):
     if options.multiple_files and output:
         parser.error("Cannot specify both --multiple-files and --output")
 
-    db = Database(cfg)
+    dbconn = None
+    if options.snapshot:
+        dbcfg = cfg['database']
+        dbconn = RecordingConnection(dbcfg['dbname'], dbcfg['username'],
+                                     dbcfg['password'], dbcfg['host'],
+                                     dbcfg['port'])
+    db = Database(cfg, dbconn)
     dbmap = db.to_map()
+    if options.snapshot:
+        dbconn.save(options.snapshot)
 
     if not options.multiple_files:
         print(yamldump(dbmap), file=output or sys.stdout)
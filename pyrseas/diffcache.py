@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.diffcache
+    ~~~~~~~~~~~~~~~~~
+
+    This module defines DiffCache, which keeps the statements
+    generated by `Database.diff_map` in files, removing the least
+    recently used when they exceed a given size, and a diff_map
+    function that returns the statements from the cache when the
+    catalogs, the input map and the options are the same as when they
+    were generated.
+"""
+import os
+import pickle
+import hashlib
+import tempfile
+
+from pyrseas.checkpoint import spec_hash
+from pyrseas.dbfingerprint import fingerprint, MIN_VERSION
+
+# Default maximum size of the files kept, in bytes
+MAX_SIZE = 64 * 1024 * 1024
+
+# Options that change the statements generated (not, e.g., diff_jobs,
+# which only changes how they are generated)
+DIFF_OPTIONS = ['schemas', 'tables', 'excl_schemas', 'excl_tables',
+                'revert', 'quote_reserved', 'online_indexes',
+                'online_constraints', 'online_columns', 'backfill_batch',
+                'coalesce_alters', 'by_schema']
+
+SUFFIX = '.diff'
+
+
+class DiffCache(object):
+    """Statements generated for a key, kept in files in a directory
+
+    Each entry is a pickled file, whose modification time is updated
+    when it is read.  After an entry is added, the least recently used
+    ones are removed until the total size of the files is at most the
+    maximum.  Files are written under a temporary name and renamed, so
+    a cache can be shared by concurrent processes.
+    """
+
+    def __init__(self, path, max_size=MAX_SIZE):
+        """Initialize the cache, creating its directory if needed
+
+        :param path: path of the directory holding the entries
+        :param max_size: maximum total size of the entries, in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def get(self, key):
+        """Return the value of an entry and mark it as recently used
+
+        :param key: key of the entry
+        :return: value, or None if there is no entry or it is unreadable
+        """
+        filename = self._file(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(filename, None)
+        except Exception:
+            return None
+        return value
+
+    def put(self, key, value):
+        """Add an entry and remove the least recently used if needed
+
+        :param key: key of the entry
+        :param value: value to be pickled
+        """
+        (fd, tmpname) = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, 2)
+            os.rename(tmpname, self._file(key))
+        except Exception:
+            os.remove(tmpname)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries over the maximum size"""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+
+def diff_key(catalog, version, input_map, options, datacopy=None):
+    """Return the key of the statements generated for a diff
+
+    :param catalog: fingerprint of the contents of the catalogs
+    :param version: server version number
+    :param input_map: a YAML map defining the new database
+    :param options: object holding the options
+    :param datacopy: dictionary of data copying info, from the
+        configuration
+    :return: string
+    """
+    opts = [(opt, getattr(options, opt, None)) for opt in DIFF_OPTIONS]
+    return hashlib.sha1(repr((catalog, version, spec_hash(input_map),
+                              opts, spec_hash(datacopy or {}))).encode(
+                                  'utf-8')).hexdigest()
+
+
+def diff_map(db, input_map, cache, catalog=None):
+    """Generate SQL to transform a database, unless generated before
+
+    :param db: a Database object, not yet loaded from the catalogs
+    :param input_map: a YAML map defining the new database
+    :param cache: DiffCache object
+    :param catalog: fingerprint of the catalogs, if already computed
+    :return: list of SQL statements
+
+    The cache is keyed by the fingerprint of the contents of the
+    catalogs (see :func:`pyrseas.dbfingerprint.fingerprint`), which
+    is the same for databases with identical schemas, the hash of the
+    input map, the server version, the options that affect the
+    statements and the data copying configuration.  The database is
+    connected to first, if needed, to get its version.  If an entry
+    is found, neither the catalogs nor the input map are loaded, and
+    the column type changes recorded with the statements are restored
+    to `db.type_changes`.  Otherwise,
+    `db.diff_map` generates the statements, which are then added to
+    the cache.  The fingerprint covers everything read from the
+    catalogs to generate the statements.  With the `estimate_costs`
+    option, which needs the objects loaded, or before PostgreSQL 9.3,
+    whose catalogs cannot be fingerprinted, the cache is not used.
+    """
+    opts = db.config['options']
+    if getattr(opts, 'estimate_costs', False):
+        return db.diff_map(input_map)
+    if db.dbconn.conn is None or db.dbconn.conn.closed:
+        db.dbconn.connect()
+    if db.dbconn.version < MIN_VERSION:
+        return db.diff_map(input_map)
+    if catalog is None:
+        catalog = fingerprint(db.dbconn)
+    key = diff_key(catalog, db.dbconn.version, input_map, opts,
+                   db.config.get('datacopy'))
+    entry = cache.get(key)
+    if entry is not None:
+        db.type_changes = entry['type_changes']
+        return entry['statements']
+    stmts = db.diff_map(input_map)
+    cache.put(key, {'statements': stmts, 'type_changes': db.type_changes})
+    return stmts
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.lockplan
+    ~~~~~~~~~~~~~~~~
+
+    This module classifies the generated SQL statements by the table
+    lock they acquire, and defines LockPlanner, which executes them
+    with a lock timeout and retries those that time out.
+"""
+from __future__ import print_function
+import re
+import sys
+import time
+
+from pyrseas.dbobject import quote_id
+
+ACCESS_SHARE = 'ACCESS SHARE'
+ROW_SHARE = 'ROW SHARE'
+ROW_EXCLUSIVE = 'ROW EXCLUSIVE'
+SHARE_UPDATE_EXCLUSIVE = 'SHARE UPDATE EXCLUSIVE'
+SHARE = 'SHARE'
+SHARE_ROW_EXCLUSIVE = 'SHARE ROW EXCLUSIVE'
+EXCLUSIVE = 'EXCLUSIVE'
+ACCESS_EXCLUSIVE = 'ACCESS EXCLUSIVE'
+LOCK_LEVELS = (ACCESS_SHARE, ROW_SHARE, ROW_EXCLUSIVE, SHARE_UPDATE_EXCLUSIVE,
+               SHARE, SHARE_ROW_EXCLUSIVE, EXCLUSIVE, ACCESS_EXCLUSIVE)
+
+# Lock levels that conflict with ROW EXCLUSIVE, i.e., that block
+# INSERT, UPDATE and DELETE on the table while they are held or waited
+# for.
+BLOCKS_WRITES = (SHARE, SHARE_ROW_EXCLUSIVE, EXCLUSIVE, ACCESS_EXCLUSIVE)
+
+# SQLSTATE raised when lock_timeout expires
+LOCK_NOT_AVAILABLE = '55P03'
+
+REL = r'((?:"[^"]+"|[\w$]+)(?:\.(?:"[^"]+"|[\w$]+))?)'
+
+# (pattern, lock level) pairs, the first matching pattern applies and
+# its first group, if any, is the relation locked
+LOCK_PATTERNS = [
+    (r'CREATE (?:UNIQUE )?INDEX CONCURRENTLY .*? ON (?:ONLY )?' + REL,
+     SHARE_UPDATE_EXCLUSIVE),
+    (r'CREATE (?:UNIQUE )?INDEX .*? ON (?:ONLY )?' + REL, SHARE),
+    (r'DROP INDEX CONCURRENTLY (?:IF EXISTS )?' + REL,
+     SHARE_UPDATE_EXCLUSIVE),
+    (r'ALTER TABLE (?:ONLY )?' + REL + r'\s+VALIDATE CONSTRAINT \S+$',
+     SHARE_UPDATE_EXCLUSIVE),
+    (r'ALTER TABLE (?:ONLY )?' + REL + r'\s+ALTER COLUMN \S+ '
+     r'SET STATISTICS -?\d+$', SHARE_UPDATE_EXCLUSIVE),
+    (r'ALTER TABLE (?:ONLY )?' + REL + r'\s+ADD CONSTRAINT \S+ FOREIGN KEY '
+     r'\([^)]*\) REFERENCES [^(]+\([^)]*\)[\w ]*$', SHARE_ROW_EXCLUSIVE),
+    (r'CREATE (?:CONSTRAINT )?TRIGGER .*? ON ' + REL, SHARE_ROW_EXCLUSIVE),
+    (r'(?:CREATE|CREATE OR REPLACE) RULE .*? TO ' + REL, ACCESS_EXCLUSIVE),
+    (r'REFRESH MATERIALIZED VIEW CONCURRENTLY ' + REL, EXCLUSIVE),
+    (r'(?:ALTER|DROP|REFRESH) (?:TABLE|INDEX|SEQUENCE|VIEW|MATERIALIZED VIEW|'
+     r'FOREIGN TABLE) (?:IF EXISTS )?(?:ONLY )?' + REL, ACCESS_EXCLUSIVE),
+    (r'CREATE OR REPLACE VIEW ' + REL, ACCESS_EXCLUSIVE),
+    (r'TRUNCATE (?:ONLY )?' + REL, ACCESS_EXCLUSIVE),
+    (r'COMMENT ON ', SHARE_UPDATE_EXCLUSIVE),
+    (r'(?:UPDATE|INSERT INTO|DELETE FROM) (?:ONLY )?' + REL, ROW_EXCLUSIVE),
+    (r'(?:WITH|DO)\b', ROW_EXCLUSIVE)]
+LOCK_RULES = [(re.compile(pattern, re.DOTALL), level)
+              for (pattern, level) in LOCK_PATTERNS]
+
+ACTIVITY_QUERY = \
+    """SELECT schemaname, relname, seq_scan + coalesce(idx_scan, 0)
+              + n_tup_ins + n_tup_upd + n_tup_del
+       FROM pg_stat_user_tables"""
+
+
+def lock_level(stmt):
+    """Return the table lock acquired by a statement
+
+    :param stmt: SQL statement or data copy tuple
+    :return: tuple of lock level and relation, either may be None
+
+    The relation is given as in the statement, i.e., qualified by its
+    schema unless it's in ``public``.  Statements that only create
+    new objects or change privileges are assumed not to conflict with
+    other sessions and return ``(None, None)``.
+    """
+    if isinstance(stmt, tuple):
+        # expected format: (\copy, table, from, path, csv)
+        return (ROW_EXCLUSIVE, stmt[1])
+    for (pattern, level) in LOCK_RULES:
+        match = pattern.match(stmt)
+        if match:
+            return (level, match.group(1) if match.groups() else None)
+    return (None, None)
+
+
+def fetch_activity(dbconn):
+    """Fetch a measure of how busy each table is
+
+    :param dbconn: a DbConnection object
+    :return: dictionary of number of scans and rows changed, by table
+
+    The tables are keyed as :func:`lock_level` returns them.
+    """
+    activity = {}
+    for (sch, tbl, count) in dbconn.fetchall(ACTIVITY_QUERY):
+        key = quote_id(tbl) if sch == 'public' else "%s.%s" % (
+            quote_id(sch), quote_id(tbl))
+        activity[key] = count
+    return activity
+
+
+def order_levels(levels, activity):
+    """Postpone the groups of statements that lock the busiest tables
+
+    :param levels: iterable of levels, as from `Database.diff_map_levels`
+    :param activity: dictionary as returned by :func:`fetch_activity`
+    :return: generator of levels
+
+    The groups within a level are independent of each other, so they
+    are sorted so that those that block writes to the busiest tables
+    come last, which shortens the time those locks are held before
+    the transaction is committed.  The levels, and the statements of
+    each group, are left in their order.
+    """
+    def busiest(group):
+        score = 0
+        for stmt in group:
+            (level, rel) = lock_level(stmt)
+            if level in BLOCKS_WRITES:
+                score = max(score, activity.get(rel, 0))
+        return score
+
+    for level in levels:
+        yield sorted(level, key=busiest)
+
+
+class LockPlanner(object):
+    """Executes statements with a lock timeout, retrying on timeouts
+
+    Statements that block writes to a table are executed with
+    ``lock_timeout`` set, so that, rather than queueing behind a long
+    running query and making every other session queue behind them,
+    they give up and are retried after a delay, doubled at each
+    attempt.  Within a transaction, such statements are preceded by a
+    savepoint, so that only the statement is rolled back on a timeout.
+    The other statements are executed without a timeout.
+    """
+
+    def __init__(self, timeout, retries=3, delay=1.0):
+        """Initialize the planner
+
+        :param timeout: lock timeout in milliseconds
+        :param retries: number of times to retry a statement
+        :param delay: seconds to wait before the first retry
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.delay = delay
+        self._settings = {}
+
+    def execute(self, dbconn, stmt):
+        """Execute a statement, retrying it if it times out on a lock
+
+        :param dbconn: a DbConnection object
+        :param stmt: SQL statement
+        """
+        if dbconn.conn is None or dbconn.conn.closed:
+            dbconn.connect()
+        (level, rel) = lock_level(stmt)
+        timeout = self.timeout if level in BLOCKS_WRITES else 0
+        savepoint = timeout and not dbconn.conn.autocommit
+        curs = dbconn.conn.cursor()
+        try:
+            if self._settings.get(id(dbconn.conn)) != timeout:
+                curs.execute("SET lock_timeout = %d" % timeout)
+                self._settings[id(dbconn.conn)] = timeout
+            attempt = 0
+            while True:
+                if savepoint:
+                    curs.execute("SAVEPOINT pyrseas_lock")
+                try:
+                    curs.execute(stmt)
+                except Exception as exc:
+                    if getattr(exc, 'pgcode', None) != LOCK_NOT_AVAILABLE \
+                            or attempt >= self.retries:
+                        raise
+                    if savepoint:
+                        curs.execute("ROLLBACK TO SAVEPOINT pyrseas_lock")
+                    wait = self.delay * 2 ** attempt
+                    attempt += 1
+                    print("Lock timeout on %s, retrying in %g seconds" % (
+                        rel, wait), file=sys.stderr)
+                    time.sleep(wait)
+                    continue
+                if savepoint:
+                    curs.execute("RELEASE SAVEPOINT pyrseas_lock")
+                break
+        except:
+            # the setting is undone if the transaction is rolled back
+            self._settings.pop(id(dbconn.conn), None)
+            raise
+        finally:
+            curs.close()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""pyrseasd - serve extract, diff and apply requests for PostgreSQL
+databases over a UNIX socket, keeping their catalogs in memory"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import socket
+import threading
+from argparse import ArgumentParser, Namespace
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import yaml
+
+from pyrseas import __version__
+from pyrseas.yamlutil import yamldump
+from pyrseas.database import Database
+from pyrseas.dbobject import stmt_phase, POST_TRANSACTION
+from pyrseas.dbobject.column import BACKFILL_BATCH
+from pyrseas.checkpoint import FINGERPRINT_QUERY
+from pyrseas import changelog
+from pyrseas.snapshot import RecordingConnection
+from pyrseas.yamltodb import _execute
+
+DEFAULT_SOCKET = '/tmp/.s.pyrseasd'
+
+# Options that a request can give, with their default values
+OPTIONS = {'schemas': [], 'excl_schemas': [], 'tables': [],
+           'excl_tables': [], 'no_owner': False, 'no_privs': False,
+           'quote_reserved': False, 'revert': False,
+           'online_indexes': False, 'online_constraints': False,
+           'online_columns': False, 'backfill_batch': BACKFILL_BATCH,
+           'coalesce_alters': False}
+
+
+def _options(reqopts):
+    """Return the options of a request, filled in with the defaults
+
+    :param reqopts: dictionary of options given by the request
+    :return: Namespace object, as from parsing command line arguments
+    """
+    opts = dict(OPTIONS, multiple_files=False)
+    for (key, val) in list(reqopts.items()):
+        if key not in OPTIONS:
+            raise KeyError("Unrecognized option: %s" % key)
+        opts[key] = val
+    return Namespace(**opts)
+
+
+def _apply(dbconn, stmts):
+    """Execute statements, committing those of the transaction together
+
+    :param dbconn: database connection
+    :param stmts: list of statements, as from `Database.diff_map`
+    """
+    post = []
+    try:
+        for stmt in stmts:
+            if stmt_phase(stmt) == POST_TRANSACTION:
+                post.append(stmt)
+            else:
+                _execute(dbconn, stmt)
+        dbconn.commit()
+    except Exception:
+        dbconn.rollback()
+        raise
+    for stmt in post:
+        _execute(dbconn, stmt)
+
+
+class CatalogCache(object):
+    """The catalogs of a database, kept between requests
+
+    A single connection to the database is kept open and used by all
+    the requests.  The results of the catalog queries are kept in
+    memory.  While a :class:`pyrseas.changelog.Listener` is listening
+    and the event triggers of :mod:`pyrseas.changelog` are enabled,
+    the catalogs are queried again only after a change is notified.
+    Otherwise, each request first checks a fingerprint of the catalogs
+    (see :mod:`pyrseas.checkpoint`), a single query, and only if it
+    has changed are the catalogs queried again.  The `Database`
+    objects used to answer the
+    requests are built from the results kept, so that the objects
+    altered while generating SQL are never shared between requests.
+    The specifications extracted are also kept until the catalogs
+    change.
+
+    If the DDL log of :mod:`pyrseas.changelog` is used, the
+    specifications are instead kept as maps, and only the schemas
+    named in the log since they were extracted are loaded again to
+    bring them up to date.  While a :class:`pyrseas.changelog.Listener`
+    is listening, the schemas changed are instead those notified by
+    the event triggers, and neither the log nor the fingerprint are
+    queried until a change is notified.
+    """
+
+    def __init__(self, dbcfg, ddl_log=False):
+        """Initialize the cache
+
+        :param dbcfg: database configuration dictionary
+        :param ddl_log: whether to install and use the DDL log
+        """
+        self.dbcfg = dbcfg
+        self.dbconn = RecordingConnection(
+            dbcfg['dbname'], dbcfg['username'], dbcfg['password'],
+            dbcfg['host'], dbcfg['port'])
+        self.dbconn.keep_open = True
+        self.lock = threading.Lock()
+        self._fingerprint = None
+        self._catalog = None
+        self._specs = {}
+        self.ddl_log = ddl_log
+        self._horizon = None
+        self._maps = {}
+        self.listener = None
+        self._pending_lock = threading.Lock()
+        self._pending = set()
+        self._pending_global = False
+        self._unsure = True
+        self._catalog_stale = True
+        self._notifying = False
+        self._check_triggers = True
+        if ddl_log:
+            changelog.install(self.dbconn)
+
+    def listen(self):
+        """Start listening for the changes notified by the event triggers
+        """
+        self.listener = changelog.Listener(self.dbcfg, self.notified)
+        self.listener.start()
+
+    def _listening(self):
+        return self.listener is not None and self.listener.listening
+
+    def notified(self, notifies):
+        """Mark the schemas of the objects changed as stale
+
+        :param notifies: list of notifications, or None if some may
+            have been missed
+        """
+        with self._pending_lock:
+            self._catalog_stale = True
+            if notifies is None:
+                self._unsure = True
+                self._check_triggers = True
+                return
+            (schemas, dbwide) = changelog.classify(notifies)
+            if schemas is None or self._pending is None:
+                self._pending = None
+            else:
+                self._pending |= schemas
+            self._pending_global = self._pending_global or dbwide
+
+    def _config(self, options):
+        return {'database': self.dbcfg, 'files': {}, 'options': options}
+
+    def invalidate(self):
+        """Query the catalogs again on the next request"""
+        self._fingerprint = None
+        self._catalog_stale = True
+
+    def _load(self):
+        """Query the catalogs and keep the results"""
+        self.dbconn.clear()
+        Database(self._config(_options({})), self.dbconn).from_catalog()
+        self._catalog = self.dbconn.snapshot()
+        self.dbconn.clear()
+        self._specs = {}
+
+    def catalog(self):
+        """Return a connection answering the catalog queries
+
+        :return: SnapshotConnection
+        """
+        with self._pending_lock:
+            if self._notifying and self._listening() and \
+                    not self._catalog_stale:
+                return self._catalog
+            self._catalog_stale = False
+            check = self._check_triggers
+            self._check_triggers = False
+        try:
+            if check:
+                self._notifying = changelog.notifying(self.dbconn)
+            fingerprint = None
+            if not (self._notifying and self._listening()):
+                fingerprint = self.dbconn.fetchone(FINGERPRINT_QUERY)[0]
+                self.dbconn.rollback()
+            if self._catalog is None or fingerprint is None or \
+                    fingerprint != self._fingerprint:
+                self._load()
+                self._fingerprint = fingerprint
+        except Exception:
+            with self._pending_lock:
+                self._catalog_stale = True
+                self._check_triggers = self._check_triggers or check
+            raise
+        return self._catalog
+
+    def extract(self, reqopts):
+        """Return the YAML specification of the database
+
+        :param reqopts: dictionary of options
+        :return: YAML text
+        """
+        key = json.dumps(reqopts, sort_keys=True)
+        if self.ddl_log:
+            return self._extract_logged(key, reqopts)
+        catalog = self.catalog()
+        if key not in self._specs:
+            db = Database(self._config(_options(reqopts)), catalog)
+            self._specs[key] = yamldump(db.to_map())
+        return self._specs[key]
+
+    def _extract_logged(self, key, reqopts):
+        """Return the specification, updated with the changes logged
+
+        :param key: key of the specification in the cache
+        :param reqopts: dictionary of options
+        :return: YAML text
+        """
+        with self._pending_lock:
+            (schemas, dbwide) = (self._pending, self._pending_global)
+            unsure = self._unsure or not self._listening()
+            self._pending = set()
+            self._pending_global = False
+            self._unsure = False
+        if unsure:
+            (self._horizon, logged, logged_global) = changelog.changes(
+                self.dbconn, self._horizon)
+            schemas = None if schemas is None or logged is None \
+                else schemas | logged
+            dbwide = dbwide or logged_global
+        try:
+            if schemas is None or schemas or dbwide:
+                try:
+                    for (mapkey, (dbmap, _)) in list(self._maps.items()):
+                        db = Database(self._config(
+                            _options(json.loads(mapkey))), self.dbconn)
+                        dbmap = db.refresh_map(dbmap, schemas, dbwide)
+                        self._maps[mapkey] = (dbmap, yamldump(dbmap))
+                except Exception:
+                    # the changes would be lost
+                    self._maps = {}
+                    raise
+            if key not in self._maps:
+                dbmap = Database(self._config(_options(reqopts)),
+                                 self.dbconn).to_map()
+                self._maps[key] = (dbmap, yamldump(dbmap))
+        finally:
+            # only the results of a full load are kept
+            self.dbconn.clear()
+        return self._maps[key][1]
+
+    def diff(self, spec, reqopts):
+        """Return the statements to update the database to a specification
+
+        :param spec: a YAML map defining the new database
+        :param reqopts: dictionary of options
+        :return: list of SQL statements
+        """
+        db = Database(self._config(_options(reqopts)), self.catalog())
+        return db.diff_map(spec)
+
+    def apply(self, spec, reqopts):
+        """Update the database to match a specification
+
+        :param spec: a YAML map defining the new database
+        :param reqopts: dictionary of options
+        :return: list of SQL statements executed
+        """
+        stmts = self.diff(spec, reqopts)
+        try:
+            _apply(self.dbconn, stmts)
+        finally:
+            self.invalidate()
+        return stmts
+
+
+def handle_request(caches, request):
+    """Answer a request
+
+    :param caches: dictionary of CatalogCache objects, by database name
+    :param request: dictionary holding the request
+    :return: dictionary holding the response
+
+    The request has a `command`, one of 'extract', 'diff' or 'apply',
+    the `dbname` it applies to, the `spec`, as YAML text, for the
+    latter two commands, and optionally a dictionary of `options`.
+    """
+    try:
+        cache = caches[request['dbname']]
+    except KeyError:
+        raise KeyError("Database not served: %s" % request.get('dbname'))
+    command = request.get('command')
+    reqopts = request.get('options') or {}
+    with cache.lock:
+        if command == 'extract':
+            return {'spec': cache.extract(reqopts)}
+        if command not in ('diff', 'apply'):
+            raise ValueError("Unrecognized command: %s" % command)
+        spec = yaml.safe_load(request['spec'])
+        if command == 'diff':
+            stmts = cache.diff(spec, reqopts)
+        else:
+            stmts = cache.apply(spec, reqopts)
+    return {'statements': [{'statement': "".join(stmt) if isinstance(
+        stmt, tuple) else stmt, 'phase': stmt_phase(stmt)} for stmt in stmts]}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Reads requests, one JSON object per line, and writes responses"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = handle_request(self.server.caches,
+                                          json.loads(line.decode('utf-8')))
+            except (Exception, SystemExit) as exc:
+                # str() of a KeyError would quote its message
+                response = {'error': str(exc.args[0]) if isinstance(
+                    exc, KeyError) and exc.args else str(exc)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves requests on a UNIX socket, each in its own thread"""
+
+    daemon_threads = True
+
+    def __init__(self, path, caches):
+        """Bind the socket
+
+        :param path: path of the socket
+        :param caches: dictionary of CatalogCache objects, by database
+        """
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.caches = caches
+
+
+def request(command, dbname, spec=None, options=None, path=DEFAULT_SOCKET):
+    """Send a request to pyrseasd and return its response
+
+    :param command: 'extract', 'diff' or 'apply'
+    :param dbname: database name
+    :param spec: YAML specification text, for 'diff' and 'apply'
+    :param options: dictionary of options
+    :param path: path of the socket
+    :return: dictionary holding the response
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall((json.dumps({
+            'command': command, 'dbname': dbname, 'spec': spec,
+            'options': options or {}}) + '\n').encode('utf-8'))
+        response = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+    finally:
+        sock.close()
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
+
+
+def main():
+    """Serve requests for the named databases."""
+    parser = ArgumentParser(description="Serve extract, diff and apply "
+                            "requests for PostgreSQL databases over a UNIX "
+                            "socket")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + '%s' % __version__)
+    parser.add_argument('dbnames', nargs='+', metavar='dbname',
+                        help='database name')
+    group = parser.add_argument_group('Connection options')
+    group.add_argument('-H', '--host', help="database server host")
+    group.add_argument('-p', '--port', type=int,
+                       help="database server port")
+    group.add_argument('-U', '--username', help="database user name")
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET,
+                        help="path of the socket (default %(default)s)")
+    parser.add_argument('--ddl-log', action='store_true',
+                        help="install a log of DDL commands in the databases "
+                        "and extract only the schemas it names")
+    options = parser.parse_args()
+
+    if os.path.exists(options.socket):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(options.socket)
+        except socket.error:
+            # left behind by a server that is no longer running
+            os.remove(options.socket)
+        else:
+            sys.exit("Socket %s is in use" % options.socket)
+        finally:
+            sock.close()
+    caches = {}
+    for dbname in options.dbnames:
+        caches[dbname] = CatalogCache({
+            'dbname': dbname, 'host': options.host, 'port': options.port,
+            'username': options.username, 'password': None},
+            options.ddl_log)
+        caches[dbname].listen()
+    # only the user running the server may connect to the socket
+    umask = os.umask(0o077)
+    try:
+        server = Server(options.socket, caches)
+    finally:
+        os.umask(umask)
+    print("Listening on %s" % options.socket, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(options.socket)
+
+if __name__ == '__main__':
+    main()
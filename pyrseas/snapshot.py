@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    pyrseas.snapshot
+    ~~~~~~~~~~~~~~~~
+
+    This module defines the catalog connections RecordingConnection,
+    which records the results of the queries made by `Database` so
+    that they can be saved to a snapshot file, SnapshotConnection,
+    which answers the same queries from the file, without a server,
+    and MapConnection, used to compare two maps without a server.
+"""
+import pickle
+
+from pyrseas.lib.pycompat import strtypes
+from pyrseas.database import CatDbConnection, LANG_TEMPLATES_QUERY
+from pyrseas.dbobject import RESERVED_WORDS_QUERY
+from pyrseas.dbobject.column import BINARY_CASTS_QUERY
+from pyrseas.dbobject.column import VOLATILE_FUNCTIONS_QUERY
+
+SNAPSHOT_FORMAT = 1
+
+# Server version assumed when comparing two maps
+MAP_VERSION = 120000
+
+# Procedural languages with a template in a standard installation
+LANG_TEMPLATES = ['plpgsql', 'pltcl', 'pltclu', 'plperl', 'plperlu',
+                  'plpythonu', 'plpython2u', 'plpython3u']
+
+# Volatile functions of a standard installation that are commonly
+# used in column defaults
+VOLATILE_FUNCTIONS = ['clock_timestamp', 'gen_random_uuid', 'nextval',
+                      'random', 'timeofday', 'txid_current',
+                      'uuid_generate_v1', 'uuid_generate_v4']
+
+# Queries made when generating SQL, rather than when reading the
+# catalogs, whose results are also saved in a snapshot
+DIFF_QUERIES = [RESERVED_WORDS_QUERY, LANG_TEMPLATES_QUERY,
+                BINARY_CASTS_QUERY, VOLATILE_FUNCTIONS_QUERY]
+
+
+def _key(query, args):
+    """Return the key of the results of a query
+
+    :param query: text of the query
+    :param args: arguments to the query
+    :return: tuple
+    """
+    return (query, repr(args))
+
+
+class Row(list):
+    """A result row, whose values can be accessed by column name"""
+
+    def __init__(self, values, columns):
+        super(Row, self).__init__(values)
+        self._columns = columns
+
+    def __getitem__(self, key):
+        if isinstance(key, strtypes):
+            key = self._columns.index(key)
+        return super(Row, self).__getitem__(key)
+
+    def keys(self):
+        return list(self._columns)
+
+    def items(self):
+        return list(zip(self._columns, self))
+
+
+class RecordingConnection(CatDbConnection):
+    """A catalog connection that records the results of its queries"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingConnection, self).__init__(*args, **kwargs)
+        self._results = {}
+
+    def _record(self, query, args, rows):
+        columns = list(rows[0].keys()) if rows else []
+        self._results[_key(query, args)] = (columns,
+                                            [list(row) for row in rows])
+
+    def fetchone(self, query, args=None):
+        row = super(RecordingConnection, self).fetchone(query, args)
+        self._record(query, args, [] if row is None else [row])
+        return row
+
+    def fetchall(self, query, args=None):
+        rows = super(RecordingConnection, self).fetchall(query, args)
+        self._record(query, args, rows)
+        return rows
+
+    def clear(self):
+        """Forget the results recorded so far"""
+        self._results = {}
+
+    def record_diff_queries(self):
+        """Fetch and record the results of the `DIFF_QUERIES`
+
+        A query that fails, e.g., on a catalog that doesn't exist in
+        this server version, is left out.
+        """
+        for query in DIFF_QUERIES:
+            try:
+                self.fetchall(query)
+            except Exception:
+                # the transaction has been rolled back
+                pass
+        self.rollback()
+
+    def snapshot(self):
+        """Return a connection answering the queries recorded so far
+
+        :return: SnapshotConnection
+
+        The results of the `DIFF_QUERIES` are fetched and recorded
+        first.
+        """
+        self.record_diff_queries()
+        return SnapshotConnection(self.dbname, self.version,
+                                  dict(self._results))
+
+    def save(self, path):
+        """Save the results recorded to a snapshot file
+
+        :param path: path of the file to write
+
+        The results of the `DIFF_QUERIES` are fetched and recorded
+        first.
+        """
+        self.record_diff_queries()
+        self.close()
+        with open(path, 'wb') as f:
+            pickle.dump({'format': SNAPSHOT_FORMAT, 'dbname': self.dbname,
+                         'version': self.version, 'results': self._results},
+                        f, 2)
+
+
+class SnapshotConnection(CatDbConnection):
+    """A catalog connection that answers queries from a snapshot file
+
+    Only the queries made when the snapshot was taken, i.e., those
+    that read the catalogs and generate SQL, can be answered, so the
+    connection can be shared by several `Database` objects.  Any
+    other query, and any attempt to connect to the server, raise an
+    error.
+    """
+
+    def __init__(self, dbname, version, results):
+        """Initialize the connection
+
+        :param dbname: database name
+        :param version: server version number
+        :param results: dictionary of query results, as recorded by
+            `RecordingConnection`
+        """
+        super(SnapshotConnection, self).__init__(dbname)
+        self._version = version
+        self._results = results
+
+    @classmethod
+    def load(cls, path):
+        """Load a snapshot file
+
+        :param path: path of the file written by `RecordingConnection`
+        :return: SnapshotConnection
+        """
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if not isinstance(snapshot, dict) or \
+                snapshot.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError("Unsupported snapshot format in %s" % path)
+        return cls(snapshot['dbname'], snapshot['version'],
+                   snapshot['results'])
+
+    def connect(self):
+        raise RuntimeError("A snapshot cannot connect to the database")
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def fetchone(self, query, args=None):
+        rows = self.fetchall(query, args)
+        return rows[0] if rows else None
+
+    def fetchall(self, query, args=None):
+        try:
+            (columns, rows) = self._results[_key(query, args)]
+        except KeyError:
+            raise KeyError("Query not in snapshot: %s" %
+                           query.strip().split('\n')[0])
+        return [Row(row, columns) for row in rows]
+
+
+class MapConnection(SnapshotConnection):
+    """A catalog connection for comparing two maps, without a server
+
+    The language templates are those of a standard installation, the
+    volatile functions are the usual ones of a standard installation
+    and any other query, e.g., for the binary coercible casts, returns
+    no rows.
+    """
+
+    def __init__(self, version=MAP_VERSION):
+        """Initialize the connection
+
+        :param version: server version number to generate SQL for
+        """
+        super(MapConnection, self).__init__(None, version, {
+            _key(LANG_TEMPLATES_QUERY, None): (
+                ['tmplname'], [[lang] for lang in LANG_TEMPLATES]),
+            _key(VOLATILE_FUNCTIONS_QUERY, None): (
+                ['proname'], [[func] for func in VOLATILE_FUNCTIONS])})
+
+    def fetchall(self, query, args=None):
+        (columns, rows) = self._results.get(_key(query, args), ([], []))
+        return [Row(row, columns) for row in rows]
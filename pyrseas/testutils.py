@@ -377,7 +377,10 @@ class InputMapToSqlTestCase(PyrseasTestCase):
     superuser = False
 
     def to_sql(self, inmap, stmts=None, config={}, superuser=False, schemas=[],
-               revert=False, quote_reserved=False):
+               revert=False, quote_reserved=False, diff_jobs=1,
+               by_schema=False, online_indexes=False, coalesce_alters=False,
+               online_constraints=False, online_columns=False,
+               backfill_batch=10000, estimate_costs=False):
         """Execute statements and compare database to input map.
 
         :param inmap: dictionary defining target database
@@ -387,6 +390,14 @@ class InputMapToSqlTestCase(PyrseasTestCase):
         :param schemas: list of schemas to diff
         :param revert: generate statements to back out changes
         :param quote_reserved: fetch reserved words
+        :param diff_jobs: number of worker processes to generate SQL
+        :param by_schema: process one group of schemas at a time
+        :param online_indexes: create and drop indexes concurrently
+        :param coalesce_alters: merge ALTER TABLE statements on each table
+        :param online_constraints: add constraints NOT VALID, then validate
+        :param online_columns: fill new NOT NULL columns in batches
+        :param backfill_batch: number of rows in each batch
+        :param estimate_costs: record the cost of changes to tables
         :return: list of SQL statements
         """
         if (self.superuser or superuser) and not self.db.is_superuser():
@@ -400,7 +411,14 @@ class InputMapToSqlTestCase(PyrseasTestCase):
             self.cfg.merge({'files': {'data_path': os.path.join(
                             TEST_DIR, self.cfg['repository']['data'])}})
         self.config_options(schemas=schemas, revert=revert,
-                            quote_reserved=quote_reserved)
+                            quote_reserved=quote_reserved,
+                            diff_jobs=diff_jobs, by_schema=by_schema,
+                            online_indexes=online_indexes,
+                            coalesce_alters=coalesce_alters,
+                            online_constraints=online_constraints,
+                            online_columns=online_columns,
+                            backfill_batch=backfill_batch,
+                            estimate_costs=estimate_costs)
         self.cfg.merge(config)
         return self.database().diff_map(inmap)
 
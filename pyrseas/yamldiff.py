@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""yamldiff - generate SQL statements to transform the schema specified
+in a YAML file into the one specified in another, without a database"""
+
+from __future__ import print_function
+import sys
+from argparse import ArgumentParser, FileType
+
+import yaml
+
+from pyrseas import __version__
+from pyrseas.database import Database
+from pyrseas.dbobject import stmt_phase, Backfill
+from pyrseas.dbobject import PRE_TRANSACTION, TRANSACTION, POST_TRANSACTION
+from pyrseas.dbobject.column import BACKFILL_BATCH
+from pyrseas.snapshot import MapConnection, MAP_VERSION
+from pyrseas.yamltodb import _format
+
+
+def diff_maps(old_map, new_map, options, version=MAP_VERSION):
+    """Generate SQL to transform the database defined by a map to another
+
+    :param old_map: a YAML map defining the existing database
+    :param new_map: a YAML map defining the new database
+    :param options: object holding the options, as parsed by `main`
+    :param version: server version number to generate SQL for
+    :return: list of SQL statements
+
+    The batches filling a column added online are output as a ``DO``
+    block, which can only commit on PostgreSQL 11 or later, so for
+    earlier versions the generation stops with an error.
+    """
+    db = Database({'options': options}, MapConnection(version))
+    stmts = db.diff_maps(old_map, new_map)
+    for stmt in stmts:
+        if isinstance(stmt, Backfill) and version < 110000:
+            sys.exit("Cannot output the batches filling %s for PostgreSQL "
+                     "before 11: use yamltodb --update to execute them" %
+                     stmt.table)
+    return stmts
+
+
+def main():
+    """Compare two YAML specifications and output SQL."""
+    parser = ArgumentParser(description="Generate SQL statements to "
+                            "transform the schema specified in a YAML file "
+                            "into the one specified in another")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + '%s' % __version__)
+    parser.add_argument('old', type=FileType('r'),
+                        help='YAML specification of the existing schema')
+    parser.add_argument('new', type=FileType('r'),
+                        help='YAML specification of the new schema')
+    parser.add_argument('-o', '--output', type=FileType('w'),
+                        help="output file name (default stdout)")
+    parser.add_argument('-1', '--single-transaction', action='store_true',
+                        dest='onetrans', help="wrap commands in BEGIN/COMMIT")
+    parser.add_argument('--server-version', metavar='NUM', type=int,
+                        default=MAP_VERSION,
+                        help="generate SQL for this PostgreSQL version "
+                        "number (default %(default)s)")
+    parser.add_argument('--online-indexes', action='store_true',
+                        help="create and drop indexes concurrently, "
+                        "outside the transaction")
+    parser.add_argument('--online-constraints', action='store_true',
+                        help="add foreign keys and check constraints as "
+                        "NOT VALID and validate them after the transaction")
+    parser.add_argument('--online-columns', action='store_true',
+                        help="add NOT NULL columns with defaults as "
+                        "nullable and fill them in batches")
+    parser.add_argument('--backfill-batch', metavar='N', type=int,
+                        default=BACKFILL_BATCH,
+                        help="rows to fill in each transaction "
+                        "(default %(default)s)")
+    parser.add_argument('--coalesce-alters', action='store_true',
+                        help="merge ALTER TABLE statements on each table")
+    parser.set_defaults(schemas=[], revert=False, quote_reserved=False)
+    options = parser.parse_args()
+
+    old_map = yaml.safe_load(options.old)
+    new_map = yaml.safe_load(options.new)
+    stmts = diff_maps(old_map, new_map, options, options.server_version)
+
+    fd = options.output or sys.stdout
+    intrans = False
+    post = []
+    for stmt in stmts:
+        phase = stmt_phase(stmt)
+        if phase == POST_TRANSACTION:
+            # output after the transaction is committed
+            post.append(stmt)
+            continue
+        if phase == PRE_TRANSACTION and intrans:
+            print("COMMIT;", file=fd)
+            intrans = False
+        elif phase == TRANSACTION and options.onetrans and not intrans:
+            print("BEGIN;", file=fd)
+            intrans = True
+        print(_format(stmt), file=fd)
+    if intrans:
+        print("COMMIT;", file=fd)
+    for stmt in post:
+        print(_format(stmt), file=fd)
+    if options.output:
+        options.output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""yamlfanout - update many PostgreSQL databases concurrently to match
+the schema specified in a YAML file"""
+
+from __future__ import print_function
+import sys
+import copy
+import threading
+from argparse import ArgumentParser, FileType
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+from pyrseas import __version__
+from pyrseas.database import Database, CatDbConnection
+from pyrseas.dbfingerprint import fingerprint, MIN_VERSION
+from pyrseas.pyrseasd import _options, _apply
+from pyrseas.diffcache import DiffCache, diff_map, MAX_SIZE
+
+
+class StatementCache(object):
+    """The statements generated for each catalog fingerprint
+
+    Databases with the same fingerprint have the same schema, so the
+    statements generated for the first one apply to all of them.
+    While the statements for a fingerprint are being generated, the
+    threads needing the same ones wait for them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._stmts = {}
+        self._pending = {}
+
+    def get(self, key, generate):
+        """Return the statements for a fingerprint, generating them once
+
+        :param key: server version and catalog fingerprint
+        :param generate: function returning the statements
+        :return: tuple of list of SQL statements and whether they were
+            generated for another database
+        """
+        with self.lock:
+            if key in self._stmts:
+                return (self._stmts[key], True)
+            event = self._pending.get(key)
+            if event is None:
+                self._pending[key] = threading.Event()
+        if event is not None:
+            event.wait()
+            return self.get(key, generate)
+        try:
+            stmts = generate()
+            with self.lock:
+                self._stmts[key] = stmts
+        finally:
+            with self.lock:
+                self._pending.pop(key).set()
+        return (stmts, False)
+
+
+def update(dbcfg, input_map, reqopts, cache, execute=True, diff_cache=None):
+    """Update a database to match a specification
+
+    :param dbcfg: database configuration dictionary
+    :param input_map: a YAML map defining the new database, not changed
+    :param reqopts: dictionary of options, as accepted by pyrseasd
+    :param cache: StatementCache shared by the databases
+    :param execute: whether to execute the statements
+    :param diff_cache: DiffCache keeping the statements between runs
+    :return: tuple of list of SQL statements and whether they were
+        generated for another database
+
+    The fingerprint covers everything read from the catalogs to
+    generate the statements.  Databases whose catalogs cannot be
+    fingerprinted, before PostgreSQL 9.3, get statements of their own.
+    """
+    dbconn = CatDbConnection(dbcfg['dbname'], dbcfg['username'],
+                             dbcfg['password'], dbcfg['host'], dbcfg['port'])
+    try:
+        dbconn.connect()
+        catalog = None
+        if dbconn.version >= MIN_VERSION:
+            catalog = fingerprint(dbconn)
+
+        def generate():
+            db = Database({'database': dbcfg, 'files': {},
+                           'options': _options(reqopts)}, dbconn)
+            if diff_cache is not None:
+                return diff_map(db, copy.deepcopy(input_map), diff_cache,
+                                catalog)
+            return db.diff_map(copy.deepcopy(input_map))
+
+        if catalog is None:
+            (stmts, reused) = (generate(), False)
+        else:
+            (stmts, reused) = cache.get((dbconn.version, catalog), generate)
+        if execute and stmts:
+            _apply(dbconn, stmts)
+    finally:
+        dbconn.close()
+    return (stmts, reused)
+
+
+def main():
+    """Update databases to match a YAML specification."""
+    parser = ArgumentParser(description="Update PostgreSQL databases "
+                            "concurrently to match the schema specified in a "
+                            "YAML file")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + '%s' % __version__)
+    parser.add_argument('spec', type=FileType('r'),
+                        help='YAML specification')
+    parser.add_argument('dbnames', nargs='+', metavar='dbname',
+                        help='database name')
+    group = parser.add_argument_group('Connection options')
+    group.add_argument('-H', '--host', help="database server host")
+    group.add_argument('-p', '--port', type=int,
+                       help="database server port")
+    group.add_argument('-U', '--username', help="database user name")
+    parser.add_argument('-u', '--update', action='store_true',
+                        help="apply changes to the databases (default only "
+                        "report how many statements each needs)")
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help="number of databases to update concurrently "
+                        "(default %(default)s)")
+    parser.add_argument('--online-indexes', action='store_true',
+                        help="create and drop indexes concurrently, "
+                        "outside the transaction")
+    parser.add_argument('--online-constraints', action='store_true',
+                        help="add foreign keys and check constraints as "
+                        "NOT VALID and validate them after the transaction")
+    parser.add_argument('--online-columns', action='store_true',
+                        help="add NOT NULL columns with defaults as "
+                        "nullable and fill them in batches")
+    parser.add_argument('--diff-cache', metavar='DIR',
+                        help="keep the statements generated in DIR, for "
+                        "reuse by later runs")
+    parser.add_argument('--diff-cache-size', metavar='MB', type=int,
+                        default=MAX_SIZE // (1024 * 1024),
+                        help="maximum size of the statements kept "
+                        "(default %(default)s)")
+    options = parser.parse_args()
+
+    input_map = yaml.safe_load(options.spec)
+    reqopts = {'online_indexes': options.online_indexes,
+               'online_constraints': options.online_constraints,
+               'online_columns': options.online_columns}
+    cache = StatementCache()
+    diff_cache = None
+    if options.diff_cache:
+        diff_cache = DiffCache(options.diff_cache,
+                               options.diff_cache_size * 1024 * 1024)
+    output = threading.Lock()
+
+    def run(dbname):
+        dbcfg = {'dbname': dbname, 'host': options.host,
+                 'port': options.port, 'username': options.username,
+                 'password': None}
+        try:
+            (stmts, reused) = update(dbcfg, input_map, reqopts, cache,
+                                     options.update, diff_cache)
+        except (Exception, SystemExit) as exc:
+            msg = "failed: %s" % str(exc).strip()
+            failed = True
+        else:
+            msg = "%d statements %s%s" % (
+                len(stmts), "applied" if options.update else "needed",
+                " (reused)" if reused else "")
+            failed = False
+        with output:
+            print("%s: %s" % (dbname, msg), file=sys.stderr)
+        return failed
+
+    pool = ThreadPool(options.jobs)
+    try:
+        failures = sum(pool.map(run, options.dbnames))
+    finally:
+        pool.close()
+    print("%d databases, %d failed" % (len(options.dbnames), failures),
+          file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
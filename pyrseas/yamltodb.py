@@ -4,17 +4,443 @@
 to match the schema specified in a YAML file"""
 
 from __future__ import print_function
+import re
 import sys
+import time
+import threading
 from argparse import FileType
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 import yaml
 
 from pyrseas import __version__
-from pyrseas.database import Database
+from pyrseas.database import Database, CatDbConnection
+from pyrseas.dbobject import NonTransactional, Backfill, stmt_phase
+from pyrseas.dbobject import PRE_TRANSACTION, TRANSACTION, POST_TRANSACTION
+from pyrseas.dbobject.column import METADATA_ONLY, VERIFY_SCAN, FULL_REWRITE
+from pyrseas.dbobject.column import BACKFILL_BATCH
+from pyrseas.costs import INDEX_BUILD
+from pyrseas.lockplan import LockPlanner, fetch_activity, order_levels
+from pyrseas.lockplan import lock_level, BLOCKS_WRITES
+from pyrseas.checkpoint import Checkpoint, spec_hash
+from pyrseas.checkpoint import unchanged, record_applied
+from pyrseas.diffcache import DiffCache, diff_map, MAX_SIZE
+from pyrseas.snapshot import SnapshotConnection
 from pyrseas.cmdargs import cmd_parser, parse_args
 from pyrseas.lib.pycompat import PY2
 
 
+# Removes CONCURRENTLY from index statements for a dry run
+CONCURRENTLY = re.compile(
+    r'^((?:CREATE (?:UNIQUE )?|DROP )INDEX) CONCURRENTLY')
+
+LOCKS_QUERY = \
+    """SELECT relation::regclass::text, mode FROM pg_locks
+       WHERE pid = pg_backend_pid() AND locktype = 'relation'
+             AND relation >= 16384 AND granted"""
+
+
+def _execute(dbconn, stmt, planner=None, checkpoint=None):
+    """Execute a generated statement
+
+    :param dbconn: database connection
+    :param stmt: SQL statement or data copy tuple
+    :param planner: LockPlanner to execute the SQL statements, if any
+    :param checkpoint: Checkpoint recording the statements executed
+        outside the transaction, if any
+    """
+    execute = dbconn.execute
+    if planner is not None:
+        execute = partial(planner.execute, dbconn)
+    if isinstance(stmt, tuple):
+        # expected format: (\copy, table, from, path, csv)
+        dbconn.copy_from(stmt[3], stmt[1])
+    elif isinstance(stmt, NonTransactional):
+        if checkpoint is not None and checkpoint.applied(stmt):
+            print("Skipping statement already applied: %s" %
+                  stmt.split('\n')[0], file=sys.stderr)
+            return
+        if isinstance(stmt, Backfill):
+            _backfill(dbconn, stmt)
+        else:
+            if dbconn.conn is None or dbconn.conn.closed:
+                dbconn.connect()
+            dbconn.commit()
+            dbconn.conn.autocommit = True
+            try:
+                execute(stmt)
+            finally:
+                dbconn.conn.autocommit = False
+        if checkpoint is not None:
+            checkpoint.record(dbconn, stmt)
+    else:
+        execute(stmt)
+
+
+def _batchable(stmt, planner=None):
+    """Return whether a statement can be sent as part of a batch
+
+    :param stmt: SQL statement or data copy tuple
+    :param planner: LockPlanner to execute the SQL statements, if any
+    :return: boolean
+
+    Only statements executed in the transaction can be batched, and
+    not those that the planner executes with a lock timeout.
+    """
+    if isinstance(stmt, tuple) or stmt_phase(stmt) != TRANSACTION:
+        return False
+    return planner is None or lock_level(stmt)[0] not in BLOCKS_WRITES
+
+
+def _execute_batch(dbconn, batch, planner=None):
+    """Execute several statements in a single round trip
+
+    :param dbconn: database connection
+    :param batch: list of SQL statements
+    :param planner: LockPlanner to execute the SQL statements, if any
+
+    The statements are sent together, preceded by a savepoint.  If one
+    fails, the batch is rolled back to the savepoint and the
+    statements are executed again, one at a time, so that the error
+    is raised by, and reported with, the statement that caused it.
+    """
+    if planner is not None:
+        execute = partial(planner.execute, dbconn)
+    else:
+        execute = dbconn.execute
+    if len(batch) == 1:
+        execute(batch[0])
+        return
+    if dbconn.conn is None or dbconn.conn.closed:
+        dbconn.connect()
+    curs = dbconn.conn.cursor()
+    if planner is None:
+        execute = curs.execute
+    try:
+        try:
+            execute("SAVEPOINT pyrseas_batch;\n%s;\n"
+                    "RELEASE SAVEPOINT pyrseas_batch" % ";\n".join(batch))
+            return
+        except Exception:
+            curs.execute("ROLLBACK TO SAVEPOINT pyrseas_batch")
+        for stmt in batch:
+            try:
+                execute(stmt)
+            except Exception:
+                print("Failed statement: %s" % stmt, file=sys.stderr)
+                raise
+        curs.execute("RELEASE SAVEPOINT pyrseas_batch")
+    except Exception:
+        dbconn.rollback()
+        raise
+    finally:
+        curs.close()
+
+
+def _execute_group(dbconn, stmts, planner=None, checkpoint=None,
+                   batch_size=1):
+    """Execute statements, sending consecutive batchable ones together
+
+    :param dbconn: database connection
+    :param stmts: iterable of SQL statements or data copy tuples
+    :param planner: LockPlanner to execute the SQL statements, if any
+    :param checkpoint: Checkpoint recording the statements executed
+        outside the transaction, if any
+    :param batch_size: maximum number of statements sent together
+
+    A batch is sent when it is full and before any statement that
+    cannot be part of one (see :func:`_batchable`) is executed.
+    """
+    batch = []
+    for stmt in stmts:
+        if batch_size > 1 and _batchable(stmt, planner):
+            batch.append(stmt)
+            if len(batch) >= batch_size:
+                _execute_batch(dbconn, batch, planner)
+                batch = []
+            continue
+        if batch:
+            _execute_batch(dbconn, batch, planner)
+            batch = []
+        _execute(dbconn, stmt, planner, checkpoint)
+    if batch:
+        _execute_batch(dbconn, batch, planner)
+
+
+def _backfill(dbconn, stmt):
+    """Execute the batches of a backfill, each in its own transaction
+
+    :param dbconn: database connection
+    :param stmt: Backfill statement
+
+    The number of rows filled so far is reported after each batch.
+    """
+    if dbconn.conn is None or dbconn.conn.closed:
+        dbconn.connect()
+    dbconn.commit()
+    total = 0
+    row = dbconn.fetchone(stmt.first)
+    while row is not None:
+        dbconn.commit()
+        total += row[-1]
+        print("Backfilled %d rows of %s" % (total, stmt.table),
+              file=sys.stderr)
+        row = dbconn.fetchone(stmt.next, row[:-1])
+    dbconn.commit()
+
+
+def _report_costs(db):
+    """Report the statements estimated to be expensive and their total
+
+    :param db: the Database that generated the statements
+    """
+    totals = {}
+    for (stmt, cls, rel, size, tuples) in sorted(
+            db.costs, key=lambda cost: -cost[3]):
+        totals[cls] = totals.get(cls, 0) + size
+        print("%s of %s (%d bytes, %d rows): %s" % (
+            cls, rel, size, tuples, stmt.split('\n')[0]), file=sys.stderr)
+    print("Estimated %d bytes to rewrite, %d bytes to scan for validation "
+          "and %d bytes to scan for index builds" % (
+              totals.get(FULL_REWRITE, 0), totals.get(VERIFY_SCAN, 0),
+              totals.get(INDEX_BUILD, 0)), file=sys.stderr)
+
+
+def _record_applied(dbconn, spec):
+    """Record a specification as applied, warning if that fails
+
+    :param dbconn: database connection
+    :param spec: hash of the specification
+
+    The changes are already committed, so a failure, e.g., for lack
+    of privileges to create the bookkeeping table, only means the next
+    update can't be skipped.
+    """
+    try:
+        record_applied(dbconn, spec)
+    except Exception as exc:
+        print("Warning: could not record the specification as applied: "
+              "%s" % str(exc).strip(), file=sys.stderr)
+
+
+def _format(stmt):
+    """Format a generated statement for output
+
+    :param stmt: SQL statement or data copy tuple
+    :return: string
+    """
+    if isinstance(stmt, tuple):
+        outstmt = "".join(stmt) + '\n'
+    else:
+        outstmt = "%s;\n" % stmt
+    if PY2:
+        outstmt = outstmt.encode('utf-8')
+    return outstmt
+
+
+def _report_type_changes(db, items):
+    """Report the expensive column type changes as items are generated
+
+    :param db: the Database generating the items
+    :param items: iterable of statements or levels
+    :return: generator of the same items
+    """
+    reported = 0
+    for item in items:
+        for (tbl, col, oldtype, newtype, cls) in \
+                db.type_changes[reported:]:
+            if cls != METADATA_ONLY:
+                print("Type change on %s.%s from %s to %s requires %s" % (
+                    tbl, col, oldtype, newtype,
+                    "a table rewrite" if cls == FULL_REWRITE
+                    else "a table scan"), file=sys.stderr)
+        reported = len(db.type_changes)
+        yield item
+
+
+def apply_levels(dbcfg, levels, jobs, fd=None, planner=None,
+                 checkpoint=None, batch_size=1):
+    """Execute statements grouped by dependency level over several connections
+
+    :param dbcfg: database configuration dictionary
+    :param levels: iterable of levels, as from `Database.diff_map_levels`
+    :param jobs: number of concurrent connections
+    :param fd: file to output the statements to, if any
+    :param planner: LockPlanner to execute the SQL statements, if any
+    :param checkpoint: Checkpoint recording the statements executed
+        outside the transaction, if any
+    :param batch_size: maximum number of statements sent together
+    :return: number of statements executed
+
+    The groups of statements in a level are executed concurrently,
+    each in its own transaction, committed when the group completes.
+    The statements of a group to be executed outside the transaction,
+    e.g., ``CREATE INDEX CONCURRENTLY``, are then executed one at a
+    time, once all the groups of the level are committed.  All of them
+    are completed before the next level is started.  If any group
+    fails, the remaining groups of that level are completed (or rolled
+    back if they fail too), the statements outside the transaction of
+    those committed are executed and the first error is raised.  The
+    levels already committed are not undone.
+    """
+    local = threading.local()
+    conns = []
+    session = []
+
+    def connection():
+        dbconn = getattr(local, 'dbconn', None)
+        if dbconn is None:
+            dbconn = local.dbconn = CatDbConnection(
+                dbcfg['dbname'], dbcfg['username'], dbcfg['password'],
+                dbcfg['host'], dbcfg['port'])
+            conns.append(dbconn)
+            dbconn.connect()
+            for stmt in session:
+                dbconn.execute(stmt)
+            dbconn.commit()
+        return dbconn
+
+    def run(group):
+        dbconn = connection()
+        try:
+            _execute_group(dbconn, [
+                stmt for stmt in group
+                if stmt_phase(stmt) != POST_TRANSACTION],
+                planner, checkpoint, batch_size)
+        except Exception:
+            dbconn.rollback()
+            raise
+        dbconn.commit()
+        return [stmt for stmt in group
+                if stmt_phase(stmt) == POST_TRANSACTION]
+
+    def run_post(stmts):
+        dbconn = connection()
+        for stmt in stmts:
+            _execute(dbconn, stmt, planner, checkpoint)
+
+    stmts = 0
+    pool = ThreadPool(jobs)
+    try:
+        for level in levels:
+            for group in level:
+                for stmt in group:
+                    stmts += 1
+                    if fd is not None:
+                        print(_format(stmt), file=fd)
+            if len(level) == 1 and all(
+                    not isinstance(stmt, tuple) and stmt.startswith('SET ')
+                    for stmt in level[0]):
+                session.extend(level[0])
+                for dbconn in conns:
+                    for stmt in level[0]:
+                        dbconn.execute(stmt)
+                    dbconn.commit()
+                continue
+            error = None
+            post = []
+            for result in [pool.apply_async(run, (group, ))
+                           for group in level]:
+                try:
+                    post.extend(result.get())
+                except Exception as exc:
+                    if error is None:
+                        error = exc
+            if post:
+                try:
+                    pool.apply(run_post, (post, ))
+                except Exception as exc:
+                    if error is None:
+                        error = exc
+            if error is not None:
+                raise error
+    finally:
+        pool.close()
+        pool.join()
+        for dbconn in conns:
+            dbconn.close()
+    return stmts
+
+
+def dry_run_apply(dbconn, stmts):
+    """Execute statements in a single transaction, timing them, and roll back
+
+    :param dbconn: database connection
+    :param stmts: iterable of statements, as from `Database.diff_map_iter`
+    :return: list of (seconds, statement, locks) tuples, and error if any
+
+    Statements that are normally executed after the transaction are
+    executed within it: indexes are created and dropped without
+    ``CONCURRENTLY`` and a backfill updates all the rows at once.
+    Those executed before the transaction, i.e., ``ALTER TYPE ... ADD
+    VALUE``, are not executed and are returned with no time.  After
+    each statement, the locks on relations held by the
+    transaction are fetched from `pg_locks` and those not held before
+    are recorded with it.  Finally, the transaction is rolled back,
+    even if a statement fails, in which case the timings up to the
+    failure are returned with the error.
+    """
+    results = []
+    error = None
+    if dbconn.conn is None or dbconn.conn.closed:
+        dbconn.connect()
+    dbconn.rollback()
+    held = set()
+    try:
+        for stmt in stmts:
+            if stmt_phase(stmt) == PRE_TRANSACTION:
+                results.append((None, stmt, []))
+                continue
+            start = time.time()
+            if isinstance(stmt, tuple):
+                _execute(dbconn, stmt)
+            elif isinstance(stmt, Backfill):
+                row = dbconn.fetchone(stmt.first)
+                while row is not None:
+                    row = dbconn.fetchone(stmt.next, row[:-1])
+            else:
+                dbconn.execute(CONCURRENTLY.sub(r'\1', stmt))
+            elapsed = time.time() - start
+            locks = set(tuple(lock) for lock in dbconn.fetchall(LOCKS_QUERY))
+            results.append((elapsed, stmt, sorted(locks - held)))
+            held |= locks
+    except Exception as exc:
+        error = exc
+    finally:
+        dbconn.rollback()
+    return (results, error)
+
+
+def _report_timings(results, error, fd):
+    """Output the statements executed by a dry run, slowest first
+
+    :param results: list of (seconds, statement, locks) tuples, the
+        seconds being None for the statements not executed
+    :param error: error raised by the last statement, if any
+    :param fd: file to output the report to
+    """
+    def first_line(stmt):
+        text = "".join(stmt) if isinstance(stmt, tuple) else stmt
+        return text.split('\n')[0]
+
+    total = 0
+    timed = [res for res in results if res[0] is not None]
+    for (elapsed, stmt, locks) in sorted(timed, key=lambda res: -res[0]):
+        total += elapsed
+        print("%10.3f ms  %s" % (elapsed * 1000, first_line(stmt)), file=fd)
+        for (rel, mode) in locks:
+            print("              %s on %s" % (mode, rel), file=fd)
+    print("%10.3f ms  total for %d statements" % (total * 1000,
+                                                   len(timed)), file=fd)
+    for (elapsed, stmt, _) in results:
+        if elapsed is None:
+            print("Not executable in a dry run: %s" % first_line(stmt),
+                  file=fd)
+    if error is not None:
+        print("Statement failed: %s" % error, file=fd)
+
+
 def main():
     """Convert YAML specifications to database DDL."""
     parser = cmd_parser("Generate SQL statements to update a PostgreSQL "
@@ -28,53 +454,226 @@ def main():
                         dest='onetrans', help="wrap commands in BEGIN/COMMIT")
     parser.add_argument('-u', '--update', action='store_true',
                         help="apply changes to database (implies -1)")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help="apply changes using N concurrent connections "
+                        "(requires --update)")
+    parser.add_argument('--online-indexes', action='store_true',
+                        help="create and drop indexes concurrently, "
+                        "outside the transaction")
+    parser.add_argument('--online-constraints', action='store_true',
+                        help="add foreign keys and check constraints as "
+                        "NOT VALID and validate them after the transaction")
+    parser.add_argument('--online-columns', action='store_true',
+                        help="add NOT NULL columns with defaults as "
+                        "nullable and fill them in batches")
+    parser.add_argument('--backfill-batch', metavar='N', type=int,
+                        default=BACKFILL_BATCH,
+                        help="rows to fill in each transaction "
+                        "(default %(default)s)")
+    parser.add_argument('--batch-size', metavar='N', type=int, default=1,
+                        help="send up to N statements to the server at a "
+                        "time (default %(default)s)")
+    parser.add_argument('--lock-timeout', metavar='MS', type=int, default=0,
+                        help="give up waiting for locks that block writes "
+                        "after MS milliseconds and retry")
+    parser.add_argument('--lock-retries', metavar='N', type=int, default=3,
+                        help="retry a statement up to N times after a lock "
+                        "timeout (default %(default)s)")
+    parser.add_argument('--lock-order', action='store_true',
+                        help="postpone locking the busiest tables as long "
+                        "as dependencies allow")
+    parser.add_argument('--estimate-costs', action='store_true',
+                        help="report the statements that rewrite or scan "
+                        "existing tables, with their sizes")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="record the statements applied outside the "
+                        "transaction and skip them when rerun")
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help="exit immediately if the specification was "
+                        "the last applied and the catalogs are unchanged")
+    parser.add_argument('--dry-run-apply', action='store_true',
+                        help="execute the changes in a transaction that is "
+                        "rolled back, and output the time taken by each "
+                        "statement")
+    parser.add_argument('--from-snapshot', metavar='FILE',
+                        help="compare to the catalogs saved by dbtoyaml "
+                        "--snapshot, without connecting to the database")
+    parser.add_argument('--diff-cache', metavar='DIR',
+                        help="keep the statements generated in DIR and reuse "
+                        "them for identical catalogs and specification")
+    parser.add_argument('--diff-cache-size', metavar='MB', type=int,
+                        default=MAX_SIZE // (1024 * 1024),
+                        help="maximum size of the statements kept "
+                        "(default %(default)s)")
+    parser.add_argument('--coalesce-alters', action='store_true',
+                        help="merge ALTER TABLE statements on each table")
     parser.add_argument('--revert', action='store_true',
                         help="generate SQL to revert changes")
     parser.add_argument('--quote-reserved', action='store_true',
                         help="quote SQL reserved words")
+    parser.add_argument('--diff-jobs', metavar='N', type=int, default=1,
+                        help="generate SQL using N worker processes")
+    parser.add_argument('--by-schema', action='store_true',
+                        help="process one group of schemas at a time")
     parser.add_argument('-n', '--schema', metavar='SCHEMA', dest='schemas',
                         action='append', default=[],
                         help="process only named schema(s) (default all)")
     cfg = parse_args(parser)
     output = cfg['files']['output']
     options = cfg['options']
-    db = Database(cfg)
+    dbconn = None
+    if options.jobs > 1 and not options.update:
+        parser.error("Cannot specify --jobs without --update")
+    if options.from_snapshot:
+        for (opt, arg) in [('update', '--update'),
+                           ('dry_run_apply', '--dry-run-apply'),
+                           ('estimate_costs', '--estimate-costs'),
+                           ('lock_order', '--lock-order'),
+                           ('by_schema', '--by-schema')]:
+            if getattr(options, opt):
+                parser.error("Cannot specify both --from-snapshot and %s" %
+                             arg)
+        dbconn = SnapshotConnection.load(options.from_snapshot)
+    if options.diff_cache:
+        if options.from_snapshot:
+            parser.error("Cannot specify both --diff-cache and "
+                         "--from-snapshot")
+        if options.lock_order:
+            parser.error("Cannot specify both --diff-cache and --lock-order")
+    db = Database(cfg, dbconn)
     if options.multiple_files:
         inmap = db.map_from_dir()
     else:
         inmap = yaml.safe_load(options.spec)
 
-    stmts = db.diff_map(inmap)
-    if stmts:
-        fd = output or sys.stdout
-        if options.onetrans or options.update:
-            print("BEGIN;", file=fd)
-        for stmt in stmts:
-            if isinstance(stmt, tuple):
-                outstmt = "".join(stmt) + '\n'
-            else:
-                outstmt = "%s;\n" % stmt
-            if PY2:
-                outstmt = outstmt.encode('utf-8')
-            print(outstmt, file=fd)
-        if options.onetrans or options.update:
-            print("COMMIT;", file=fd)
-        if options.update:
-            try:
-                for stmt in stmts:
-                    if isinstance(stmt, tuple):
-                        # expected format: (\copy, table, from, path, csv)
-                        db.dbconn.copy_from(stmt[3], stmt[1])
-                    else:
-                        db.dbconn.execute(stmt)
-            except:
-                db.dbconn.rollback()
-                raise
-            else:
-                db.dbconn.commit()
-                print("Changes applied", file=sys.stderr)
+    fd = output or sys.stdout
+    planner = None
+    if options.update and options.lock_timeout:
+        planner = LockPlanner(options.lock_timeout, options.lock_retries)
+    applying = options.update and not options.dry_run_apply
+    # a partial or reverted update is not recorded as applied
+    skip_unchanged = applying and options.skip_unchanged and not (
+        options.schemas or options.revert)
+    spec = None
+    if skip_unchanged or (applying and options.checkpoint):
+        spec = spec_hash(inmap)
+    if skip_unchanged and unchanged(db.dbconn, spec):
+        print("No changes since the last update", file=sys.stderr)
+        if output:
+            output.close()
+        return
+    checkpoint = None
+    if applying and options.checkpoint:
+        checkpoint = Checkpoint(spec)
+        checkpoint.load(db.dbconn)
+    if options.update and options.jobs > 1 and not options.dry_run_apply \
+            and not options.diff_cache:
+        levels = db.diff_map_levels(inmap)
+        if options.lock_order:
+            levels = order_levels(levels, fetch_activity(db.dbconn))
+        if apply_levels(cfg['database'], _report_type_changes(db, levels),
+                        options.jobs, fd, planner, checkpoint,
+                        options.batch_size):
+            print("Changes applied", file=sys.stderr)
+        if checkpoint is not None:
+            checkpoint.clear(db.dbconn)
+        if skip_unchanged:
+            _record_applied(db.dbconn, spec)
+        if options.estimate_costs:
+            _report_costs(db)
         if output:
             output.close()
+        return
+
+    trans = options.onetrans or options.update
+    intrans = False
+    stmts = 0
+    post = []
+    batch = []
+    if options.lock_order:
+        items = (stmt for level in order_levels(
+            db.diff_map_levels(inmap), fetch_activity(db.dbconn))
+            for group in level for stmt in group)
+    elif options.diff_cache:
+        items = diff_map(db, inmap, DiffCache(
+            options.diff_cache, options.diff_cache_size * 1024 * 1024))
+    else:
+        items = db.diff_map_iter(inmap)
+    if options.dry_run_apply:
+        (results, error) = dry_run_apply(db.dbconn,
+                                         _report_type_changes(db, items))
+        _report_timings(results, error, fd)
+        if options.estimate_costs:
+            _report_costs(db)
+        if output:
+            output.close()
+        if error is not None:
+            sys.exit(1)
+        return
+    try:
+        for stmt in _report_type_changes(db, items):
+            phase = stmt_phase(stmt)
+            if phase == POST_TRANSACTION:
+                # executed after the transaction is committed
+                if isinstance(stmt, Backfill) and not options.update and \
+                        db.dbconn.version < 110000:
+                    # the DO block can only commit on PostgreSQL 11
+                    sys.exit("Cannot output the batches filling %s for "
+                             "PostgreSQL before 11: use --update to "
+                             "execute them" % stmt.table)
+                post.append(stmt)
+                continue
+            if phase == PRE_TRANSACTION and intrans:
+                # e.g., with --by-schema: commit the preceding statements
+                print("COMMIT;", file=fd)
+                if batch:
+                    _execute_batch(db.dbconn, batch, planner)
+                    batch = []
+                if options.update:
+                    db.dbconn.commit()
+                intrans = False
+            elif phase == TRANSACTION and trans and not intrans:
+                print("BEGIN;", file=fd)
+                intrans = True
+            stmts += 1
+            print(_format(stmt), file=fd)
+            if not options.update:
+                continue
+            if options.batch_size > 1 and _batchable(stmt, planner):
+                batch.append(stmt)
+                if len(batch) >= options.batch_size:
+                    _execute_batch(db.dbconn, batch, planner)
+                    batch = []
+                continue
+            if batch:
+                _execute_batch(db.dbconn, batch, planner)
+                batch = []
+            _execute(db.dbconn, stmt, planner, checkpoint)
+        if batch:
+            _execute_batch(db.dbconn, batch, planner)
+    except:
+        if options.update and stmts:
+            db.dbconn.rollback()
+        raise
+    if intrans:
+        print("COMMIT;", file=fd)
+        if options.update:
+            db.dbconn.commit()
+    for stmt in post:
+        stmts += 1
+        print(_format(stmt), file=fd)
+        if options.update:
+            _execute(db.dbconn, stmt, planner, checkpoint)
+    if stmts and options.update:
+        print("Changes applied", file=sys.stderr)
+    if checkpoint is not None:
+        checkpoint.clear(db.dbconn)
+    if skip_unchanged:
+        _record_applied(db.dbconn, spec)
+    if options.estimate_costs:
+        _report_costs(db)
+    if output:
+        output.close()
 
 if __name__ == '__main__':
     main()
@@ -32,6 +32,10 @@ setup(
         'console_scripts': [
             'dbtoyaml = pyrseas.dbtoyaml:main',
             'yamltodb = pyrseas.yamltodb:main',
+            'yamldiff = pyrseas.yamldiff:main',
+            'pyrseasd = pyrseas.pyrseasd:main',
+            'dbfingerprint = pyrseas.dbfingerprint:main',
+            'yamlfanout = pyrseas.yamlfanout:main',
             'dbaugment = pyrseas.dbaugment:main']},
 
     install_requires=[
@@ -196,6 +196,39 @@ class ColumnToSqlTestCase(InputMapToSqlTestCase):
         assert fix_indent(sql[0]) == \
             "ALTER TABLE t1 ALTER COLUMN c1 SET NOT NULL"
 
+    def test_set_column_not_null_online(self):
+        "Change a nullable column to NOT NULL using a validated CHECK"
+        if self.db.version < 120000:
+            self.skipTest('Only available on PG 12 and later')
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer', 'not_null': True}},
+                        {'c2': {'type': 'text'}}]}})
+        sql = self.to_sql(inmap, [CREATE_STMT1], online_constraints=True)
+        assert fix_indent(sql[0]) == "ALTER TABLE t1 ADD CONSTRAINT " \
+            "t1_c1_not_null CHECK (c1 IS NOT NULL) NOT VALID"
+        assert sql[1:] == [
+            "ALTER TABLE t1 VALIDATE CONSTRAINT t1_c1_not_null",
+            "ALTER TABLE t1 ALTER COLUMN c1 SET NOT NULL",
+            "ALTER TABLE t1 DROP CONSTRAINT t1_c1_not_null"]
+
+    def test_set_column_not_null_online_name_taken(self):
+        "Number the CHECK used to set NOT NULL if its name is taken"
+        if self.db.version < 120000:
+            self.skipTest('Only available on PG 12 and later')
+        stmts = [CREATE_STMT1, "ALTER TABLE t1 ADD CONSTRAINT "
+                 "t1_c1_not_null CHECK (c1 > 0)"]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer', 'not_null': True}},
+                        {'c2': {'type': 'text'}}],
+            'check_constraints': {'t1_c1_not_null': {
+                'columns': ['c1'], 'expression': '(c1 > 0)'}}}})
+        sql = self.to_sql(inmap, stmts, online_constraints=True)
+        assert fix_indent(sql[0]) == "ALTER TABLE t1 ADD CONSTRAINT " \
+            "t1_c1_not_null1 CHECK (c1 IS NOT NULL) NOT VALID"
+        assert sql[-1] == "ALTER TABLE t1 DROP CONSTRAINT t1_c1_not_null1"
+
     def test_change_column_types(self):
         "Change the datatypes of two columns"
         inmap = self.std_map()
@@ -249,6 +282,83 @@ class ColumnToSqlTestCase(InputMapToSqlTestCase):
         assert fix_indent(sql[0]) == "ALTER TABLE t1 ADD COLUMN c3 date"
         assert fix_indent(sql[1]) == "ALTER TABLE t1 ADD COLUMN c4 text"
 
+    def test_add_columns_coalesced(self):
+        "Add two columns and alter another in a single ALTER TABLE"
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer', 'not_null': True}},
+                        {'c2': {'type': 'text'}}, {'c3': {'type': 'date'}},
+                        {'c4': {'type': 'text'}}, {'c5': {'type': 'text',
+                                                          'description':
+                                                          'Column c5'}}]}})
+        sql = self.to_sql(inmap, [CREATE_STMT2], coalesce_alters=True)
+        assert fix_indent(sql[0]) == "ALTER TABLE t1 ALTER COLUMN c1 " \
+            "SET NOT NULL, ADD COLUMN c4 text, ADD COLUMN c5 text"
+        assert sql[1] == "COMMENT ON COLUMN t1.c5 IS 'Column c5'"
+        assert len(sql) == 2
+
+    def test_add_column_backfill(self):
+        "Add a NOT NULL column with a volatile default in batches"
+        stmts = ["CREATE TABLE t1 (c1 integer PRIMARY KEY, c2 text)"]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer', 'not_null': True}},
+                        {'c2': {'type': 'text'}},
+                        {'c3': {'type': 'double precision', 'not_null': True,
+                                'default': 'random()'}}],
+            'primary_key': {'t1_pkey': {'columns': ['c1']}}}})
+        sql = self.to_sql(inmap, stmts, online_columns=True,
+                          backfill_batch=100)
+        assert fix_indent(sql[0]) == \
+            "ALTER TABLE t1 ADD COLUMN c3 double precision"
+        assert sql[1] == "ALTER TABLE t1 ALTER COLUMN c3 SET DEFAULT random()"
+        assert sql[2].phase == 'post-transaction'
+        assert sql[2].startswith("DO $$")
+        assert sql[2].first == \
+            "WITH _b AS (SELECT c1 FROM t1 ORDER BY c1 LIMIT 100),\n" \
+            "     _u AS (UPDATE t1 AS _t SET c3 = DEFAULT FROM _b\n" \
+            "            WHERE (_t.c1) = (_b.c1) RETURNING _t.c1)\n" \
+            "SELECT c1, count(*) OVER () FROM _u ORDER BY c1 DESC LIMIT 1"
+        assert "WHERE (c1) > (%s) ORDER BY c1" in sql[2].next
+        assert "ALTER TABLE t1 ALTER COLUMN c3 SET NOT NULL" in sql[3:]
+        assert all(stmt.phase == 'post-transaction' for stmt in sql[3:])
+
+    def test_add_column_stable_default(self):
+        "Add a NOT NULL column with a stable default directly on 11+"
+        if self.db.version < 110000:
+            self.skipTest('Only available on PG 11 and later')
+        stmts = ["CREATE TABLE t1 (c1 integer PRIMARY KEY, c2 text)"]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer', 'not_null': True}},
+                        {'c2': {'type': 'text'}},
+                        {'c3': {'type': 'timestamp with time zone',
+                                'not_null': True, 'default': 'now()'}}],
+            'primary_key': {'t1_pkey': {'columns': ['c1']}}}})
+        sql = self.to_sql(inmap, stmts, online_columns=True)
+        assert fix_indent(sql[0]) == "ALTER TABLE t1 ADD COLUMN c3 " \
+            "timestamp with time zone NOT NULL DEFAULT now()"
+        assert len(sql) == 1
+
+    def test_classify_type_changes(self):
+        "Classify column type changes according to their cost"
+        stmts = ["CREATE TABLE t1 (c1 integer, c2 varchar(16), "
+                 "c3 numeric(8,2), c4 varchar(16))"]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'bigint'}}, {'c2': {'type': 'text'}},
+                        {'c3': {'type': 'numeric(10,2)'}},
+                        {'c4': {'type': 'character varying(8)'}}]}})
+        self.to_sql(inmap, stmts)
+        db = self.database()
+        db.diff_map(inmap)
+        assert sorted(db.type_changes) == [
+            ('t1', 'c1', 'integer', 'bigint', 'full-rewrite'),
+            ('t1', 'c2', 'character varying(16)', 'text', 'metadata-only'),
+            ('t1', 'c3', 'numeric(8,2)', 'numeric(10,2)', 'metadata-only'),
+            ('t1', 'c4', 'character varying(16)', 'character varying(8)',
+             'full-rewrite')]
+
     def test_drop_column1(self):
         "Drop a column from the end of a table"
         inmap = self.std_map()
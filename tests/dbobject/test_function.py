@@ -246,6 +246,21 @@ class FunctionToSqlTestCase(InputMapToSqlTestCase):
             "RETURNS text LANGUAGE sql IMMUTABLE AS " \
             "$_$SELECT 'example'::text$_$"
 
+    def test_change_function_prologue(self):
+        "Emit the check_function_bodies prologue only for changed functions"
+        inmap = self.std_map()
+        inmap['schema public'].update({'function f1()': {
+            'language': 'sql', 'returns': 'text',
+            'source': "SELECT 'example'::text", 'volatility': 'immutable'}})
+        sql = self.to_sql(inmap, [CREATE_STMT1])
+        assert sql[0] == "SET check_function_bodies = false"
+        inmap['schema public']['function f1()'].update(
+            description='Test function f1')
+        sql = self.to_sql(inmap, ["CREATE OR REPLACE FUNCTION f1() RETURNS "
+                                  "text LANGUAGE sql IMMUTABLE AS "
+                                  "$_$SELECT 'example'::text$_$"])
+        assert sql == ["COMMENT ON FUNCTION f1() IS 'Test function f1'"]
+
     def test_function_with_comment(self):
         "Create a function with a comment"
         inmap = self.std_map()
@@ -170,6 +170,44 @@ class IndexToMapTestCase(DatabaseToMapTestCase):
 class IndexToSqlTestCase(InputMapToSqlTestCase):
     """Test SQL generation from input indexes"""
 
+    def test_create_indexes_levels(self):
+        "Group new indexes on several tables for concurrent execution"
+        stmts = [CREATE_TABLE_STMT, "CREATE TABLE t2 (c1 integer, c2 text)"]
+        inmap = self.std_map()
+        for tbl in ['t1', 't2']:
+            inmap['schema public'].update({'table %s' % tbl: {
+                'columns': [{'c1': {'type': 'integer'}},
+                            {'c2': {'type': 'text'}}],
+                'indexes': {'%s_idx1' % tbl: {'keys': ['c1']},
+                            '%s_idx2' % tbl: {'keys': ['c2']}}}})
+        sql = self.to_sql(inmap, stmts)
+        levels = list(self.database().diff_map_levels(inmap))
+        assert len(levels) == 1
+        assert sorted(levels[0]) == [
+            ["CREATE INDEX t1_idx1 ON t1 (c1)",
+             "CREATE INDEX t1_idx2 ON t1 (c2)"],
+            ["CREATE INDEX t2_idx1 ON t2 (c1)",
+             "CREATE INDEX t2_idx2 ON t2 (c2)"]]
+        assert sorted(sql) == sorted(levels[0][0] + levels[0][1])
+
+    def test_unique_index_for_foreign_key_levels_online(self):
+        "Build a unique index referenced by a new foreign key in the levels"
+        stmts = [CREATE_TABLE_STMT, "CREATE TABLE t2 (c1 integer, c2 text)"]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer'}}, {'c2': {'type': 'text'}}],
+            'indexes': {'t1_idx': {'keys': ['c1'], 'unique': True}}},
+            'table t2': {
+                'columns': [{'c1': {'type': 'integer'}},
+                            {'c2': {'type': 'text'}}],
+                'foreign_keys': {'t2_c1_fkey': {
+                    'columns': ['c1'],
+                    'references': {'table': 't1', 'columns': ['c1']}}}}})
+        sql = self.to_sql(inmap, stmts, online_indexes=True)
+        assert sql[0] == "CREATE UNIQUE INDEX t1_idx ON t1 (c1)"
+        levels = list(self.database().diff_map_levels(inmap))
+        assert levels == [[[sql[0]]], [[sql[1]]]]
+
     def test_create_table_with_index(self):
         "Create new table with a single column index"
         inmap = self.std_map()
@@ -358,6 +396,49 @@ class IndexToSqlTestCase(InputMapToSqlTestCase):
         assert sql == ["DROP INDEX t1_idx",
                        "CREATE INDEX t1_idx ON t1 (btrim(c1))"]
 
+    def test_change_index_keys_online(self):
+        "Rebuild an index with changed keys concurrently"
+        stmts = [CREATE_TABLE_STMT, CREATE_STMT]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer'}}, {'c2': {'type': 'text'}}],
+            'indexes': {'t1_idx': {'keys': ['c2']}}}})
+        sql = self.to_sql(inmap, stmts, online_indexes=True)
+        assert sql == ["CREATE INDEX CONCURRENTLY t1_idx_new ON t1 (c2)",
+                       "DROP INDEX CONCURRENTLY IF EXISTS t1_idx",
+                       "ALTER INDEX t1_idx_new RENAME TO t1_idx"]
+
+    def test_create_index_online(self):
+        "Create an index concurrently on an existing table"
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer'}}, {'c2': {'type': 'text'}}],
+            'indexes': {'t1_idx': {'keys': ['c1']}},
+            'description': 'Test table t1'}})
+        sql = self.to_sql(inmap, [CREATE_TABLE_STMT], online_indexes=True)
+        assert sql == ["COMMENT ON TABLE t1 IS 'Test table t1'",
+                       "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)"]
+
+    def test_create_table_index_online(self):
+        "Create an index on a new table within the transaction"
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer'}}, {'c2': {'type': 'text'}}],
+            'indexes': {'t1_idx': {'keys': ['c1']}}}})
+        sql = self.to_sql(inmap, online_indexes=True)
+        assert fix_indent(sql[0]) == "CREATE TABLE t1 (c1 integer, c2 text)"
+        assert sql[1] == "CREATE INDEX t1_idx ON t1 (c1)"
+
+    def test_drop_index_online(self):
+        "Drop an index concurrently"
+        stmts = [CREATE_TABLE_STMT, CREATE_STMT]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'integer'}},
+                        {'c2': {'type': 'text'}}]}})
+        sql = self.to_sql(inmap, stmts, online_indexes=True)
+        assert sql == ["DROP INDEX CONCURRENTLY IF EXISTS t1_idx"]
+
     def test_change_order_index_keys(self):
         "Change keys order of an existing index"
         stmts = [CREATE_TABLE_STMT, "CREATE INDEX t1_idx ON t1 (c1, c2)"]
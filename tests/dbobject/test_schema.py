@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 """Test schemas"""
 
+from argparse import Namespace
+
 import pytest
 
+from pyrseas.database import Database
+from pyrseas.snapshot import MapConnection
 from pyrseas.testutils import DatabaseToMapTestCase
 from pyrseas.testutils import InputMapToSqlTestCase
 
@@ -99,6 +103,41 @@ class SchemaToSqlTestCase(InputMapToSqlTestCase):
         sql = self.to_sql(inmap, stmts)
         assert sql == ["COMMENT ON SCHEMA s1 IS 'Changed schema s1'"]
 
+    def test_diff_jobs_schemas(self):
+        "Generate the same SQL for several schemas using worker processes"
+        stmts = []
+        inmap = self.std_map()
+        for sch in ['s1', 's2', 's3']:
+            stmts.extend(["CREATE SCHEMA %s" % sch,
+                          "CREATE TABLE %s.t1 (c1 integer)" % sch])
+            inmap.update({'schema %s' % sch: {'table t1': {
+                'columns': [{'c1': {'type': 'integer'}},
+                            {'c2': {'type': 'text'}}]}}})
+        inmap.update({'schema s4': {'description': 'Test schema s4'}})
+        sql = self.to_sql(inmap, stmts)
+        assert len(sql) == 5
+        assert self.to_sql(inmap, diff_jobs=2) == sql
+
+    def test_by_schema(self):
+        "Generate the same SQL processing one schema group at a time"
+        stmts = ["CREATE SCHEMA s1", "CREATE SCHEMA s2", "CREATE SCHEMA s3",
+                 "CREATE TABLE s1.t1 (c1 integer PRIMARY KEY)",
+                 "CREATE TABLE s2.t2 (c1 integer REFERENCES s1.t1)",
+                 "CREATE TABLE s3.t3 (c1 integer)"]
+        inmap = self.std_map()
+        inmap.update({'schema s1': {'table t1': {
+            'columns': [{'c1': {'type': 'integer', 'not_null': True}}],
+            'primary_key': {'t1_pkey': {'columns': ['c1']}}}},
+            'schema s2': {}, 'schema s3': {'table t3': {
+                'columns': [{'c1': {'type': 'integer'}},
+                            {'c2': {'type': 'text'}}]}}})
+        sql = self.to_sql(dict(inmap), stmts)
+        assert sql[0] == "ALTER TABLE s3.t3 ADD COLUMN c2 text"
+        assert sql[-1] == "DROP TABLE s2.t2"
+        keys = sorted(inmap)
+        assert sorted(self.to_sql(inmap, by_schema=True)) == sorted(sql)
+        assert sorted(inmap) == keys
+
 
 class SchemaUndoSqlTestCase(InputMapToSqlTestCase):
     """Test SQL generation to revert schemas"""
@@ -132,3 +171,41 @@ class SchemaUndoSqlTestCase(InputMapToSqlTestCase):
         stmts = [CREATE_STMT, COMMENT_STMT]
         sql = self.to_sql(inmap, stmts, revert=True)
         assert sql == [COMMENT_STMT]
+
+
+class ExecConnection(MapConnection):
+    "Connection recording the statements executed and the rollbacks"
+
+    def __init__(self):
+        super(ExecConnection, self).__init__()
+        self.executed = []
+        self.rollbacks = 0
+
+    def execute(self, query, args=None):
+        self.executed.append((query, self.rollbacks))
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_by_schema_update():
+    "Execute the statements of each group while the next one is loaded"
+    opts = Namespace(schemas=[], excl_schemas=[], tables=[], excl_tables=[],
+                     revert=False, quote_reserved=False, by_schema=True)
+    dbconn = ExecConnection()
+    db = Database({'options': opts}, dbconn)
+    inmap = {'extension plpgsql': {'schema': 'pg_catalog'},
+             'schema s1': {'table t1': {'columns': [{'c1': {
+                 'type': 'integer'}}]}},
+             'schema s2': {'table t2': {'columns': [{'c2': {
+                 'type': 'text'}}]}}}
+    keys = sorted(inmap)
+    assert len(db._schema_groups(inmap)) == 3
+    for stmt in db.diff_map_iter(inmap):
+        dbconn.execute(stmt)
+    stmts = [stmt for (stmt, _) in dbconn.executed]
+    assert "CREATE TABLE s1.t1 (\n    c1 integer)" in stmts
+    assert "CREATE TABLE s2.t2 (\n    c2 text)" in stmts
+    rollbacks = set(count for (_, count) in dbconn.executed)
+    assert rollbacks == set([dbconn.rollbacks])
+    assert sorted(inmap) == keys
@@ -236,6 +236,26 @@ class TableToSqlTestCase(InputMapToSqlTestCase):
         sql = self.to_sql(inmap, [CREATE_STMT, "CREATE SEQUENCE seq1"])
         assert sql[0] == "ALTER SEQUENCE seq1 OWNED BY t1.c1"
 
+    def test_estimate_costs(self):
+        "Estimate the cost of changes to a table with rows"
+        stmts = [CREATE_STMT, "INSERT INTO t1 SELECT i, 'row ' || i "
+                 "FROM generate_series(1, 1000) i", "ANALYZE t1"]
+        inmap = self.std_map()
+        inmap['schema public'].update({'table t1': {
+            'columns': [{'c1': {'type': 'bigint'}}, {'c2': {'type': 'text'}},
+                        {'c3': {'type': 'double precision',
+                                'default': 'random()'}}],
+            'indexes': {'t1_idx': {'keys': ['c2']}}}})
+        self.to_sql(inmap, stmts, estimate_costs=True)
+        db = self.database()
+        sql = db.diff_map(inmap)
+        assert [cost[1:3] for cost in db.costs] == [
+            ('full-rewrite', 't1'), ('full-rewrite', 't1'),
+            ('index-build', 't1')]
+        assert [cost[0] for cost in db.costs] == [sql[0], sql[1], sql[2]]
+        assert db.costs[0][3] > 0
+        assert db.costs[0][4] == 1000
+
 
 class TableCommentToSqlTestCase(InputMapToSqlTestCase):
     """Test SQL generation of table and column COMMENT statements"""
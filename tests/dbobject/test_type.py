@@ -3,6 +3,7 @@
 
 from pyrseas.testutils import DatabaseToMapTestCase
 from pyrseas.testutils import InputMapToSqlTestCase, fix_indent
+from pyrseas.dbobject import stmt_phase, PRE_TRANSACTION
 
 CREATE_COMPOSITE_STMT = "CREATE TYPE t1 AS (x integer, y integer, z integer)"
 CREATE_ENUM_STMT = "CREATE TYPE t1 AS ENUM ('red', 'green', 'blue')"
@@ -142,6 +143,50 @@ class EnumToSqlTestCase(InputMapToSqlTestCase):
         sql = self.to_sql(self.std_map(), [CREATE_ENUM_STMT])
         assert sql == ["DROP TYPE t1"]
 
+    def test_add_enum_labels(self):
+        "Add labels to an existing enum before the transaction"
+        inmap = self.std_map()
+        inmap['schema public'].update({'type t1': {
+            'labels': ['red', 'yellow', 'green', 'blue', 'black']}})
+        sql = self.to_sql(inmap, [CREATE_ENUM_STMT])
+        assert sql == ["ALTER TYPE t1 ADD VALUE 'yellow' BEFORE 'green'",
+                       "ALTER TYPE t1 ADD VALUE 'black'"]
+        assert stmt_phase(sql[0]) == PRE_TRANSACTION
+
+    def test_add_enum_label_quote(self):
+        "Add a label holding a quote to an existing enum"
+        inmap = self.std_map()
+        inmap['schema public'].update({'type t1': {
+            'labels': ['red', "o'range", 'green', 'blue']}})
+        sql = self.to_sql(inmap, [CREATE_ENUM_STMT])
+        assert sql == ["ALTER TYPE t1 ADD VALUE 'o''range' BEFORE 'green'"]
+
+    def test_add_enum_label_used(self):
+        "Add a label to an enum ahead of a table using it"
+        inmap = self.std_map()
+        inmap['schema public'].update({'type t1': {
+            'labels': ['red', 'green', 'blue', 'black']}, 'table t2': {
+                'columns': [{'c1': {'type': 't1', 'default': "'black'::t1"}}],
+                'description': 'Test table t2'}})
+        sql = self.to_sql(inmap, [CREATE_ENUM_STMT])
+        assert sql[0] == "ALTER TYPE t1 ADD VALUE 'black'"
+        assert fix_indent(sql[1]) == \
+            "CREATE TABLE t2 (c1 t1 DEFAULT 'black'::t1)"
+
+    def test_add_enum_label_used_levels(self):
+        "Add a label to an enum in the first level, ahead of a table"
+        inmap = self.std_map()
+        inmap['schema public'].update({'type t1': {
+            'labels': ['red', 'green', 'blue', 'black']}, 'table t2': {
+                'columns': [{'c1': {'type': 't1', 'default': "'black'::t1"}}],
+                'description': 'Test table t2'}})
+        sql = self.to_sql(inmap, [CREATE_ENUM_STMT])
+        levels = list(self.database().diff_map_levels(inmap))
+        assert levels[0] == [["ALTER TYPE t1 ADD VALUE 'black'"]]
+        assert stmt_phase(levels[0][0][0]) == PRE_TRANSACTION
+        assert sorted(stmt for level in levels for group in level
+                      for stmt in group) == sorted(sql)
+
     def test_rename_enum(self):
         "Rename an existing enum"
         inmap = self.std_map()
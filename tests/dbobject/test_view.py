@@ -77,6 +77,35 @@ class ViewToSqlTestCase(InputMapToSqlTestCase):
         with pytest.raises(KeyError):
             self.to_sql(inmap)
 
+    def test_view_dependency_loop(self):
+        "Error creating views that depend on each other"
+        inmap = self.std_map()
+        inmap['schema public'].update({
+            'view v1': {'definition': VIEW_DEFN, 'depends_on': ['view v2']},
+            'view v2': {'definition': VIEW_DEFN, 'depends_on': ['view v1']}})
+        with pytest.raises(Exception) as excinfo:
+            self.to_sql(inmap)
+        assert "view v1 -> view v2" in str(excinfo.value)
+
+    def test_view_dependency_levels(self):
+        "Partition tables and views in levels of dependency"
+        inmap = self.std_map()
+        inmap['schema public'].update({
+            'table t1': {'columns': [{'c1': {'type': 'integer'}}]},
+            'table t2': {'columns': [{'c1': {'type': 'integer'}}]},
+            'view v1': {'definition': "SELECT c1 FROM t1",
+                        'depends_on': ['table t1']},
+            'view v2': {'definition': "SELECT c1 FROM v1",
+                        'depends_on': ['view v1']}})
+        db = self.database()
+        db.from_map(inmap)
+        objs = [db.ndb.schemas['public']] + [
+            db.ndb.tables[('public', name)]
+            for name in ['v2', 't2', 'v1', 't1']]
+        levels = db.dep_levels(objs, db.ndb)
+        assert [sorted(obj.name for obj in lvl) for lvl in levels] == [
+            ['public'], ['t1', 't2'], ['v1'], ['v2']]
+
     def test_drop_view_no_table(self):
         "Drop an existing view without a table dependency"
         sql = self.to_sql(self.std_map(), [CREATE_STMT])
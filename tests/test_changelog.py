@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Test reading the DDL log and refreshing maps with its changes"""
+
+from argparse import Namespace
+
+from pyrseas.changelog import changes
+from pyrseas.database import Database
+from pyrseas.snapshot import MapConnection
+
+
+class FakeConnection(object):
+    "Connection returning a horizon and the rows of the log"
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def fetchone(self, query, args=None):
+        self.queries.append(query)
+        return (1234, )
+
+    def fetchall(self, query, args=None):
+        self.queries.append(query)
+        return self.rows
+
+    def rollback(self):
+        pass
+
+
+def test_changes_first_read():
+    "Return only the horizon on the first read"
+    dbconn = FakeConnection([{'catalog': 'pg_class', 'schema_name': 's1'}])
+    assert changes(dbconn) == (1234, set(), False)
+    assert len(dbconn.queries) == 1
+
+
+def test_changes_schemas():
+    "Return the schemas named in the log"
+    dbconn = FakeConnection([{'catalog': 'pg_class', 'schema_name': 's1'},
+                             {'catalog': 'pg_proc', 'schema_name': 's2'},
+                             {'catalog': 'pg_class', 'schema_name': 's1'}])
+    assert changes(dbconn, 1000) == (1234, set(['s1', 's2']), False)
+
+
+def test_changes_database_wide():
+    "Recognize changes to database-wide objects"
+    dbconn = FakeConnection([{'catalog': 'pg_extension',
+                              'schema_name': None}])
+    assert changes(dbconn, 1000) == (1234, set(), True)
+
+
+def test_changes_unknown_schema():
+    "Return no schemas for a change that cannot be attributed to one"
+    dbconn = FakeConnection([{'catalog': 'pg_class', 'schema_name': 's1'},
+                             {'catalog': 'pg_class', 'schema_name': None}])
+    assert changes(dbconn, 1000) == (1234, None, False)
+
+
+def test_refresh_map():
+    "Replace only the schemas changed, here dropped from the catalogs"
+    opts = Namespace(schemas=[], excl_schemas=[], tables=[], excl_tables=[],
+                     no_owner=False, no_privs=False, multiple_files=False)
+    db = Database({'options': opts}, MapConnection())
+    dbmap = {'extension plpgsql': {'schema': 'pg_catalog'},
+             'schema s1': {'table t1': {'columns': [{'c1': {
+                 'type': 'integer'}}]}},
+             'schema s2': {'table t2': {'columns': [{'c2': {
+                 'type': 'text'}}]}}}
+    newmap = db.refresh_map(dbmap, set(['s1']), False)
+    assert newmap == {'extension plpgsql': {'schema': 'pg_catalog'},
+                      'schema s2': dbmap['schema s2']}
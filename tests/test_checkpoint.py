@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Test identification of specifications and applied statements"""
+
+from pyrseas.checkpoint import Checkpoint, spec_hash, stmt_hash, unchanged
+from pyrseas.checkpoint import SCHEMA_QUERY, CREATE_STMTS, APPLIED_QUERY
+from pyrseas.checkpoint import RECORD_STMT, CLEAR_STMT, record_applied
+from pyrseas.testutils import PyrseasTestCase
+
+CREATE_SEQ = "CREATE SEQUENCE seq1"
+
+
+def test_spec_hash():
+    "Identify a specification regardless of the order of its keys"
+    map1 = {'schema public': {'table t1': {'columns': [{'c1': {
+        'type': 'integer'}}]}, 'description': 'standard public schema'}}
+    map2 = {'schema public': {'description': 'standard public schema',
+                              'table t1': {'columns': [{'c1': {
+                                  'type': 'integer'}}]}}}
+    assert spec_hash(map1) == spec_hash(map2)
+    map2['schema public']['table t1']['columns'][0]['c1']['type'] = 'bigint'
+    assert spec_hash(map1) != spec_hash(map2)
+
+
+def test_applied():
+    "Recognize the statements recorded as applied"
+    stmt = "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)"
+    checkpoint = Checkpoint(spec_hash({}))
+    assert not checkpoint.applied(stmt)
+    checkpoint._applied.add(stmt_hash(stmt))
+    assert checkpoint.applied(stmt)
+    assert not checkpoint.applied("DROP INDEX CONCURRENTLY t1_idx")
+
+
+class FakeConnection(object):
+    "Connection returning a row or raising an error, as on a missing table"
+
+    def __init__(self, row=None):
+        self.row = row
+
+    def fetchone(self, query, args=None):
+        if self.row is None:
+            raise RuntimeError('relation "pyrseas.applied" does not exist')
+        return self.row
+
+    def commit(self):
+        pass
+
+
+def test_unchanged():
+    "Check whether the specification last applied is unchanged"
+    spec = spec_hash({})
+    assert unchanged(FakeConnection((True, )), spec)
+    assert not unchanged(FakeConnection((False, )), spec)
+    assert not unchanged(FakeConnection(), spec)
+
+
+class LogConnection(object):
+    "Connection recording the statements, on a database with the schema"
+
+    def __init__(self, schema=True, rows=[]):
+        self.schema = schema
+        self.rows = rows
+        self.executed = []
+
+    def fetchone(self, query, args=None):
+        self.executed.append((query, args))
+        return (1, ) if self.schema else None
+
+    def fetchall(self, query, args=None):
+        self.executed.append((query, args))
+        return self.rows
+
+    def execute(self, query, args=None):
+        self.executed.append((query, args))
+
+    def commit(self):
+        self.executed.append('COMMIT')
+
+
+def test_load():
+    "Create the schema and tables and fetch the statements applied"
+    stmt = "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)"
+    spec = spec_hash({})
+    dbconn = LogConnection(False, [(stmt_hash(stmt), )])
+    checkpoint = Checkpoint(spec)
+    checkpoint.load(dbconn)
+    assert checkpoint.applied(stmt)
+    assert dbconn.executed == [(SCHEMA_QUERY, ('pyrseas', )),
+                               ("CREATE SCHEMA pyrseas", None)] + [
+        (create, None) for create in CREATE_STMTS] + [
+        (APPLIED_QUERY, (spec, )), 'COMMIT']
+
+
+def test_load_existing():
+    "Leave the schema alone if it exists"
+    dbconn = LogConnection()
+    Checkpoint(spec_hash({})).load(dbconn)
+    assert ("CREATE SCHEMA pyrseas", None) not in dbconn.executed
+    assert len(dbconn.executed) == len(CREATE_STMTS) + 3
+
+
+def test_record():
+    "Record a statement applied, unless recorded by a previous run"
+    stmt = "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)"
+    spec = spec_hash({})
+    dbconn = LogConnection()
+    checkpoint = Checkpoint(spec)
+    checkpoint.record(dbconn, stmt)
+    assert checkpoint.applied(stmt)
+    assert dbconn.executed == [(RECORD_STMT, (spec, stmt_hash(stmt), stmt)),
+                               'COMMIT']
+    assert 'ON CONFLICT' not in RECORD_STMT
+
+
+def test_clear():
+    "Remove the statements recorded once the run completes"
+    stmt = "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)"
+    spec = spec_hash({})
+    dbconn = LogConnection()
+    checkpoint = Checkpoint(spec)
+    checkpoint.record(dbconn, stmt)
+    checkpoint.clear(dbconn)
+    assert not checkpoint.applied(stmt)
+    assert dbconn.executed[2:] == [(CLEAR_STMT, (spec, )), 'COMMIT']
+
+
+class SequenceFingerprintTestCase(PyrseasTestCase):
+    """Test detection of changes to sequences by the catalog fingerprint"""
+
+    def changed(self, stmts, change):
+        for stmt in stmts:
+            self.db.execute(stmt)
+        self.db.conn.commit()
+        dbconn = self.database().dbconn
+        spec = spec_hash({})
+        record_applied(dbconn, spec)
+        assert unchanged(dbconn, spec)
+        self.db.execute_commit(change)
+        result = not unchanged(dbconn, spec)
+        dbconn.close()
+        return result
+
+    def test_alter_sequence(self):
+        "Detect a change to the parameters of a sequence"
+        assert self.changed([CREATE_SEQ],
+                            "ALTER SEQUENCE seq1 INCREMENT BY 2")
+
+    def test_nextval(self):
+        "Ignore the values taken from a sequence"
+        assert not self.changed([CREATE_SEQ], "SELECT nextval('seq1')")
+
+    def test_owned_by(self):
+        "Detect a change to the column owning a sequence"
+        assert self.changed([CREATE_SEQ, "CREATE TABLE t1 (c1 integer)"],
+                            "ALTER SEQUENCE seq1 OWNED BY t1.c1")
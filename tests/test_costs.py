@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Test classification of statements by cost"""
+
+from pyrseas.costs import estimate_cost, INDEX_BUILD
+from pyrseas.dbobject import NonTransactional
+from pyrseas.dbobject.column import METADATA_ONLY, VERIFY_SCAN, FULL_REWRITE
+from pyrseas.dbobject.column import volatile_default, classify_type_change
+
+TYPE_CHANGES = [('t1', 'c2', 'character varying(16)', 'text', METADATA_ONLY)]
+
+
+def test_alter_table_costs():
+    "Classify ALTER TABLE statements by their most expensive subcommand"
+    for (stmt, expected) in [
+            ("ALTER TABLE t1\n    ALTER COLUMN c1 TYPE bigint", FULL_REWRITE),
+            ("ALTER TABLE t1\n    ALTER COLUMN c2 TYPE text", METADATA_ONLY),
+            ("ALTER TABLE t1\n    ADD COLUMN c3 integer DEFAULT 0",
+             METADATA_ONLY),
+            ("ALTER TABLE t1\n    ADD COLUMN c3 uuid DEFAULT "
+             "gen_random_uuid()", FULL_REWRITE),
+            ("ALTER TABLE t1\n    ALTER COLUMN c2 TYPE text,\n"
+             "    ALTER COLUMN c1 SET NOT NULL", VERIFY_SCAN),
+            ("ALTER TABLE t1 ADD CONSTRAINT t1_c1_check CHECK (c1 > 0)",
+             VERIFY_SCAN),
+            ("ALTER TABLE t1 ADD CONSTRAINT t1_c1_check CHECK (c1 > 0) "
+             "NOT VALID", METADATA_ONLY),
+            ("ALTER TABLE t1 ADD CONSTRAINT t1_pkey PRIMARY KEY (c1)",
+             INDEX_BUILD),
+            (NonTransactional("ALTER TABLE t1 ALTER COLUMN c1 SET NOT NULL"),
+             METADATA_ONLY)]:
+        assert estimate_cost(stmt, TYPE_CHANGES, 120000) == (expected, 't1')
+
+
+def test_other_costs():
+    "Classify other statements"
+    assert estimate_cost("CREATE INDEX t1_idx ON s1.t1 (c2)") == (
+        INDEX_BUILD, 's1.t1')
+    assert estimate_cost("CREATE TABLE t2 (c1 integer)") == (
+        METADATA_ONLY, None)
+    assert estimate_cost("ALTER TABLE t1\n    ADD COLUMN c3 integer "
+                         "DEFAULT 0", version=100000) == (FULL_REWRITE, 't1')
+
+
+def test_volatile_default():
+    "Recognize the defaults that call volatile functions"
+    volatile = set(['nextval', 'random', 'Gen"Id'])
+    assert volatile_default("nextval('t1_c1_seq'::regclass)", volatile)
+    assert volatile_default("(RANDOM() * 10)::integer", volatile)
+    assert volatile_default('"Gen""Id"()', volatile)
+    assert not volatile_default("now()", volatile)
+    assert not volatile_default("0", volatile)
+
+
+def test_add_column_costs():
+    "Rewrite the table only for volatile defaults, if they are known"
+    stmt = "ALTER TABLE t1\n    ADD COLUMN c3 timestamp DEFAULT now()"
+    assert estimate_cost(stmt, version=120000) == (FULL_REWRITE, 't1')
+    assert estimate_cost(stmt, version=120000, volatile=set(['random'])) \
+        == (METADATA_ONLY, 't1')
+    assert estimate_cost(stmt.replace('now', 'random'), version=120000,
+                         volatile=set(['random'])) == (FULL_REWRITE, 't1')
+
+
+def test_type_change_without_typmod():
+    "Drop the typmod only of the types unlimited without one"
+    for (oldtype, newtype, expected) in [
+            ('varchar(16)', 'varchar', METADATA_ONLY),
+            ('numeric(8,2)', 'numeric', METADATA_ONLY),
+            ('timestamp(3) with time zone', 'timestamp with time zone',
+             METADATA_ONLY),
+            ('character(8)', 'character', FULL_REWRITE),
+            ('bit(8)', 'bit', FULL_REWRITE)]:
+        assert classify_type_change(oldtype, newtype, set()) == expected
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Test comparing databases by hashes of their catalogs"""
+
+from argparse import Namespace
+
+import pytest
+
+from pyrseas.dbfingerprint import objects_query, compare, fingerprint
+
+OPTS = Namespace(no_owner=False, no_privs=False)
+
+
+def test_objects_query():
+    "Hash the objects of each dictionary, leaving out their oids"
+    query = objects_query(90500)
+    assert "'tables' AS objtype" in query
+    assert "'columns' AS objtype" in query
+    assert "NOT IN ('oid', 'number')" in query
+    assert "'owner'" not in query
+    assert "NOT IN ('oid', 'number', 'owner')" in objects_query(
+        90500, no_owner=True)
+
+
+def test_objects_query_attnums():
+    "Hash the columns of constraints, indexes and triggers by name"
+    query = objects_query(90500)
+    assert "NOT IN ('oid', 'number', 'keycols', 'ref_cols')" in query
+    assert "AS ref_cols_names" in query
+    assert "generate_subscripts(cat.indkey::int2[], 1)" in query
+    assert "generate_subscripts(cat.tgattr::int2[], 1)" in query
+
+
+def test_objects_query_sequences():
+    "Hash the parameters of sequences, their tables and the table parents"
+    query = objects_query(90500)
+    assert "'sequences' AS objtype" in query
+    assert "'inherits' AS objtype" in query
+    assert "FROM ' || c.oid::regclass::text" in query
+    assert "pg_sequence" not in query
+    assert "pg_catalog.pg_sequence" in objects_query(100000)
+
+
+def test_objects_query_depends():
+    "Hash the operator class members and the dependencies"
+    query = objects_query(90500)
+    assert "'opclass_operators' AS objtype" in query
+    assert "'opclass_functions' AS objtype" in query
+    assert "'depends' AS objtype" in query
+    assert "pg_identify_object(refclassid" in query
+
+
+def test_objects_query_version():
+    "Refuse to hash the catalogs of servers without JSON functions"
+    with pytest.raises(ValueError):
+        objects_query(90200)
+
+
+class FakeConnection(object):
+    "Connection returning schema or object hashes"
+
+    version = 90500
+
+    def __init__(self, schemas, objects):
+        self.schemas = schemas
+        self.objects = objects
+        self.queries = 0
+
+    def fetchall(self, query, args=None):
+        self.queries += 1
+        if args is None:
+            return [{'schema': sch, 'hash': hash}
+                    for (sch, hash) in self.schemas.items()]
+        return [{'schema': sch, 'objtype': objtype, 'key': key,
+                 'hash': hash} for (sch, objtype, key, hash) in self.objects
+                if sch in args[0] or (args[1] and sch is None)]
+
+    def rollback(self):
+        pass
+
+
+def test_compare_identical():
+    "Fetch no object hashes if the schema hashes match"
+    dbconn = FakeConnection({'s1': 'h1', None: 'h0'}, [])
+    assert compare({'s1': 'h1', None: 'h0'}, {}, dbconn, OPTS) == {}
+    assert dbconn.queries == 1
+
+
+def test_compare_objects():
+    "Report the objects that differ in the schemas that differ"
+    ref_objects = {'s1': {('tables', ('s1', 't1')): 'a',
+                          ('tables', ('s1', 't2')): 'b'},
+                   's2': {('tables', ('s2', 't3')): 'c'}}
+    dbconn = FakeConnection({'s1': 'h2', 's2': 'h3'}, [
+        ('s1', 'tables', ['s1', 't1'], 'x'),
+        ('s1', 'indexes', ['s1', 't1', 't1_idx'], 'y'),
+        ('s2', 'tables', ['s2', 't3'], 'c')])
+    assert compare({'s1': 'h1', 's2': 'h3'}, ref_objects, dbconn, OPTS) == {
+        'changed': ['tables s1.t1'], 'missing': ['tables s1.t2'],
+        'extra': ['indexes s1.t1.t1_idx']}
+
+
+def test_fingerprint():
+    "Fingerprint identical catalogs identically, regardless of row order"
+    fp1 = fingerprint(FakeConnection({'s1': 'a', None: 'b'}, []))
+    fp2 = fingerprint(FakeConnection({None: 'b', 's1': 'a'}, []))
+    assert fp1 == fp2
+    assert fp1 != fingerprint(FakeConnection({'s1': 'c', None: 'b'}, []))
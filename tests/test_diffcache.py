@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Test keeping the statements generated by diffs between runs"""
+
+import os
+from argparse import Namespace
+
+import pgdbconn.dbconn
+
+from pyrseas.database import CatDbConnection
+from pyrseas.diffcache import DiffCache, diff_key, diff_map
+
+OPTS = Namespace(schemas=[], revert=False, quote_reserved=False)
+
+
+def test_cache_get_put(tmpdir):
+    "Return the value of an entry added, or None if there is none"
+    cache = DiffCache(str(tmpdir.join('cache')))
+    assert cache.get('k1') is None
+    cache.put('k1', ["CREATE TABLE t1 (c1 integer)"])
+    assert cache.get('k1') == ["CREATE TABLE t1 (c1 integer)"]
+
+
+def test_cache_evict(tmpdir):
+    "Remove the least recently used entries over the maximum size"
+    cache = DiffCache(str(tmpdir), 10 ** 6)
+    for (i, key) in enumerate(['k1', 'k2', 'k3']):
+        cache.put(key, 'x' * 1000)
+        os.utime(cache._file(key), (i, i))
+    size = os.path.getsize(cache._file('k1'))
+    assert cache.get('k1') is not None
+    cache.max_size = 2 * size
+    cache.evict()
+    assert cache.get('k2') is None
+    assert cache.get('k1') is not None
+    assert cache.get('k3') is not None
+
+
+def test_diff_key():
+    "Key the statements by catalogs, input map and options"
+    inmap = {'schema public': {'table t1': {'columns': [{'c1': {
+        'type': 'integer'}}]}}}
+    key = diff_key('fp1', 90500, inmap, OPTS)
+    assert key == diff_key('fp1', 90500, inmap, OPTS)
+    assert key != diff_key('fp2', 90500, inmap, OPTS)
+    assert key != diff_key('fp1', 100000, inmap, OPTS)
+    assert key != diff_key('fp1', 90500, {}, OPTS)
+    assert key != diff_key('fp1', 90500, inmap, Namespace(
+        schemas=[], revert=True, quote_reserved=False))
+    assert key != diff_key('fp1', 90500, inmap, OPTS,
+                           {'schema public': ['t1']})
+    assert key == diff_key('fp1', 90500, inmap, Namespace(
+        schemas=[], revert=False, quote_reserved=False, diff_jobs=4))
+
+
+class FakeDbConnection(object):
+    "Connection already connected to a server"
+
+    def __init__(self, version=90500):
+        self.conn = Namespace(closed=False)
+        self.version = version
+
+
+class FakeDatabase(object):
+    "Database counting the diffs generated"
+
+    def __init__(self, dbconn=None):
+        self.dbconn = dbconn or FakeDbConnection()
+        self.config = {'options': OPTS}
+        self.type_changes = []
+        self.diffs = 0
+
+    def diff_map(self, input_map):
+        self.diffs += 1
+        self.type_changes = [('t1', 'c1', 'integer', 'text', 'rewrite')]
+        return ["ALTER TABLE t1 ALTER COLUMN c1 TYPE text"]
+
+
+def test_diff_map(tmpdir):
+    "Generate the statements only on the first diff"
+    cache = DiffCache(str(tmpdir))
+    db1 = FakeDatabase()
+    stmts = diff_map(db1, {}, cache, 'fp1')
+    assert db1.diffs == 1
+    db2 = FakeDatabase()
+    assert diff_map(db2, {}, cache, 'fp1') == stmts
+    assert db2.diffs == 0
+    assert db2.type_changes == db1.type_changes
+
+
+def test_diff_map_old_server(tmpdir):
+    "Generate the statements each time if the catalogs have no fingerprint"
+    cache = DiffCache(str(tmpdir))
+    db = FakeDatabase(FakeDbConnection(90200))
+    diff_map(db, {}, cache)
+    diff_map(db, {}, cache)
+    assert db.diffs == 2
+    assert os.listdir(str(tmpdir)) == []
+
+
+class FakePsycopgCursor(object):
+    "Cursor accepting any statement"
+
+    def execute(self, query, args=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePsycopgConnection(object):
+    "Connection returned by psycopg2 to a PostgreSQL 10 server"
+
+    closed = False
+    server_version = 100000
+
+    def cursor(self):
+        return FakePsycopgCursor()
+
+    def commit(self):
+        pass
+
+
+def test_diff_map_unconnected(tmpdir, monkeypatch):
+    "Connect to the database to get its version"
+    monkeypatch.setattr(pgdbconn.dbconn, 'connect',
+                        lambda *args, **kwargs: FakePsycopgConnection())
+    db = FakeDatabase(CatDbConnection('x'))
+    diff_map(db, {}, DiffCache(str(tmpdir)), 'fp1')
+    assert db.dbconn.version == 100000
+    assert db.diffs == 1
+    assert len(os.listdir(str(tmpdir))) == 1
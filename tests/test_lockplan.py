@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Test lock level classification and ordering of statements"""
+
+from pyrseas.lockplan import lock_level, order_levels
+from pyrseas.lockplan import ACCESS_EXCLUSIVE, SHARE, SHARE_ROW_EXCLUSIVE
+from pyrseas.lockplan import SHARE_UPDATE_EXCLUSIVE, ROW_EXCLUSIVE
+
+
+def test_lock_levels():
+    "Classify statements by the lock they acquire"
+    for (stmt, expected) in [
+            ("CREATE TABLE t1 (c1 integer, c2 text)", (None, None)),
+            ("ALTER TABLE t1\n    ADD COLUMN c3 date",
+             (ACCESS_EXCLUSIVE, 't1')),
+            ("ALTER TABLE s1.t1 ALTER COLUMN c1 TYPE bigint",
+             (ACCESS_EXCLUSIVE, 's1.t1')),
+            ("ALTER TABLE t1 ALTER COLUMN c2 SET STATISTICS 100",
+             (SHARE_UPDATE_EXCLUSIVE, 't1')),
+            ("ALTER TABLE t2 ADD CONSTRAINT t2_c21_fkey FOREIGN KEY (c21) "
+             "REFERENCES t1 (c11) ON DELETE CASCADE",
+             (SHARE_ROW_EXCLUSIVE, 't2')),
+            ("ALTER TABLE t2 VALIDATE CONSTRAINT t2_c21_fkey",
+             (SHARE_UPDATE_EXCLUSIVE, 't2')),
+            ("CREATE INDEX t1_idx ON t1 (c1)", (SHARE, 't1')),
+            ("CREATE UNIQUE INDEX CONCURRENTLY t1_idx ON \"S1\".t1 (c1)",
+             (SHARE_UPDATE_EXCLUSIVE, '"S1".t1')),
+            ("DROP INDEX CONCURRENTLY IF EXISTS s1.t1_idx",
+             (SHARE_UPDATE_EXCLUSIVE, 's1.t1_idx')),
+            ("DROP TABLE t1", (ACCESS_EXCLUSIVE, 't1')),
+            ("CREATE TRIGGER tr1 BEFORE INSERT ON t1 FOR EACH ROW "
+             "EXECUTE PROCEDURE f1()", (SHARE_ROW_EXCLUSIVE, 't1')),
+            ("COMMENT ON TABLE t1 IS 'Test table t1'",
+             (SHARE_UPDATE_EXCLUSIVE, None)),
+            (("\\copy ", "t1", " from '", "t1.data", "' csv"),
+             (ROW_EXCLUSIVE, 't1'))]:
+        assert lock_level(stmt) == expected
+
+
+def test_order_levels():
+    "Postpone independent groups that lock the busiest tables"
+    levels = [[["CREATE TABLE t3 (c1 integer)"]],
+              [["ALTER TABLE t1 ADD COLUMN c3 date"],
+               ["ALTER TABLE t2 ADD COLUMN c3 date"],
+               ["CREATE TABLE t4 (c1 integer)"]]]
+    activity = {'t1': 1000, 't2': 10}
+    assert list(order_levels(levels, activity)) == [
+        [["CREATE TABLE t3 (c1 integer)"]],
+        [["CREATE TABLE t4 (c1 integer)"],
+         ["ALTER TABLE t2 ADD COLUMN c3 date"],
+         ["ALTER TABLE t1 ADD COLUMN c3 date"]]]
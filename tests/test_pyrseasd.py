@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Test the handling of pyrseasd requests that need no database"""
+
+import threading
+from argparse import Namespace
+
+import pytest
+
+from pyrseas.changelog import TRIGGERS_QUERY
+from pyrseas.dbobject import NonTransactional
+from pyrseas.pyrseasd import _options, handle_request, CatalogCache
+
+DBCFG = {'dbname': 'db1', 'username': None, 'password': None,
+         'host': None, 'port': None}
+
+
+class FakeConnection(object):
+    "A connection counting the fingerprint queries"
+
+    def __init__(self, triggers):
+        self.triggers = triggers
+        self.fingerprints = 0
+
+    def fetchone(self, query, args=None):
+        if query == TRIGGERS_QUERY:
+            return (self.triggers, )
+        self.fingerprints += 1
+        return ('fp', )
+
+    def rollback(self):
+        pass
+
+
+def fake_cache(triggers):
+    cache = CatalogCache(DBCFG)
+    cache.dbconn = FakeConnection(triggers)
+    cache.listener = Namespace(listening=True)
+    cache.loads = 0
+
+    def load():
+        cache.loads += 1
+        cache._catalog = object()
+    cache._load = load
+    return cache
+
+
+def test_request_options():
+    "Fill in the options of a request with the defaults"
+    opts = _options({'no_owner': True, 'schemas': ['s1']})
+    assert opts.no_owner is True
+    assert opts.schemas == ['s1']
+    assert opts.no_privs is False
+    assert opts.multiple_files is False
+
+
+def test_request_bad_option():
+    "Reject an option that requests cannot give"
+    with pytest.raises(KeyError):
+        _options({'multiple_files': True})
+
+
+def test_request_bad_database():
+    "Reject a request for a database not served"
+    with pytest.raises(KeyError):
+        handle_request({}, {'command': 'extract', 'dbname': 'db1'})
+
+
+def test_notified_changes():
+    "Mark the schemas of the objects notified as changed"
+    cache = CatalogCache(DBCFG)
+    cache._unsure = cache._catalog_stale = False
+    cache.notified([{'catalog': 'pg_class', 'schema_name': 's1',
+                     'identity': 's1.t1', 'command': 'CREATE TABLE'}])
+    assert cache._pending == set(['s1'])
+    assert not cache._pending_global
+    assert cache._catalog_stale
+    cache.notified([{'catalog': 'pg_extension', 'schema_name': None,
+                     'identity': 'hstore', 'command': 'CREATE EXTENSION'}])
+    assert cache._pending == set(['s1'])
+    assert cache._pending_global
+    cache.notified([{'catalog': '-', 'schema_name': None,
+                     'identity': None, 'command': 'GRANT'}])
+    assert cache._pending is None
+    assert not cache._unsure
+    cache.notified(None)
+    assert cache._unsure
+
+
+def test_catalog_notified():
+    "Query the catalogs again only once a change is notified"
+    cache = fake_cache(2)
+    catalog = cache.catalog()
+    assert cache.loads == 1
+    assert cache.catalog() is catalog
+    assert cache.loads == 1
+    cache.notified([{'catalog': 'pg_class', 'schema_name': 's1',
+                     'identity': 's1.t1', 'command': 'CREATE TABLE'}])
+    cache.catalog()
+    assert cache.loads == 2
+    assert cache.dbconn.fingerprints == 0
+
+
+def test_catalog_fingerprint():
+    "Check the fingerprint on each request without the event triggers"
+    cache = fake_cache(0)
+    cache.catalog()
+    cache.catalog()
+    assert cache.loads == 1
+    assert cache.dbconn.fingerprints == 2
+
+
+def test_response_phases():
+    "Return the phase of each statement"
+    class FakeCache(object):
+        lock = threading.Lock()
+
+        def diff(self, spec, reqopts):
+            return [("ALTER TABLE t1 ", "ADD COLUMN c2 integer"),
+                    NonTransactional("CREATE INDEX CONCURRENTLY t1_idx "
+                                     "ON t1 (c2)")]
+    response = handle_request({'db1': FakeCache()}, {
+        'command': 'diff', 'dbname': 'db1', 'spec': '{}'})
+    assert response == {'statements': [
+        {'statement': "ALTER TABLE t1 ADD COLUMN c2 integer",
+         'phase': 'transaction'},
+        {'statement': "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c2)",
+         'phase': 'post-transaction'}]}
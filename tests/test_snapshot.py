@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Test answering catalog queries from a snapshot"""
+
+import pickle
+
+import pytest
+
+from pyrseas.snapshot import SnapshotConnection, SNAPSHOT_FORMAT, _key
+
+QUERY = "SELECT nspname AS name, nspowner AS owner FROM pg_namespace"
+
+
+def test_snapshot_queries(tmpdir):
+    "Answer the recorded queries, by position or column name"
+    path = str(tmpdir.join('snapshot.bin'))
+    with open(path, 'wb') as f:
+        pickle.dump({'format': SNAPSHOT_FORMAT, 'dbname': 'pyrseas_testdb',
+                     'version': 90600, 'results': {
+                         _key(QUERY, None): (['name', 'owner'], [
+                             ['public', 10], ['s1', 16384]])}}, f, 2)
+    dbconn = SnapshotConnection.load(path)
+    assert dbconn.dbname == 'pyrseas_testdb'
+    assert dbconn.version == 90600
+    rows = dbconn.fetchall(QUERY)
+    assert [row[0] for row in rows] == ['public', 's1']
+    assert dict(rows[1]) == {'name': 's1', 'owner': 16384}
+    assert dbconn.fetchone(QUERY)['owner'] == 10
+    with pytest.raises(KeyError):
+        dbconn.fetchall("SELECT word FROM pg_get_keywords()")
+    with pytest.raises(RuntimeError):
+        dbconn.connect()
+
+
+def test_snapshot_format(tmpdir):
+    "Reject a file that is not a snapshot"
+    path = str(tmpdir.join('snapshot.bin'))
+    with open(path, 'wb') as f:
+        pickle.dump(['not', 'a', 'snapshot'], f, 2)
+    with pytest.raises(ValueError):
+        SnapshotConnection.load(path)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Test generating SQL from two YAML specifications, without a database"""
+
+import pytest
+
+from pyrseas.database import coalesce_alters
+from pyrseas.yamldiff import diff_maps
+
+
+class Options(object):
+    schemas = []
+    revert = False
+    quote_reserved = False
+
+
+def table_map(columns, pkey):
+    return {'schema public': {'table t1': {
+        'columns': [{col: {'type': 'integer'}} for col in columns],
+        'primary_key': {'t1_pkey': {'columns': pkey}}}}}
+
+
+def test_same_maps():
+    "Generate no SQL for identical specifications"
+    assert diff_maps(table_map(['c1', 'c2'], ['c1']),
+                     table_map(['c1', 'c2'], ['c1']), Options()) == []
+
+
+def test_create_table():
+    "Generate SQL to create a table missing from the old specification"
+    new_map = table_map(['c1'], ['c1'])
+    new_map['schema public']['table t2'] = {
+        'columns': [{'c21': {'type': 'text'}}]}
+    assert diff_maps(table_map(['c1'], ['c1']), new_map, Options()) == [
+        "CREATE TABLE t2 (\n    c21 text)"]
+
+
+def test_change_primary_key():
+    "Generate SQL to add a column and change the primary key"
+    assert diff_maps(table_map(['c1', 'c2'], ['c1']),
+                     table_map(['c1', 'c2', 'c3'], ['c1', 'c2']),
+                     Options()) == [
+        "ALTER TABLE t1\n    ADD COLUMN c3 integer",
+        "ALTER TABLE t1 DROP CONSTRAINT t1_pkey",
+        "ALTER TABLE t1 ADD CONSTRAINT t1_pkey PRIMARY KEY (c1, c2)"]
+
+
+def test_backfill_before_11():
+    "Refuse to output the batches filling a column before PostgreSQL 11"
+    options = Options()
+    options.online_columns = True
+    options.backfill_batch = 100
+    new_map = table_map(['c1'], ['c1'])
+    new_map['schema public']['table t1']['columns'].append(
+        {'c2': {'type': 'double precision', 'not_null': True,
+                'default': 'random()'}})
+    stmts = diff_maps(table_map(['c1'], ['c1']), new_map, options)
+    assert stmts[2].startswith("DO $$")
+    with pytest.raises(SystemExit) as exc:
+        diff_maps(table_map(['c1'], ['c1']), new_map, options, 100000)
+    assert "t1.c2" in str(exc.value)
+
+
+def test_coalesce_backfilled_columns():
+    "Merge the ALTER TABLEs around the statements filling a column"
+    options = Options()
+    options.online_columns = True
+    options.backfill_batch = 100
+    options.coalesce_alters = True
+    new_map = table_map(['c1'], ['c1'])
+    new_map['schema public']['table t1']['columns'].extend([
+        {'c2': {'type': 'double precision', 'not_null': True,
+                'default': 'random()'}}, {'c3': {'type': 'integer'}}])
+    stmts = diff_maps(table_map(['c1'], ['c1']), new_map, options, 120000)
+    assert stmts[0] == "ALTER TABLE t1\n    ADD COLUMN c2 double precision," \
+        "\n    ALTER COLUMN c2 SET DEFAULT random(),\n    ADD COLUMN c3 integer"
+    assert stmts[1].startswith("DO $$")
+    assert [stmt.phase for stmt in stmts[1:]] == ['post-transaction'] * 5
+
+
+def test_coalesce_quoted_table():
+    "Merge the ALTER TABLEs on a table whose name holds a double quote"
+    assert list(coalesce_alters([
+        'ALTER TABLE s1."t""1" ADD COLUMN c2 text',
+        'ALTER TABLE s1."t""1" ADD COLUMN c3 text'])) == [
+        'ALTER TABLE s1."t""1"\n    ADD COLUMN c2 text,'
+        '\n    ADD COLUMN c3 text']
+
+
+def test_backfill_check_name_taken():
+    "Number the CHECK used to set NOT NULL if its name is taken"
+    options = Options()
+    options.online_columns = True
+    options.backfill_batch = 100
+    old_map = table_map(['c1'], ['c1'])
+    old_map['schema public']['table t1']['check_constraints'] = {
+        't1_c2_not_null': {'columns': ['c1'], 'expression': '(c1 > 0)'}}
+    new_map = table_map(['c1'], ['c1'])
+    new_map['schema public']['table t1'].update(
+        check_constraints=old_map['schema public']['table t1'][
+            'check_constraints'])
+    new_map['schema public']['table t1']['columns'].append(
+        {'c2': {'type': 'double precision', 'not_null': True,
+                'default': 'random()'}})
+    stmts = diff_maps(old_map, new_map, options, 120000)
+    assert stmts[3:] == [
+        "ALTER TABLE t1 ADD CONSTRAINT t1_c2_not_null1 CHECK "
+        "(c2 IS NOT NULL) NOT VALID",
+        "ALTER TABLE t1 VALIDATE CONSTRAINT t1_c2_not_null1",
+        "ALTER TABLE t1 ALTER COLUMN c2 SET NOT NULL",
+        "ALTER TABLE t1 DROP CONSTRAINT t1_c2_not_null1"]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Test sharing the statements generated for identical databases"""
+
+import threading
+
+import pytest
+
+from pyrseas.yamlfanout import StatementCache
+
+
+def test_statements_reused():
+    "Generate the statements once for each fingerprint"
+    cache = StatementCache()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return ["CREATE TABLE t1 (c1 integer)"]
+
+    assert cache.get('fp1', generate) == (["CREATE TABLE t1 (c1 integer)"],
+                                          False)
+    assert cache.get('fp1', generate) == (["CREATE TABLE t1 (c1 integer)"],
+                                          True)
+    assert cache.get('fp2', generate)[1] is False
+    assert len(calls) == 2
+
+
+def test_statements_concurrent():
+    "Wait for the statements being generated for another database"
+    cache = StatementCache()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def generate():
+        started.set()
+        release.wait()
+        return ["DROP TABLE t1"]
+
+    def run():
+        results.append(cache.get('fp1', generate))
+
+    first = threading.Thread(target=run)
+    first.start()
+    started.wait()
+    second = threading.Thread(target=run)
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+    assert sorted(reused for (stmts, reused) in results) == [False, True]
+
+
+def test_statements_failed():
+    "Generate the statements again if generating them failed"
+    cache = StatementCache()
+
+    def fail():
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        cache.get('fp1', fail)
+    assert cache.get('fp1', lambda: []) == ([], False)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Test execution of the statements generated by yamltodb"""
+
+import sys
+
+import pytest
+
+from pyrseas.dbobject import NonTransactional, PreTransactional, Backfill
+from pyrseas import yamltodb
+from pyrseas.yamltodb import _batchable, _execute_batch, _execute_group
+from pyrseas.yamltodb import apply_levels, _record_applied
+from pyrseas.yamltodb import dry_run_apply, _report_timings, LOCKS_QUERY
+
+COMMENTS = ["COMMENT ON TABLE t%d IS 'Test table t%d'" % (i, i)
+            for i in range(1, 6)]
+COPY = ("\\copy ", "t1", " from '", "t1.data", "' csv")
+
+
+def batch(stmts):
+    return "SAVEPOINT pyrseas_batch;\n%s;\nRELEASE SAVEPOINT pyrseas_batch" \
+        % ";\n".join(stmts)
+
+
+class FakeCursor(object):
+    "Cursor executing the statements over its connection"
+
+    def __init__(self, dbconn):
+        self.dbconn = dbconn
+
+    def execute(self, query, args=None):
+        self.dbconn.execute(query, args)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    "Connection recording the statements, failing those mentioning 'bad'"
+
+    def __init__(self):
+        self.conn = self
+        self.closed = False
+        self.autocommit = False
+        self.executed = []
+        self.rollbacks = 0
+        self.locks = []
+        self.rows = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def execute(self, query, args=None):
+        self.executed.append(query)
+        if 'bad' in query:
+            raise RuntimeError('relation "bad" does not exist')
+        if query.startswith('ALTER TABLE t1 '):
+            self.locks.append(('t1', 'AccessExclusiveLock'))
+
+    def fetchone(self, query, args=None):
+        self.executed.append((query, args))
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self, query, args=None):
+        assert query == LOCKS_QUERY
+        return list(self.locks)
+
+    def copy_from(self, path, table):
+        self.executed.append(('copy', path, table))
+
+    def commit(self):
+        self.executed.append('COMMIT')
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_batchable():
+    "Batch only the statements executed in the transaction"
+    assert _batchable(COMMENTS[0])
+    assert _batchable("ALTER TABLE t1 ADD COLUMN c3 date")
+    assert not _batchable(NonTransactional(
+        "CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)"))
+    assert not _batchable(COPY)
+
+
+def test_batchable_planner():
+    "Leave out of the batches the statements executed with a lock timeout"
+    planner = object()
+    assert _batchable(COMMENTS[0], planner)
+    assert not _batchable("ALTER TABLE t1 ADD COLUMN c3 date", planner)
+
+
+def test_execute_batch():
+    "Send the statements of a batch together, after a savepoint"
+    dbconn = FakeConnection()
+    _execute_batch(dbconn, COMMENTS[:3])
+    assert dbconn.executed == [batch(COMMENTS[:3])]
+    _execute_batch(dbconn, COMMENTS[3:4])
+    assert dbconn.executed[1:] == [COMMENTS[3]]
+
+
+def test_execute_batch_error(capsys):
+    "Replay a failed batch to report the statement that failed"
+    dbconn = FakeConnection()
+    stmts = [COMMENTS[0], "COMMENT ON TABLE bad IS 'Test'", COMMENTS[1]]
+    with pytest.raises(RuntimeError):
+        _execute_batch(dbconn, stmts)
+    assert dbconn.executed == [batch(stmts),
+                               "ROLLBACK TO SAVEPOINT pyrseas_batch",
+                               stmts[0], stmts[1]]
+    assert dbconn.rollbacks == 1
+    assert capsys.readouterr().err == "Failed statement: %s\n" % stmts[1]
+
+
+def test_execute_group():
+    "Send a batch when full and before statements that cannot be batched"
+    dbconn = FakeConnection()
+    index = NonTransactional("CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)")
+    _execute_group(dbconn, COMMENTS[:2] + [index, COMMENTS[2], COPY] +
+                   COMMENTS[3:], batch_size=2)
+    assert dbconn.executed == [
+        batch(COMMENTS[:2]), 'COMMIT', index, COMMENTS[2],
+        ('copy', 't1.data', 't1'), batch(COMMENTS[3:])]
+    assert not dbconn.autocommit
+
+
+def test_execute_group_unbatched():
+    "Execute the statements one at a time with a batch size of one"
+    dbconn = FakeConnection()
+    _execute_group(dbconn, COMMENTS[:3])
+    assert dbconn.executed == COMMENTS[:3]
+
+
+def test_apply_levels_post_transaction(monkeypatch):
+    "Execute the statements outside the transaction after the level"
+    conns = []
+
+    class LevelConnection(FakeConnection):
+        def __init__(self, *args):
+            super(LevelConnection, self).__init__()
+            conns.append(self)
+
+        def connect(self):
+            pass
+
+        def close(self):
+            pass
+    monkeypatch.setattr(yamltodb, 'CatDbConnection', LevelConnection)
+    index = NonTransactional("CREATE INDEX CONCURRENTLY t1_idx ON t1 (c1)")
+    levels = [[[COMMENTS[0], index, COMMENTS[1]]], [[COMMENTS[2]]]]
+    assert apply_levels({'dbname': 'db', 'username': None, 'password': None,
+                         'host': None, 'port': None}, levels, 1) == 4
+    assert conns[0].executed == ['COMMIT', COMMENTS[0], COMMENTS[1],
+                                 'COMMIT', 'COMMIT', index, COMMENTS[2],
+                                 'COMMIT']
+
+
+def test_record_applied_error(capsys):
+    "Warn instead of failing if the update cannot be recorded"
+    class DeniedConnection(FakeConnection):
+        def execute(self, query, args=None):
+            raise RuntimeError("permission denied for database db\n")
+    _record_applied(DeniedConnection(), 'abc')
+    assert capsys.readouterr().err == "Warning: could not record the " \
+        "specification as applied: permission denied for database db\n"
+
+
+def test_dry_run_apply():
+    "Execute the statements in the transaction, recording the new locks"
+    dbconn = FakeConnection()
+    dbconn.rows = [(10, 10), (15, 5)]
+    backfill = Backfill("DO $$ ... $$")
+    (backfill.first, backfill.next) = ("SELECT first", "SELECT next")
+    stmts = ["ALTER TABLE t1 ADD COLUMN c3 date",
+             "ALTER TABLE t1 ALTER COLUMN c3 SET DEFAULT now()",
+             NonTransactional("CREATE UNIQUE INDEX CONCURRENTLY t1_idx "
+                              "ON t1 (c1)"),
+             NonTransactional("DROP INDEX CONCURRENTLY IF EXISTS t1_idx2"),
+             PreTransactional("ALTER TYPE t2 ADD VALUE 'black'"), backfill]
+    (results, error) = dry_run_apply(dbconn, stmts)
+    assert error is None
+    assert [stmt for (_, stmt, _) in results] == stmts
+    assert [locks for (_, _, locks) in results] == [
+        [('t1', 'AccessExclusiveLock')], [], [], [], [], []]
+    assert results[4][0] is None
+    assert dbconn.executed == stmts[:2] + [
+        "CREATE UNIQUE INDEX t1_idx ON t1 (c1)",
+        "DROP INDEX IF EXISTS t1_idx2", ("SELECT first", None),
+        ("SELECT next", (10, )), ("SELECT next", (15, ))]
+    assert dbconn.rollbacks == 2
+
+
+def test_dry_run_apply_error():
+    "Return the timings up to a failed statement and roll back"
+    dbconn = FakeConnection()
+    stmts = [COMMENTS[0], "COMMENT ON TABLE bad IS 'Test'", COMMENTS[1]]
+    (results, error) = dry_run_apply(dbconn, stmts)
+    assert isinstance(error, RuntimeError)
+    assert [stmt for (_, stmt, _) in results] == stmts[:1]
+    assert dbconn.executed == stmts[:2]
+    assert dbconn.rollbacks == 2
+
+
+def test_report_timings(capsys):
+    "Report the statements slowest first, then those not executed"
+    results = [(0.002, "ALTER TABLE t1\n    ADD COLUMN c3 date",
+                [('t1', 'AccessExclusiveLock')]),
+               (None, PreTransactional("ALTER TYPE t2 ADD VALUE 'black'"),
+                []),
+               (0.5, COPY, [('t1', 'RowExclusiveLock')]),
+               (0.0015, COMMENTS[0], [])]
+    _report_timings(results, RuntimeError("canceled"), sys.stdout)
+    assert capsys.readouterr().out.split('\n') == [
+        "   500.000 ms  \\copy t1 from 't1.data' csv",
+        "              RowExclusiveLock on t1",
+        "     2.000 ms  ALTER TABLE t1",
+        "              AccessExclusiveLock on t1",
+        "     1.500 ms  %s" % COMMENTS[0],
+        "   503.500 ms  total for 3 statements",
+        "Not executable in a dry run: ALTER TYPE t2 ADD VALUE 'black'",
+        "Statement failed: canceled", ""]